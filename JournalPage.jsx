@@ -47,7 +47,7 @@ const JournalPage = () => {
   const loadEntries = async () => {
     try {
       setIsLoading(true);
-      const data = await apiClient.getJournalEntries({ limit: 50 });
+      const data = await apiClient.getJournalEntries({ limit: 50, view: 'summary' });
       setEntries(data);
     } catch (error) {
       console.error('Failed to load journal entries:', error);
@@ -323,7 +323,7 @@ const JournalPage = () => {
                       <Button
                         variant="ghost"
                         size="sm"
-                        onClick={() => setEditingEntry(entry)}
+                        onClick={async () => setEditingEntry(await apiClient.getJournalEntry(entry.id))}
                         className="transition-smooth"
                       >
                         <Edit3 className="w-4 h-4" />
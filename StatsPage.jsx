@@ -31,7 +31,7 @@ const StatsPage = () => {
     try {
       setIsLoading(true);
       const [wellness, journal] = await Promise.all([
-        apiClient.getWellnessStats({ days: timeRange }),
+        apiClient.getWellnessStats({ days: timeRange, view: 'summary' }),
         apiClient.getJournalStats({ days: timeRange })
       ]);
       
@@ -0,0 +1,19 @@
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from src.data_versions import conditional_on
+from src import activity_calendar
+from datetime import date
+
+activity_bp = Blueprint('activity', __name__)
+
+@activity_bp.route('/calendar', methods=['GET'])
+@jwt_required()
+@conditional_on('wellness', 'journal')
+def get_calendar():
+    """Day bitmaps, day scores and streaks for the heatmap of one year"""
+    user_id = get_jwt_identity()
+    year = request.args.get('year', type=int, default=date.today().year)
+    if year < 1970 or year > date.today().year + 1:
+        return jsonify({'error': 'Invalid year'}), 400
+
+    return jsonify(activity_calendar.calendar_summary(int(user_id), year))
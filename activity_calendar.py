@@ -0,0 +1,286 @@
+"""
+Per-user activity calendars for streaks and the year heatmap.
+
+One activity_calendars row per user and year holds two day bitmaps, bit n
+being day n of the year counted from 0 on January 1st: days the wellness
+wheel was logged and days a journal entry was written. Next to them, one byte
+per day holds that day's average wheel score in tenths (0 = nothing logged).
+Streaks are bit operations on the bitmaps of all years joined into one
+integer, and a year's calendar fits in a few hundred bytes of JSON.
+
+The rows are kept current on write: every flush that adds, changes or deletes
+wellness or journal entries recomputes the affected days in the same
+transaction, from the hot and archived entries of those days only. Bulk
+writes outside the ORM call refresh_days(); `flask rebuild-calendars`
+recomputes users from scratch.
+"""
+import base64
+import calendar
+from datetime import date, datetime
+
+from sqlalchemy import event, func, inspect, select, insert, update, delete
+from src.models.user import db, WellnessEntry, JournalEntry
+from src.data_versions import bump_version
+from src import archive
+
+YEAR_DAYS = 366
+BITMAP_BYTES = (YEAR_DAYS + 7) // 8
+TRACKED_MODELS = (WellnessEntry, JournalEntry)
+
+
+class ActivityCalendar(db.Model):
+    __tablename__ = 'activity_calendars'
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    wheel_days = db.Column(db.LargeBinary, nullable=False)
+    journal_days = db.Column(db.LargeBinary, nullable=False)
+    scores = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def day_index(day):
+    return day.timetuple().tm_yday - 1
+
+
+def days_in_year(year):
+    return 366 if calendar.isleap(year) else 365
+
+
+def _unpack(row):
+    if row is None:
+        return 0, 0, bytearray(YEAR_DAYS)
+    return (
+        int.from_bytes(row.wheel_days, 'little'),
+        int.from_bytes(row.journal_days, 'little'),
+        bytearray(row.scores),
+    )
+
+
+def _pack(bits):
+    return bits.to_bytes(BITMAP_BYTES, 'little')
+
+
+def _with_bit(bits, index, on):
+    return bits | (1 << index) if on else bits & ~(1 << index)
+
+
+def _day_facts(connection, user_id, days):
+    """{day: (wheel count, average score)} and the set of journal days"""
+    wellness = WellnessEntry.__table__
+    journal = JournalEntry.__table__
+    wheel = {
+        day: (count, average)
+        for day, count, average in connection.execute(
+            select(wellness.c.entry_date, func.count(), func.avg(wellness.c.score))
+            .where(wellness.c.user_id == user_id, wellness.c.entry_date.in_(days))
+            .group_by(wellness.c.entry_date)
+        )
+    }
+    written = {
+        row[0] for row in connection.execute(
+            select(journal.c.entry_date)
+            .where(journal.c.user_id == user_id, journal.c.entry_date.in_(days))
+            .distinct()
+        )
+    }
+    return wheel, written
+
+
+def _write_year(connection, user_id, year, wheel_bits, journal_bits, scores, exists):
+    table = ActivityCalendar.__table__
+    values = {
+        'wheel_days': _pack(wheel_bits),
+        'journal_days': _pack(journal_bits),
+        'scores': bytes(scores),
+        'updated_at': datetime.utcnow(),
+    }
+    if exists:
+        connection.execute(
+            update(table).where(table.c.user_id == user_id, table.c.year == year).values(**values)
+        )
+    else:
+        connection.execute(insert(table).values(user_id=user_id, year=year, **values))
+
+
+def _with_archived(wheel, user_id, days):
+    """Add archived wellness rows of the days to {day: (count, average)}"""
+    wanted = set(days)
+    totals = {day: (count, float(average) * count) for day, (count, average) in wheel.items()}
+    for row in archive.read(user_id, 'wellness', days[0], days[-1]):
+        if row['entry_date'] in wanted:
+            count, total = totals.get(row['entry_date'], (0, 0.0))
+            totals[row['entry_date']] = (count + 1, total + row['score'])
+    return {day: (count, total / count) for day, (count, total) in totals.items()}
+
+
+def _refresh(connection, user_id, days):
+    table = ActivityCalendar.__table__
+    days = sorted(days)
+    wheel, written = _day_facts(connection, user_id, days)
+    # Days moved to the archive keep counting, as in rebuild_user
+    wheel = _with_archived(wheel, user_id, days)
+
+    for year in sorted({day.year for day in days}):
+        # Locked until commit on PostgreSQL, SQLite already holds its write lock
+        row = connection.execute(
+            select(table).where(table.c.user_id == user_id, table.c.year == year).with_for_update()
+        ).first()
+        wheel_bits, journal_bits, scores = _unpack(row)
+        for day in days:
+            if day.year != year:
+                continue
+            index = day_index(day)
+            count, average = wheel.get(day, (0, None))
+            wheel_bits = _with_bit(wheel_bits, index, count > 0)
+            journal_bits = _with_bit(journal_bits, index, day in written)
+            scores[index] = round(float(average) * 10) if count else 0
+        _write_year(connection, user_id, year, wheel_bits, journal_bits, scores, row is not None)
+
+
+def refresh_days(user_id, days):
+    """Recompute some days of a user after writes that bypass the ORM flush"""
+    if days:
+        connection = db.session.connection(bind_arguments={'mapper': ActivityCalendar})
+        _refresh(connection, int(user_id), days)
+
+
+def _changed_days(session):
+    changed = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, TRACKED_MODELS) or getattr(obj, 'user_id', None) is None:
+            continue
+        # A moved entry changes its old day as well
+        history = inspect(obj).attrs.entry_date.history
+        for day in [obj.entry_date, *history.deleted]:
+            if isinstance(day, date):
+                changed.add((int(obj.user_id), day))
+    return changed
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_days(session, flush_context, instances):
+    session.info.setdefault('changed_days', set()).update(_changed_days(session))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _refresh_changed_days(session, flush_context):
+    changed = session.info.pop('changed_days', None)
+    if not changed:
+        return
+
+    by_user = {}
+    for user_id, day in changed:
+        by_user.setdefault(user_id, set()).add(day)
+    # Routed like ActivityCalendar itself, which lives on the user's shard
+    connection = session.connection(bind_arguments={'mapper': ActivityCalendar})
+    for user_id, days in by_user.items():
+        _refresh(connection, user_id, days)
+
+
+def rebuild_user(user_id):
+    """Recompute all calendars of a user from hot and archived entries; commits"""
+    wellness = WellnessEntry.__table__
+    journal = JournalEntry.__table__
+    wheel = {}
+    for day, count, total in db.session.execute(
+        select(wellness.c.entry_date, func.count(), func.sum(wellness.c.score))
+        .where(wellness.c.user_id == user_id)
+        .group_by(wellness.c.entry_date)
+    ):
+        wheel[day] = (count, float(total))
+    for row in archive.read(user_id, 'wellness'):
+        count, total = wheel.get(row['entry_date'], (0, 0.0))
+        wheel[row['entry_date']] = (count + 1, total + row['score'])
+    written = {
+        row[0] for row in db.session.execute(
+            select(journal.c.entry_date).where(journal.c.user_id == user_id).distinct()
+        )
+    }
+
+    years = {}
+    for day in set(wheel) | written:
+        wheel_bits, journal_bits, scores = years.get(day.year) or _unpack(None)
+        index = day_index(day)
+        if day in wheel:
+            count, total = wheel[day]
+            wheel_bits |= 1 << index
+            scores[index] = round(total / count * 10)
+        if day in written:
+            journal_bits |= 1 << index
+        years[day.year] = (wheel_bits, journal_bits, scores)
+
+    table = ActivityCalendar.__table__
+    db.session.execute(delete(table).where(table.c.user_id == user_id))
+    connection = db.session.connection(bind_arguments={'mapper': ActivityCalendar})
+    for year, (wheel_bits, journal_bits, scores) in years.items():
+        _write_year(connection, user_id, year, wheel_bits, journal_bits, scores, exists=False)
+    # Cached calendar responses carry ETags of these scopes
+    bump_version(user_id, 'wellness')
+    bump_version(user_id, 'journal')
+    db.session.commit()
+    return len(years)
+
+
+def _joined(rows, first_year, last_year):
+    """Bitmaps of consecutive years joined into one integer per kind"""
+    wheel = journal = 0
+    offset = 0
+    for year in range(first_year, last_year + 1):
+        wheel_bits, journal_bits, _ = _unpack(rows.get(year))
+        wheel |= wheel_bits << offset
+        journal |= journal_bits << offset
+        offset += days_in_year(year)
+    return wheel, journal
+
+
+def _longest_run(bits):
+    run = 0
+    while bits:
+        bits &= bits >> 1
+        run += 1
+    return run
+
+
+def _run_ending_at(bits, index):
+    gaps = ~bits & ((1 << (index + 1)) - 1)
+    return index + 1 - gaps.bit_length()
+
+
+def _streaks(bits, today_index):
+    # A streak still counts while today is not logged yet
+    current = _run_ending_at(bits, today_index) or (_run_ending_at(bits, today_index - 1) if today_index else 0)
+    return {'current': current, 'longest': _longest_run(bits)}
+
+
+def _encode(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def calendar_summary(user_id, year, today=None):
+    """Bitmaps and day scores of one year with the user's streaks"""
+    today = today or date.today()
+    rows = {row.year: row for row in ActivityCalendar.query.filter_by(user_id=user_id).all()}
+    first_year = min([year, today.year, *rows])
+    last_year = max([year, today.year, *rows])
+    wheel, journal = _joined(rows, first_year, last_year)
+    today_index = sum(days_in_year(y) for y in range(first_year, today.year)) + day_index(today)
+
+    wheel_bits, journal_bits, scores = _unpack(rows.get(year))
+    return {
+        'year': year,
+        'days': days_in_year(year),
+        # Bit n of byte n // 8 (least significant first) is day n of the year
+        'wheel': _encode(_pack(wheel_bits)),
+        'journal': _encode(_pack(journal_bits)),
+        'scores': _encode(bytes(scores[:days_in_year(year)])),
+        'logged_days': {
+            'wheel': wheel_bits.bit_count(),
+            'journal': journal_bits.bit_count(),
+        },
+        'streaks': {
+            'wheel': _streaks(wheel, today_index),
+            'journal': _streaks(journal, today_index),
+            'any': _streaks(wheel | journal, today_index),
+        },
+    }
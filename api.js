@@ -3,6 +3,8 @@ const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:5000
 class ApiClient {
   constructor() {
     this.token = localStorage.getItem('access_token');
+    this.refreshToken = localStorage.getItem('refresh_token');
+    this.refreshPromise = null;
   }
 
   setToken(token) {
@@ -14,6 +16,45 @@ class ApiClient {
     }
   }
 
+  setRefreshToken(token) {
+    this.refreshToken = token;
+    if (token) {
+      localStorage.setItem('refresh_token', token);
+    } else {
+      localStorage.removeItem('refresh_token');
+    }
+  }
+
+  // Access tokens are short-lived; rotate the refresh token once for all concurrent callers
+  async refreshAccessToken() {
+    if (!this.refreshToken) {
+      return false;
+    }
+
+    if (!this.refreshPromise) {
+      this.refreshPromise = fetch(`${API_BASE_URL}/auth/refresh`, {
+        method: 'POST',
+        headers: { Authorization: `Bearer ${this.refreshToken}` },
+      })
+        .then(async (response) => {
+          if (!response.ok) {
+            this.setToken(null);
+            this.setRefreshToken(null);
+            return false;
+          }
+          const data = await response.json();
+          this.setToken(data.access_token);
+          this.setRefreshToken(data.refresh_token);
+          return true;
+        })
+        .finally(() => {
+          this.refreshPromise = null;
+        });
+    }
+
+    return await this.refreshPromise;
+  }
+
   getHeaders() {
     const headers = {
       'Content-Type': 'application/json',
@@ -26,7 +67,7 @@ class ApiClient {
     return headers;
   }
 
-  async request(endpoint, options = {}) {
+  async request(endpoint, options = {}, retry = true) {
     const url = `${API_BASE_URL}${endpoint}`;
     const config = {
       headers: this.getHeaders(),
@@ -35,6 +76,10 @@ class ApiClient {
 
     try {
       const response = await fetch(url, config);
+
+      if (response.status === 401 && retry && await this.refreshAccessToken()) {
+        return await this.request(endpoint, options, false);
+      }
       
       if (!response.ok) {
         const errorData = await response.json().catch(() => ({}));
@@ -62,6 +107,7 @@ class ApiClient {
     
     if (response.access_token) {
       this.setToken(response.access_token);
+      this.setRefreshToken(response.refresh_token);
     }
     
     return response;
@@ -72,8 +118,15 @@ class ApiClient {
   }
 
   async logout() {
-    await this.request('/auth/logout', { method: 'POST' });
-    this.setToken(null);
+    try {
+      await this.request('/auth/logout', {
+        method: 'POST',
+        body: JSON.stringify({ refresh_token: this.refreshToken }),
+      });
+    } finally {
+      this.setToken(null);
+      this.setRefreshToken(null);
+    }
   }
 
   // Wellness categories
@@ -145,6 +198,15 @@ class ApiClient {
     return await this.request(endpoint);
   }
 
+  async getJournalEntry(entryId) {
+    return await this.request(`/api/journal/${entryId}`);
+  }
+
+  async semanticSearchJournal(query, limit = 10) {
+    const queryString = new URLSearchParams({ q: query, limit }).toString();
+    return await this.request(`/api/journal/semantic?${queryString}`);
+  }
+
   async getTodayJournalEntries() {
     return await this.request('/api/journal/today');
   }
@@ -182,19 +244,24 @@ class ApiClient {
     return await this.request(endpoint);
   }
 
+  // Activity calendar: day bitmaps, scores and streaks of one year
+  async getCalendar(year = new Date().getFullYear()) {
+    return await this.request(`/api/calendar?year=${year}`);
+  }
+
   async getJournalTags() {
     return await this.request('/api/journal/tags');
   }
 
   // Inspiration endpoints
-  async getDailyInspiration() {
-    return await this.request('/api/inspiration/daily');
+  async getDailyInspiration(personalized = true) {
+    return await this.request(`/api/inspiration/daily?personalized=${personalized}`);
   }
 
-  async generateInspiration(type = 'daily_quote') {
+  async generateInspiration(type = 'daily_quote', personalized = true) {
     return await this.request('/api/inspiration/generate', {
       method: 'POST',
-      body: JSON.stringify({ type }),
+      body: JSON.stringify({ type, personalized }),
     });
   }
 
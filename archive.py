@@ -0,0 +1,350 @@
+"""
+Cold tier for old wellness entries and inspirations.
+
+Rows older than the archive horizon (KOLO_ARCHIVE_AFTER_DAYS, a year by
+default) are moved out of the hot tables by `flask archive-old` into one
+read-only partition per user, kind and year: a columnar file (one list per
+column, so similar values sit next to each other) compressed with the
+journal codecs, see src.journal_store. The archive_partitions table lists
+the partitions with their date range.
+
+archive_partitions lives on the user's shard, so pointing a partition at its
+new file and deleting the archived hot rows commit in one transaction and a
+row is never visible in both tiers. Partition files are never modified:
+adding rows to a year writes a new file and removes the old one afterwards.
+The unique index on wellness days only covers the hot table, so the API and
+the history import refuse scores for days that are already archived.
+
+List endpoints read across both tiers with read() and with_archive(); only
+partitions overlapping the requested date range are opened, newest first,
+and decoded files are cached per worker.
+"""
+import heapq
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select, delete
+from src.models.user import db, WellnessEntry, AIInspiration
+from src.journal_store import codecs
+from src import sharding
+
+ARCHIVE_DIR = os.getenv(
+    'KOLO_ARCHIVE_DIR',
+    os.path.join(os.path.dirname(__file__), 'database', 'archive')
+)
+ARCHIVE_AFTER_DAYS = int(os.getenv('KOLO_ARCHIVE_AFTER_DAYS', 365))
+FORMAT_VERSION = 1
+DELETE_BATCH = 500
+CACHED_PARTITIONS = 64
+
+# kind -> (model, date attribute)
+KINDS = {
+    'wellness': (WellnessEntry, 'entry_date'),
+    'inspiration': (AIInspiration, 'created_date'),
+}
+# Archived columns holding ids of sharded tables, remapped when a user moves
+REFERENCES = {
+    'wellness': {'id': 'wellness_entries', 'category_id': 'wellness_categories'},
+    'inspiration': {'id': 'ai_inspirations'},
+}
+
+
+class ArchivePartition(db.Model):
+    __tablename__ = 'archive_partitions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    path = db.Column(db.String(500), nullable=False)
+    codec = db.Column(db.String(20), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    min_date = db.Column(db.Date, nullable=False)
+    max_date = db.Column(db.Date, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('uq_archive_partitions_user_kind_year', 'user_id', 'kind', 'year', unique=True),
+    )
+
+
+def horizon(days=None, today=None):
+    """First date that stays in the hot tables"""
+    return (today or date.today()) - timedelta(days=ARCHIVE_AFTER_DAYS if days is None else days)
+
+
+def _columns(kind):
+    model, _ = KINDS[kind]
+    return list(model.__table__.columns)
+
+
+def _encode_value(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def _decoder(column):
+    if isinstance(column.type, db.DateTime):
+        return datetime.fromisoformat
+    if isinstance(column.type, db.Date):
+        return date.fromisoformat
+    return None
+
+
+def _encode(kind, rows):
+    """Columnar JSON of row dicts, compressed; returns (codec, data)"""
+    names = [column.key for column in _columns(kind)]
+    document = {
+        'version': FORMAT_VERSION,
+        'columns': {name: [_encode_value(row[name]) for row in rows] for name in names},
+    }
+    return codecs.compress(json.dumps(document, ensure_ascii=False, separators=(',', ':')))
+
+
+def _decode(kind, codec, data):
+    document = json.loads(codecs.decompress(codec, data))
+    columns = document['columns']
+    for column in _columns(kind):
+        decode = _decoder(column)
+        values = columns.get(column.key)
+        if values is None:
+            # Column added after the partition was written
+            columns[column.key] = [None] * len(next(iter(columns.values()), []))
+        elif decode is not None:
+            columns[column.key] = [decode(value) if value is not None else None for value in values]
+    return columns
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _load(kind, path, codec):
+    """Decoded columns of a partition file, cached, files never change"""
+    with _cache_lock:
+        if path in _cache:
+            _cache.move_to_end(path)
+            return _cache[path]
+    with open(path, 'rb') as f:
+        columns = _decode(kind, codec, f.read())
+    with _cache_lock:
+        _cache[path] = columns
+        while len(_cache) > CACHED_PARTITIONS:
+            _cache.popitem(last=False)
+    return columns
+
+
+def _rows(columns):
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def _write_file(kind, user_id, year, rows):
+    """Write a new partition file, returns (path, codec)"""
+    codec, data = _encode(kind, rows)
+    directory = os.path.join(ARCHIVE_DIR, kind, str(int(user_id)))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{year}-{uuid.uuid4().hex[:12]}.col')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path, codec
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _store_partition(kind, user_id, year, partition, rows, date_attr):
+    """Point the partition of a year at a new file with rows; returns the replaced path"""
+    path, codec = _write_file(kind, user_id, year, rows)
+    dates = [row[date_attr] for row in rows]
+    old_path = partition.path if partition is not None else None
+    if partition is None:
+        partition = ArchivePartition(user_id=user_id, kind=kind, year=year)
+        db.session.add(partition)
+    partition.path = path
+    partition.codec = codec
+    partition.row_count = len(rows)
+    partition.min_date = min(dates)
+    partition.max_date = max(dates)
+    partition.updated_at = datetime.utcnow()
+    return path, old_path
+
+
+def archive_user(user_id, before):
+    """Move a user's rows dated before `before` into archive partitions
+
+    Runs under using_user(user_id). Returns the number of archived rows.
+    """
+    archived = 0
+    for kind, (model, date_attr) in KINDS.items():
+        table = model.__table__
+        date_column = table.c[date_attr]
+        oldest = db.session.execute(
+            select(db.func.min(date_column)).where(table.c.user_id == user_id, date_column < before)
+        ).scalar()
+        if oldest is None:
+            continue
+
+        for year in range(oldest.year, before.year + 1):
+            end = min(before, date(year + 1, 1, 1))
+            rows = [dict(row) for row in db.session.execute(
+                select(table).where(
+                    table.c.user_id == user_id, date_column >= date(year, 1, 1), date_column < end
+                ).order_by(date_column, table.c.id)
+            ).mappings()]
+            if not rows:
+                continue
+
+            partition = ArchivePartition.query.filter_by(user_id=user_id, kind=kind, year=year).first()
+            merged = rows
+            if partition is not None:
+                merged = _rows(_load(kind, partition.path, partition.codec)) + rows
+                merged.sort(key=lambda row: (row[date_attr], row['id']))
+
+            new_path, old_path = _store_partition(kind, user_id, year, partition, merged, date_attr)
+            ids = [row['id'] for row in rows]
+            try:
+                for start in range(0, len(ids), DELETE_BATCH):
+                    db.session.execute(delete(table).where(table.c.id.in_(ids[start:start + DELETE_BATCH])))
+                # Partition and hot rows share the shard, both change in one transaction
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                _remove_file(new_path)
+                raise
+            if old_path:
+                _remove_file(old_path)
+            archived += len(rows)
+    return archived
+
+
+def drop_hot_days(user_id):
+    """Remove archived rows of days that are in the hot tables again
+
+    After a snapshot restore, days archived since the snapshot was taken are
+    back in the hot tables and the restored rows replace the archived ones.
+    Runs under using_user(user_id). Returns the number of removed rows.
+    """
+    removed = 0
+    for kind, (model, date_attr) in KINDS.items():
+        table = model.__table__
+        hot_days = {row[0] for row in db.session.execute(
+            select(table.c[date_attr]).where(table.c.user_id == user_id).distinct()
+        )}
+        if not hot_days:
+            continue
+
+        partitions = ArchivePartition.query.filter(
+            ArchivePartition.user_id == user_id, ArchivePartition.kind == kind,
+            ArchivePartition.max_date >= min(hot_days), ArchivePartition.min_date <= max(hot_days)
+        ).all()
+        for partition in partitions:
+            rows = _rows(_load(kind, partition.path, partition.codec))
+            kept = [row for row in rows if row[date_attr] not in hot_days]
+            if len(kept) == len(rows):
+                continue
+            new_path = None
+            old_path = partition.path
+            if kept:
+                new_path, old_path = _store_partition(kind, user_id, partition.year, partition, kept, date_attr)
+            else:
+                db.session.delete(partition)
+            try:
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                if new_path:
+                    _remove_file(new_path)
+                raise
+            _remove_file(old_path)
+            removed += len(rows) - len(kept)
+    return removed
+
+
+def read(user_id, kind, start=None, end=None, match=None, limit=None):
+    """Archived rows of a user as attribute dicts, newest first
+
+    start and end bound the date inclusively, match filters on attribute
+    values. With a limit, older partitions are not opened once enough rows
+    were found.
+    """
+    _, date_attr = KINDS[kind]
+    query = ArchivePartition.query.filter_by(user_id=user_id, kind=kind)
+    if start:
+        query = query.filter(ArchivePartition.max_date >= start)
+    if end:
+        query = query.filter(ArchivePartition.min_date <= end)
+
+    result = []
+    for partition in query.order_by(ArchivePartition.year.desc()).all():
+        columns = _load(kind, partition.path, partition.codec)
+        dates = columns[date_attr]
+        # Filter on the columns before building row dicts
+        keep = [
+            i for i, day in enumerate(dates)
+            if (not start or day >= start) and (not end or day <= end)
+            and all(columns[name][i] == value for name, value in (match or {}).items())
+        ]
+        names = list(columns)
+        rows = [{name: columns[name][i] for name in names} for i in keep]
+        rows.sort(key=lambda row: (row[date_attr], row['id']), reverse=True)
+        result.extend(rows)
+        if limit and len(result) >= limit:
+            break
+    return result[:limit] if limit else result
+
+
+def with_archive(projection, query, fields, archived, date_field, limit, full):
+    """Rows of a list endpoint from the hot query and archived rows, newest first
+
+    query must be ordered by date_field descending. full(instances) returns
+    the full representation of hot rows; archived rows always go through the
+    projection, with every field when none were requested.
+    """
+    if fields:
+        names = fields if date_field in fields else fields + [date_field]
+        hot = projection.fetch(query, names)
+    else:
+        names = list(projection.columns)
+        hot = full(query.all())
+    cold = [projection.project(row, names) for row in archived]
+
+    rows = list(heapq.merge(hot, cold, key=lambda row: row[date_field], reverse=True))[:limit]
+    if fields and date_field not in fields:
+        for row in rows:
+            row.pop(date_field, None)
+    return rows
+
+
+def _remap_moved_user(user_id, id_maps):
+    """Rewrite a moved user's partitions with the ids of the target shard"""
+    with sharding.using_user(user_id):
+        replaced = []
+        for partition in ArchivePartition.query.filter_by(user_id=user_id).all():
+            columns = _load(partition.kind, partition.path, partition.codec)
+            remapped = dict(columns)
+            for name, table_name in REFERENCES[partition.kind].items():
+                id_map = id_maps.get(table_name, {})
+                remapped[name] = [id_map.get(value, value) for value in columns[name]]
+            _, date_attr = KINDS[partition.kind]
+            _, old_path = _store_partition(
+                partition.kind, user_id, partition.year, partition, _rows(remapped), date_attr
+            )
+            replaced.append(old_path)
+        db.session.commit()
+    for path in replaced:
+        _remove_file(path)
+
+
+sharding.MOVE_HOOKS.append(_remap_moved_user)
@@ -0,0 +1,325 @@
+"""
+Online backups and per-user snapshots.
+
+Database backups use the SQLite online backup API: BACKUP_PAGES pages are
+copied per step and the source is released for BACKUP_SLEEP seconds between
+steps, so writers in other workers only ever wait for one short step. Each
+database (the default one and every SQLite shard) is copied into
+KOLO_BACKUP_DIR/<timestamp>/<name>.db and checked with PRAGMA quick_check.
+
+A backup restarts whenever another connection writes to the source, which
+under steady write traffic can keep a stepwise copy from ever finishing.
+After MAX_RESTARTS restarts the rest is copied in one step instead; in WAL
+mode that step only holds a read snapshot and still does not block writers.
+
+Data kept as files is copied next to the databases afterwards: archive
+partitions into archive/, trained zstd dictionaries into zstd-dicts/ and
+attachment blobs into attachments/, each mirroring its KOLO_*_DIR. These
+files are never modified, only added and removed, so copying them after the
+databases is consistent as long as every file the copied databases refer to
+is still there; backup_all checks that and fails otherwise. To restore,
+copy the databases and the three directories back in place.
+
+Per-user snapshots are standalone SQLite files with the user's rows of all
+per-user tables, read in one transaction so they show a single point in
+time. Restoring a snapshot replaces the user's wellness, journal and
+inspiration data on their current shard. Activity calendars are rebuilt and
+data versions bumped afterwards. Archived partitions are kept, with their
+ids rewritten by the move hooks to the restored rows' new ids. Days that were
+archived after the snapshot was taken come back as hot rows, and their
+archived copies are removed so no row is visible in both tiers.
+"""
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import create_engine, select, text
+from src.models.user import db
+from src import archive, journal_store, sharding
+
+BACKUP_DIR = os.getenv(
+    'KOLO_BACKUP_DIR',
+    os.path.join(os.path.dirname(__file__), 'database', 'backups')
+)
+BACKUP_PAGES = int(os.getenv('KOLO_BACKUP_PAGES', 256))
+BACKUP_SLEEP = float(os.getenv('KOLO_BACKUP_SLEEP_MS', 5)) / 1000
+MAX_RESTARTS = 5
+# Global tables with rows of one user, kept in snapshots for reference
+GLOBAL_USER_TABLES = ('users', 'reminders', 'push_subscriptions')
+# Derived or versioned per-user tables that a restore leaves as they are
+NOT_RESTORED = {'data_versions', 'archive_partitions', 'activity_calendars'}
+
+
+class _Restarted(Exception):
+    pass
+
+
+def sqlite_path(engine):
+    if engine.dialect.name != 'sqlite':
+        raise RuntimeError(f'Online backup needs SQLite, not {engine.dialect.name}')
+    return engine.url.database
+
+
+def backup_sqlite(source_path, target_path, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP):
+    """Copy a live SQLite database in page steps, returns statistics"""
+    tmp_path = target_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    source = sqlite3.connect(source_path, timeout=30)
+    target = sqlite3.connect(tmp_path)
+    stats = {'steps': 0, 'restarts': 0, 'pages': 0}
+    started = time.perf_counter()
+    try:
+        last_remaining = None
+
+        def progress(status, remaining, total):
+            stats['steps'] += 1
+            stats['pages'] = total
+            nonlocal last_remaining
+            if last_remaining is not None and remaining > last_remaining:
+                stats['restarts'] += 1
+                if stats['restarts'] >= MAX_RESTARTS:
+                    raise _Restarted()
+            last_remaining = remaining
+
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=sleep)
+        except _Restarted:
+            # Too busy for small steps, copy the rest from one read snapshot
+            source.backup(target, pages=-1)
+
+        check = target.execute('PRAGMA quick_check').fetchone()[0]
+        if check != 'ok':
+            raise RuntimeError(f'Backup of {source_path} failed its check: {check}')
+    finally:
+        target.close()
+        source.close()
+
+    os.replace(tmp_path, target_path)
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['bytes'] = os.path.getsize(target_path)
+    return stats
+
+
+def _file_trees():
+    """(backup subdirectory, source directory, keep(relative path)) of the data kept as files"""
+    return [
+        ('archive', archive.ARCHIVE_DIR, lambda path: path.endswith('.col')),
+        # The dictionary directory defaults to the database directory itself
+        ('zstd-dicts', journal_store.ZSTD_DICT_DIR,
+         lambda path: os.sep not in path and path.startswith('journal-cs') and path.endswith('.zdict')),
+        # Blobs sit in sha[:2]/sha[2:4]/sha, skip temporary files of running uploads
+        ('attachments', journal_store.ATTACHMENT_DIR, lambda path: path.count(os.sep) == 2),
+    ]
+
+
+def _copy_tree(source, target, keep):
+    """Copy the files of source that keep() accepts, returns their number"""
+    copied = 0
+    for root, _, names in os.walk(source):
+        for name in names:
+            relative = os.path.relpath(os.path.join(root, name), source)
+            if not keep(relative):
+                continue
+            destination = os.path.join(target, relative)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            try:
+                shutil.copy2(os.path.join(source, relative), destination)
+            except FileNotFoundError:
+                # Replaced since the walk, _missing_files() tells whether it mattered
+                continue
+            copied += 1
+    return copied
+
+
+def _missing_files(directory, database_path):
+    """Files a backed-up database refers to that are not in the backup"""
+    missing = []
+    connection = sqlite3.connect(database_path)
+    try:
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        codecs = set()
+        if 'archive_partitions' in tables:
+            for path, codec in connection.execute('SELECT path, codec FROM archive_partitions'):
+                codecs.add(codec)
+                if not os.path.exists(os.path.join(directory, 'archive', os.path.relpath(path, archive.ARCHIVE_DIR))):
+                    missing.append(path)
+        if 'journal_contents' in tables:
+            codecs.update(row[0] for row in connection.execute('SELECT DISTINCT codec FROM journal_contents'))
+        for codec in sorted(codec for codec in codecs if codec.startswith('zstd-')):
+            name = f"journal-cs-{codec[len('zstd-'):]}.zdict"
+            if not os.path.exists(os.path.join(directory, 'zstd-dicts', name)):
+                missing.append(os.path.join(journal_store.ZSTD_DICT_DIR, name))
+        if 'journal_attachments' in tables:
+            for (sha256,) in connection.execute('SELECT DISTINCT sha256 FROM journal_attachments'):
+                path = journal_store.attachment_path(sha256)
+                if not os.path.exists(os.path.join(directory, 'attachments', os.path.relpath(path, journal_store.ATTACHMENT_DIR))):
+                    missing.append(path)
+    finally:
+        connection.close()
+    return missing
+
+
+def backup_all(directory=None, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP, log=print):
+    """Back up the default database, every SQLite shard and the data kept as files
+
+    Returns the backup directory. Raises RuntimeError when a file a database
+    refers to could not be copied; running the backup again usually succeeds.
+    """
+    directory = directory or os.path.join(BACKUP_DIR, datetime.utcnow().strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(directory, exist_ok=True)
+    databases = []
+    for shard in sharding.shard_names():
+        engine = sharding.shard_engine(shard)
+        if engine.dialect.name != 'sqlite':
+            log(f'{shard}: skipped, not SQLite')
+            continue
+        target = os.path.join(directory, f'{shard}.db')
+        stats = backup_sqlite(sqlite_path(engine), target, pages, sleep)
+        databases.append(target)
+        rate = stats['bytes'] / stats['seconds'] / 1024 / 1024 if stats['seconds'] else 0
+        log(f"{shard}: {stats['bytes']} bytes in {stats['seconds']} s ({rate:.1f} MB/s), "
+            f"{stats['steps']} steps, {stats['restarts']} restarts")
+
+    # After the databases, so every file they refer to was written before
+    for name, source, keep in _file_trees():
+        if not os.path.isdir(source):
+            log(f'{name}: skipped, {source} does not exist')
+            continue
+        log(f'{name}: {_copy_tree(source, os.path.join(directory, name), keep)} files')
+
+    missing = [path for database in databases for path in _missing_files(directory, database)]
+    if missing:
+        raise RuntimeError(f'Backup in {directory} is incomplete, missing {len(missing)} files: '
+                           + ', '.join(missing[:10]))
+    return directory
+
+
+@contextmanager
+def _consistent_reads(engine):
+    """Connection whose reads all see one point in time"""
+    with engine.connect() as connection:
+        if engine.dialect.name == 'sqlite':
+            # pysqlite only begins transactions before writes, start the read one explicitly
+            connection.exec_driver_sql('BEGIN')
+        else:
+            connection = connection.execution_options(isolation_level='REPEATABLE READ')
+        try:
+            yield connection
+        finally:
+            connection.rollback()
+
+
+def _global_tables():
+    return [db.metadata.tables[name] for name in GLOBAL_USER_TABLES if name in db.metadata.tables]
+
+
+def snapshot_user(user_id, path):
+    """Write a user's rows into a standalone SQLite file, returns rows per table"""
+    user_id = int(user_id)
+    shard, _ = sharding.directory.lookup(user_id)
+    if os.path.exists(path):
+        raise RuntimeError(f'{path} already exists')
+    tables = sharding.sharded_tables()
+    counts = {}
+
+    snapshot = create_engine(f'sqlite:///{path}')
+    try:
+        db.metadata.create_all(snapshot, tables=tables + _global_tables())
+        with snapshot.begin() as target:
+            target.execute(text('CREATE TABLE snapshot_info (key TEXT PRIMARY KEY, value TEXT)'))
+            target.execute(text('INSERT INTO snapshot_info VALUES (:key, :value)'), [
+                {'key': 'user_id', 'value': str(user_id)},
+                {'key': 'shard', 'value': shard},
+                {'key': 'taken_at', 'value': datetime.utcnow().isoformat()},
+            ])
+            with _consistent_reads(sharding.shard_engine(shard)) as source:
+                for table in tables:
+                    rows = source.execute(select(table).where(sharding.user_filter(table, user_id))).mappings().all()
+                    if rows:
+                        target.execute(table.insert(), [dict(row) for row in rows])
+                    counts[table.name] = len(rows)
+            with db.engine.connect() as source:
+                for table in _global_tables():
+                    column = table.c.id if table.name == 'users' else table.c.user_id
+                    rows = source.execute(select(table).where(column == user_id)).mappings().all()
+                    if rows:
+                        target.execute(table.insert(), [dict(row) for row in rows])
+                    counts[table.name] = len(rows)
+    finally:
+        snapshot.dispose()
+    return counts
+
+
+def snapshot_info(path):
+    snapshot = create_engine(f'sqlite:///{path}')
+    try:
+        with snapshot.connect() as connection:
+            return dict(connection.execute(text('SELECT key, value FROM snapshot_info')).all())
+    finally:
+        snapshot.dispose()
+
+
+def _categories(connection, user_id):
+    table = db.metadata.tables['wellness_categories']
+    return connection.execute(select(table.c.id, table.c.name).where(table.c.user_id == user_id)).all()
+
+
+def _by_name(live, snapshot, id_map):
+    """{live category id: restored id} of categories with the same name"""
+    restored = {}
+    for old_id, name in snapshot:
+        restored.setdefault(name, id_map.get(old_id))
+    return {live_id: restored[name] for live_id, name in live if restored.get(name) is not None}
+
+
+def restore_user(path, user_id=None, log=print):
+    """Replace a user's data with a snapshot, returns the number of restored rows
+
+    Their requests get 503 for a few seconds meanwhile. Rows get fresh ids,
+    so the snapshot also restores onto another shard after a move.
+    """
+    from src import activity_calendar, semantic_index
+    from src.data_versions import bump_version
+
+    info = snapshot_info(path)
+    user_id = int(user_id or info['user_id'])
+    if user_id != int(info['user_id']):
+        raise RuntimeError(f"The snapshot belongs to user {info['user_id']}")
+    tables = [table for table in sharding.sharded_tables() if table.name not in NOT_RESTORED]
+
+    snapshot = create_engine(f'sqlite:///{path}')
+    try:
+        with sharding.paused_user(user_id) as shard:
+            with snapshot.connect() as source, sharding.shard_engine(shard).begin() as target:
+                live_categories = _categories(target, user_id)
+                sharding.delete_user_rows(target, user_id, tables)
+                restored, id_maps = sharding.copy_user_rows(source, target, user_id, tables, log=log)
+                # Archived rows carry ids of the live rows, which match the snapshot's
+                # only on the same shard; categories created since are matched by name
+                categories = _by_name(live_categories, _categories(source, user_id),
+                                      id_maps.get('wellness_categories', {}))
+                if shard == info['shard']:
+                    categories.update(id_maps.get('wellness_categories', {}))
+                    id_maps['wellness_categories'] = categories
+                else:
+                    id_maps = {'wellness_categories': categories}
+    finally:
+        snapshot.dispose()
+
+    # Archived rows still point at the replaced ids, same as after a move
+    for hook in sharding.MOVE_HOOKS:
+        hook(user_id, id_maps)
+
+    with sharding.using_user(user_id):
+        dropped = archive.drop_hot_days(user_id)
+        if dropped:
+            log(f'archive: {dropped} rows of restored days removed')
+        bump_version(user_id, 'inspiration')
+        activity_calendar.rebuild_user(user_id)
+    # Entry ids changed, the next search rebuilds the index
+    semantic_index.drop_user(user_id)
+    return restored
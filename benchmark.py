@@ -0,0 +1,845 @@
+"""
+Benchmark suite for the Kolo Pohody API.
+
+Seeds a synthetic dataset into a throwaway SQLite database, starts a local
+stub LLM server and drives a realistic traffic mix against the Flask app.
+Reports p50/p95/p99 latency and throughput per endpoint and compares the
+results with the stored baseline.
+
+Usage:
+    python src/benchmark.py                    # run and compare with baseline
+    python src/benchmark.py --update-baseline  # run and store a new baseline
+    python src/benchmark.py --compare-serving  # sync vs gthread vs gevent under a slow LLM
+    python src/benchmark.py --startup          # worker import time and RSS, lazy vs eager imports
+    python src/benchmark.py --push-throughput  # web push fan-out against a stub push service
+    python src/benchmark.py --push-check       # check fan-out results and retry backoff, exits 1 on failure
+    python src/benchmark.py --identity-check   # check OAuth metadata caching and Graph calls against a stub
+    python src/benchmark.py --backup           # online backup throughput and its cost for writers
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# DON'T CHANGE THIS !!!
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+SEARCH_TERMS = ['radost', 'procházka', 'káva', 'klid', 'rodina', 'les', 'práce', 'spánek']
+
+JOURNAL_SENTENCES = [
+    'Dnes ráno jsem si dal kávu na balkoně a poslouchal ptáky.',
+    'Procházka lesem mi pomohla vyčistit hlavu po náročném dni v práci.',
+    'Večer s rodinou u společné večeře byl plný smíchu.',
+    'Cítím klid a vděčnost za malé radosti dne.',
+    'Konečně jsem se pořádně vyspal a mám energii.',
+    'Přečetl jsem pár stránek knihy, kterou mám rozečtenou už měsíc.',
+]
+
+JOURNAL_TAGS = ['radost', 'příroda', 'rodina', 'práce', 'klid', 'sport', 'jídlo']
+
+# Each scenario is a sequence of requests issued by one simulated page view.
+TRAFFIC_MIX = {
+    'dashboard': 50,
+    'wheel_save': 20,
+    'journal_search': 15,
+    'stats_page': 15,
+}
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible chat completions endpoint"""
+
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if self.latency:
+            time.sleep(self.latency)
+
+        body = json.dumps({
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': 'stub',
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': 'Malé kroky vedou k velkým změnám.'},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 10, 'completion_tokens': 10, 'total_tokens': 20}
+        }).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_llm(latency_ms=0):
+    """Start the stub LLM server on a free local port and return it"""
+    handler = type('Handler', (StubLLMHandler,), {'latency': latency_ms / 1000.0})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+class StubPushHandler(BaseHTTPRequestHandler):
+    """Push service stub: every 50th endpoint is gone, every 20th fails once with 503, /down always fails"""
+
+    # Keep-alive, so the benchmark measures connection reuse like a real push service
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    failed_once = set()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if self.latency:
+            time.sleep(self.latency)
+
+        headers = {}
+        if self.path.endswith('/down'):
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        number = int(self.path.rsplit('/', 1)[-1])
+        if number % 50 == 0:
+            status = 410
+        else:
+            status = 201
+            if number % 20 == 7:
+                with self.lock:
+                    if number not in self.failed_once:
+                        self.failed_once.add(number)
+                        status = 503
+                        headers['Retry-After'] = '1'
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_push(latency_ms=0):
+    """Start the stub push service on a free local port and return it"""
+    handler = type('Handler', (StubPushHandler,), {
+        'latency': latency_ms / 1000.0, 'failed_once': set(), 'lock': threading.Lock()
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+class StubIdentityHandler(BaseHTTPRequestHandler):
+    """OpenID discovery, JWKS and Microsoft Graph /me of a fake identity provider"""
+
+    protocol_version = 'HTTP/1.1'
+    token = 'stub-access-token'
+    calls = None
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.calls[self.path] = self.calls.get(self.path, 0) + 1
+        base = f'http://127.0.0.1:{self.server.server_address[1]}'
+        status = 200
+        if self.path == '/.well-known/openid-configuration':
+            body = {
+                'issuer': base,
+                'authorization_endpoint': f'{base}/authorize',
+                'token_endpoint': f'{base}/token',
+                'userinfo_endpoint': f'{base}/userinfo',
+                'jwks_uri': f'{base}/jwks',
+            }
+        elif self.path == '/jwks':
+            body = {'keys': [{'kty': 'RSA', 'kid': 'stub', 'use': 'sig', 'alg': 'RS256', 'n': 'sXch', 'e': 'AQAB'}]}
+        elif self.path == '/v1.0/me' and self.headers.get('Authorization') == f'Bearer {self.token}':
+            body = {'id': 'stub-id', 'mail': 'stub@example.com', 'displayName': 'Stub Uživatel'}
+        elif self.path == '/v1.0/me':
+            status, body = 401, {'error': 'invalid token'}
+        else:
+            status, body = 404, {'error': 'not found'}
+
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_identity():
+    """Start the stub identity provider on a free local port and return it"""
+    handler = type('Handler', (StubIdentityHandler,), {'calls': {}, 'lock': threading.Lock()})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def check_identity_providers():
+    """Check provider metadata caching and Graph calls against the stub identity provider
+
+    Wires the stub in through the same environment variables a deployment
+    would use, so it runs before the app is imported. Returns an exit code.
+    """
+    server = start_stub_identity()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    os.environ['GOOGLE_METADATA_URL'] = f'{base}/.well-known/openid-configuration'
+    os.environ['MICROSOFT_AUTHORITY'] = base
+    os.environ['MICROSOFT_GRAPH_URL'] = f'{base}/v1.0'
+    from src.identity_providers import google_metadata, fetch_microsoft_profile, microsoft_url
+
+    calls = server.RequestHandlerClass.calls
+    errors = []
+
+    def expect(condition, message):
+        if not condition:
+            errors.append(message)
+
+    # A login burst on a cold worker shares one discovery and one JWKS fetch
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(lambda _: google_metadata.get(), range(16)))
+    expect(all(result is results[0] for result in results), 'concurrent logins got different metadata objects')
+    expect(results[0].get('jwks', {}).get('keys', [{}])[0].get('kid') == 'stub', 'JWKS was not loaded with the metadata')
+    expect(calls.get('/.well-known/openid-configuration') == 1,
+           f"{calls.get('/.well-known/openid-configuration')} discovery fetches, expected 1")
+    expect(calls.get('/jwks') == 1, f"{calls.get('/jwks')} JWKS fetches, expected 1")
+
+    # Cached until the TTL, refetched on demand (unknown key id)
+    google_metadata.get()
+    google_metadata.get(force=True)
+    expect(calls.get('/.well-known/openid-configuration') == 2,
+           f"{calls.get('/.well-known/openid-configuration')} discovery fetches after a forced refresh, expected 2")
+
+    expect(microsoft_url('common', 'token') == f'{base}/common/oauth2/v2.0/token', 'MICROSOFT_AUTHORITY is not used')
+    profile = fetch_microsoft_profile(StubIdentityHandler.token)
+    expect(profile.get('mail') == 'stub@example.com', f'unexpected Graph profile {profile}')
+    try:
+        fetch_microsoft_profile('wrong-token')
+        errors.append('Graph call with a wrong token did not fail')
+    except Exception:
+        pass
+
+    server.shutdown()
+    print(f'Identity provider calls: {dict(sorted(calls.items()))}')
+    for message in errors:
+        print(f'ERROR {message}')
+    return 1 if errors else 0
+
+
+def measure_push_throughput(app, subscriptions, latency_ms, levels=(1, 8, 32)):
+    """Fan out one message per subscription at several concurrency levels"""
+    from src.models.user import db
+    from src.push_delivery import PushSubscription, FanOut, send_to_users
+
+    users = max(1, subscriptions // 2)
+    for concurrency in levels:
+        server = start_stub_push(latency_ms)
+        base = f'http://127.0.0.1:{server.server_address[1]}/push'
+        with app.app_context():
+            PushSubscription.query.delete()
+            db.session.bulk_insert_mappings(PushSubscription, [
+                {'user_id': number % users + 1, 'endpoint': f'{base}/{number}', 'p256dh': 'stub', 'auth': 'stub'}
+                for number in range(1, subscriptions + 1)
+            ])
+            db.session.commit()
+
+            stats = send_to_users({user_id: {'title': 'benchmark', 'body': 'x'} for user_id in range(1, users + 1)},
+                                  fanout=FanOut(concurrency=concurrency))
+            remaining = PushSubscription.query.count()
+        server.shutdown()
+
+        expected_gone = subscriptions // 50
+        print(f"concurrency {concurrency:>3}: {stats['sent']} sent in {stats['seconds']} s "
+              f"({round(stats['sent'] / stats['seconds']) if stats['seconds'] else 0} msg/s), "
+              f"{stats['retried']} retried, {stats['gone']} pruned, {stats['failed']} failed")
+        if stats['gone'] != expected_gone or remaining != subscriptions - expected_gone:
+            print(f'ERROR expected {expected_gone} pruned subscriptions, {subscriptions - remaining} were removed')
+            return 1
+    return 0
+
+
+def check_push_fanout(count=200, concurrency=8, max_attempts=3):
+    """Check FanOut results and retry scheduling against the stub push service, returns an exit code"""
+    from src.push_delivery import FanOut, send_one, RETRY_BASE_SECONDS
+
+    server = start_stub_push()
+    base = f'http://127.0.0.1:{server.server_address[1]}/push'
+    attempts = {}
+    lock = threading.Lock()
+
+    def sender(subscription, payload):
+        result = send_one(subscription, payload)
+        with lock:
+            attempts.setdefault(subscription['endpoint'], []).append(time.monotonic())
+        return result
+
+    keys = {'p256dh': 'stub', 'auth': 'stub'}
+    messages = [(number, {'endpoint': f'{base}/{number}', 'keys': keys}, {'title': 'check'})
+                for number in range(1, count + 1)]
+    messages.append((0, {'endpoint': f'{base}/down', 'keys': keys}, {'title': 'check'}))
+    fanout = FanOut(concurrency=concurrency, max_attempts=max_attempts, sender=sender)
+    stats = fanout.run(messages)
+    server.shutdown()
+
+    numbers = set(range(1, count + 1))
+    gone = {number for number in numbers if number % 50 == 0}
+    flaky = {number for number in numbers if number % 20 == 7}
+    errors = []
+
+    def expect(condition, message):
+        if not condition:
+            errors.append(message)
+
+    expect(sorted(fanout.gone_ids) == sorted(gone), f'gone ids {sorted(fanout.gone_ids)}, expected {sorted(gone)}')
+    expect(sorted(fanout.delivered_ids) == sorted(numbers - gone), 'delivered ids differ from the live endpoints')
+    expect(stats['sent'] == len(numbers - gone), f"{stats['sent']} sent, expected {len(numbers - gone)}")
+    # Flaky endpoints retry once, /down until max_attempts
+    expect(stats['retried'] == len(flaky) + max_attempts - 1,
+           f"{stats['retried']} retries, expected {len(flaky) + max_attempts - 1}")
+    expect(stats['failed'] == 1, f"{stats['failed']} failed, expected only /down")
+
+    for number in numbers:
+        times = attempts.get(f'{base}/{number}', [])
+        expected = 2 if number in flaky else 1
+        expect(len(times) == expected, f'endpoint {number} was called {len(times)} times, expected {expected}')
+        # The stub answers Retry-After: 1
+        if number in flaky and len(times) == 2:
+            expect(times[1] - times[0] >= 0.95, f'endpoint {number} was retried after {times[1] - times[0]:.2f} s')
+
+    # Exponential backoff without Retry-After: 1 s, then 2 s
+    down = attempts.get(f'{base}/down', [])
+    expect(len(down) == max_attempts, f'/down was called {len(down)} times, expected {max_attempts}')
+    for attempt, (earlier, later) in enumerate(zip(down, down[1:])):
+        delay = RETRY_BASE_SECONDS * 2 ** attempt
+        expect(later - earlier >= delay - 0.05, f'/down attempt {attempt + 2} came {later - earlier:.2f} s after the previous one, expected {delay} s')
+
+    print(f"{stats['sent']} sent, {stats['retried']} retried, {stats['gone']} gone, {stats['failed']} failed "
+          f"in {stats['seconds']} s")
+    for message in errors:
+        print(f'ERROR {message}')
+    return 1 if errors else 0
+
+
+def measure_backup(app, fixtures, database_path, writers=4, levels=(64, 1024, -1), idle_seconds=5):
+    """Online backup throughput and the latency it adds to concurrent wheel saves"""
+    from src.backup import backup_sqlite, BACKUP_SLEEP
+
+    def run_writers(until):
+        """Save wheel entries from several threads until until() is true, returns sorted latencies"""
+        latencies = []
+        lock = threading.Lock()
+
+        def writer(index):
+            client = app.test_client()
+            rng = random.Random(index)
+            fixture = fixtures[index % len(fixtures)]
+            headers = {'Authorization': f"Bearer {fixture['token']}"}
+            while not until():
+                started = time.perf_counter()
+                client.post('/api/entries', headers=headers, json={
+                    'category_id': rng.choice(fixture['category_ids']),
+                    'score': rng.randint(1, 10),
+                    'entry_date': date.today().isoformat(),
+                    'note': ''
+                })
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=writer, args=(index,)) for index in range(writers)]
+        for thread in threads:
+            thread.start()
+        return threads, latencies
+
+    def describe(latencies):
+        latencies.sort()
+        return (f"{len(latencies):>6} writes  p50 {percentile(latencies, 50) * 1000:>7.2f} ms  "
+                f"p99 {percentile(latencies, 99) * 1000:>7.2f} ms  max {(latencies[-1] if latencies else 0) * 1000:>7.2f} ms")
+
+    deadline = time.monotonic() + idle_seconds
+    threads, latencies = run_writers(lambda: time.monotonic() > deadline)
+    for thread in threads:
+        thread.join()
+    print(f"{'no backup':<16}{describe(latencies)}")
+
+    target = database_path + '.backup'
+    for pages in levels:
+        done = threading.Event()
+        threads, latencies = run_writers(done.is_set)
+        try:
+            stats = backup_sqlite(database_path, target, pages=pages, sleep=BACKUP_SLEEP)
+        finally:
+            done.set()
+            for thread in threads:
+                thread.join()
+        rate = stats['bytes'] / stats['seconds'] / 1024 / 1024 if stats['seconds'] else 0
+        label = 'one step' if pages < 0 else f'{pages} pages/step'
+        print(f"{label:<16}{describe(latencies)}  backup {rate:>6.1f} MB/s in {stats['seconds']} s, "
+              f"{stats['steps']} steps, {stats['restarts']} restarts")
+        os.remove(target)
+    return 0
+
+
+def seed_dataset(app, users, years, journal_per_user, seed):
+    """Create users with default categories, wellness history and journal entries"""
+    from src.models.user import db, User, WellnessCategory, WellnessEntry, JournalEntry
+    from src.routes.auth import create_default_categories
+    from flask_jwt_extended import create_access_token
+
+    rng = random.Random(seed)
+    today = date.today()
+    days = 365 * years
+    fixtures = []
+
+    with app.app_context():
+        for n in range(users):
+            user = User(
+                email=f'bench{n}@example.com',
+                name=f'Bench User {n}',
+                provider='demo',
+                provider_id=f'bench_{n}',
+                avatar_url=None
+            )
+            db.session.add(user)
+            db.session.commit()
+            create_default_categories(user.id)
+
+            category_ids = [c.id for c in WellnessCategory.query.filter_by(user_id=user.id).all()]
+
+            wellness_rows = []
+            for offset in range(1, days + 1):
+                entry_date = today - timedelta(days=offset)
+                for category_id in category_ids:
+                    wellness_rows.append({
+                        'user_id': user.id,
+                        'category_id': category_id,
+                        'score': rng.randint(1, 10),
+                        'note': rng.choice(JOURNAL_SENTENCES) if rng.random() < 0.3 else '',
+                        'entry_date': entry_date,
+                        'created_at': datetime.utcnow(),
+                        'updated_at': datetime.utcnow()
+                    })
+            db.session.execute(WellnessEntry.__table__.insert(), wellness_rows)
+
+            journal_rows = []
+            for _ in range(journal_per_user):
+                entry_date = today - timedelta(days=rng.randint(0, days))
+                journal_rows.append({
+                    'user_id': user.id,
+                    'title': rng.choice(JOURNAL_SENTENCES)[:40],
+                    'content': ' '.join(rng.choice(JOURNAL_SENTENCES) for _ in range(rng.randint(2, 12))),
+                    'entry_date': entry_date,
+                    'is_private': rng.random() < 0.2,
+                    'tags': json.dumps(rng.sample(JOURNAL_TAGS, rng.randint(0, 3))),
+                    'created_at': datetime.utcnow(),
+                    'updated_at': datetime.utcnow()
+                })
+            db.session.execute(JournalEntry.__table__.insert(), journal_rows)
+            db.session.commit()
+
+            fixtures.append({
+                'token': create_access_token(identity=user.id),
+                'category_ids': category_ids
+            })
+
+    return fixtures
+
+
+def build_scenario(name, fixture, rng):
+    """Return the list of (label, method, url, json) requests of one scenario"""
+    if name == 'dashboard':
+        return [
+            ('GET /api/categories', 'GET', '/api/categories', None),
+            ('GET /api/entries/today', 'GET', '/api/entries/today', None),
+            ('GET /api/inspiration/daily', 'GET', '/api/inspiration/daily', None),
+        ]
+    if name == 'wheel_save':
+        return [
+            ('POST /api/entries', 'POST', '/api/entries', {
+                'category_id': rng.choice(fixture['category_ids']),
+                'score': rng.randint(1, 10),
+                'entry_date': date.today().isoformat(),
+                'note': ''
+            }),
+            ('GET /api/entries/today', 'GET', '/api/entries/today', None),
+        ]
+    if name == 'journal_search':
+        return [
+            ('GET /api/journal?search', 'GET', f'/api/journal?search={urllib.parse.quote(rng.choice(SEARCH_TERMS))}', None),
+        ]
+    if name == 'stats_page':
+        days = rng.choice([7, 30, 365])
+        return [
+            ('GET /api/stats', 'GET', f'/api/stats?days={days}', None),
+            ('GET /api/journal/stats', 'GET', f'/api/journal/stats?days={days}', None),
+        ]
+    raise ValueError(f'Unknown scenario: {name}')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def run_traffic(app, fixtures, scenarios, concurrency, seed):
+    """Drive the scenarios against the app and collect per-endpoint timings"""
+    samples = {}
+    errors = {}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def worker(index):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        rng = random.Random(seed + index)
+        fixture = fixtures[index % len(fixtures)]
+        headers = {'Authorization': f"Bearer {fixture['token']}"}
+
+        for label, method, url, payload in build_scenario(scenarios[index], fixture, rng):
+            started = time.perf_counter()
+            response = local.client.open(url, method=method, json=payload, headers=headers)
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples.setdefault(label, []).append(elapsed)
+                if response.status_code >= 400:
+                    errors[label] = errors.get(label, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(len(scenarios))))
+    wall_time = time.perf_counter() - started
+
+    report = {}
+    for label, values in sorted(samples.items()):
+        values.sort()
+        report[label] = {
+            'count': len(values),
+            'errors': errors.get(label, 0),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'throughput_rps': round(len(values) / wall_time, 1)
+        }
+    return report
+
+
+def pick_scenarios(count, seed):
+    """Draw a reproducible sequence of scenarios following TRAFFIC_MIX"""
+    rng = random.Random(seed)
+    names = list(TRAFFIC_MIX)
+    weights = [TRAFFIC_MIX[name] for name in names]
+    return rng.choices(names, weights=weights, k=count)
+
+
+def print_report(report):
+    print(f"{'endpoint':<32}{'count':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}")
+    for label, row in report.items():
+        print(f"{label:<32}{row['count']:>7}{row['errors']:>5}{row['p50_ms']:>10}"
+              f"{row['p95_ms']:>10}{row['p99_ms']:>10}{row['throughput_rps']:>9}")
+
+
+def compare_with_baseline(report, config, tolerance):
+    """Return a list of regression messages against the stored baseline
+
+    Without a baseline there is nothing to compare and only a warning is
+    printed. A baseline recorded with another configuration fails the run.
+    """
+    if not os.path.exists(BASELINE_PATH):
+        print(f'WARNING no baseline at {BASELINE_PATH}, nothing compared. Run with --update-baseline '
+              'on the reference machine and commit it.')
+        return []
+
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+
+    if baseline.get('config') != config:
+        return [f"baseline was recorded with {baseline.get('config')}, this run used {config}"]
+
+    regressions = []
+    for label, row in report.items():
+        expected = baseline['endpoints'].get(label)
+        if not expected:
+            continue
+        for metric in ('p95_ms', 'p99_ms'):
+            limit = expected[metric] * (1 + tolerance)
+            if row[metric] > limit:
+                regressions.append(f'{label}: {metric} {row[metric]} > {round(limit, 2)} (baseline {expected[metric]})')
+        if row['errors'] > expected['errors']:
+            regressions.append(f"{label}: {row['errors']} errors (baseline {expected['errors']})")
+    return regressions
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_health(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f'{base_url}/health', timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def fire_slow_requests(base_url, token, count, concurrency):
+    """Issue LLM-bound requests over real HTTP and return latency stats"""
+    latencies = []
+    failures = [0]
+    lock = threading.Lock()
+
+    def call(_):
+        request = urllib.request.Request(
+            f'{base_url}/api/inspiration/generate',
+            data=json.dumps({'type': 'wellness_tip'}).encode('utf-8'),
+            headers={'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'},
+            method='POST'
+        )
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+        except OSError:
+            with lock:
+                failures[0] += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, range(count)))
+    wall_time = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'ok': len(latencies),
+        'failed': failures[0],
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'throughput_rps': round(len(latencies) / wall_time, 1)
+    }
+
+
+def compare_serving(args, app, fixtures):
+    """Run the same slow-LLM load against each gunicorn worker class"""
+    classes = ['sync', 'gthread']
+    if importlib.util.find_spec('gevent') is not None:
+        classes.append('gevent')
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    token = fixtures[0]['token']
+
+    print(f"{'worker class':<14}{'ok':>6}{'failed':>8}{'p50 ms':>10}{'p95 ms':>10}{'req/s':>9}")
+    for klass in classes:
+        port = free_port()
+        env = dict(os.environ, KOLO_WORKER_CLASS=klass, WEB_CONCURRENCY=str(args.workers), PORT=str(port))
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'python:src.gunicorn_config', 'src.main:app'],
+            cwd=project_root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        base_url = f'http://127.0.0.1:{port}'
+        try:
+            if not wait_for_health(base_url):
+                print(f'{klass:<14} failed to start')
+                continue
+            row = fire_slow_requests(base_url, token, args.requests, args.concurrency)
+            print(f"{klass:<14}{row['ok']:>6}{row['failed']:>8}{row['p50_ms']:>10}"
+                  f"{row['p95_ms']:>10}{row['throughput_rps']:>9}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+# Imports the app the way a gunicorn worker does and reports cost of doing so
+STARTUP_PROBE = """
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+for name in {preload!r}:
+    __import__(name)
+from src.main import app
+print(json.dumps({{
+    'import_s': time.perf_counter() - started,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules': len(sys.modules)
+}}))
+"""
+
+# What every worker imported at boot before the SDKs were loaded lazily
+EAGER_MODULES = ['openai', 'authlib.integrations.flask_client', 'requests']
+
+
+def measure_startup(runs):
+    """Compare worker start-up cost with heavy SDKs imported eagerly and lazily"""
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp(prefix='kolo-startup-')
+    env = dict(
+        os.environ,
+        KOLO_INIT_SCHEMA='0',
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}"
+    )
+
+    results = {}
+    for label, preload in (('eager', EAGER_MODULES), ('lazy', [])):
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, '-c', STARTUP_PROBE.format(root=project_root, preload=preload)],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        results[label] = {
+            'import_ms': round(statistics.median(s['import_s'] for s in samples) * 1000, 1),
+            'rss_mb': round(statistics.median(s['rss_mb'] for s in samples), 1),
+            'modules': samples[0]['modules']
+        }
+
+    print(f"{'imports':<10}{'import ms':>12}{'RSS MB':>10}{'modules':>10}")
+    for label, row in results.items():
+        print(f"{label:<10}{row['import_ms']:>12}{row['rss_mb']:>10}{row['modules']:>10}")
+
+    eager, lazy = results['eager'], results['lazy']
+    print(f"lazy imports save {round(eager['import_ms'] - lazy['import_ms'], 1)} ms "
+          f"and {round(eager['rss_mb'] - lazy['rss_mb'], 1)} MB per worker")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Kolo Pohody API benchmark')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--journal-per-user', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=2000, help='number of scenarios to run')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--llm-latency-ms', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative p95/p99 regression')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--compare-serving', action='store_true',
+                        help='compare gunicorn worker classes under slow LLM calls')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers for --compare-serving')
+    parser.add_argument('--startup', action='store_true', help='measure worker import time and RSS')
+    parser.add_argument('--runs', type=int, default=5, help='repetitions for --startup')
+    parser.add_argument('--push-throughput', action='store_true', help='measure web push fan-out throughput')
+    parser.add_argument('--subscriptions', type=int, default=2000, help='subscriptions for --push-throughput')
+    parser.add_argument('--push-latency-ms', type=int, default=10, help='stub push service latency')
+    parser.add_argument('--push-check', action='store_true', help='check web push fan-out and retries')
+    parser.add_argument('--identity-check', action='store_true',
+                        help='check OAuth provider calls against a stub identity provider')
+    parser.add_argument('--backup', action='store_true', help='measure online backup throughput and writer latency')
+    parser.add_argument('--writers', type=int, default=4, help='concurrent writers for --backup')
+    args = parser.parse_args()
+
+    if args.startup:
+        return measure_startup(args.runs)
+
+    if args.push_check:
+        return check_push_fanout()
+
+    if args.identity_check:
+        return check_identity_providers()
+
+    if args.compare_serving and not args.llm_latency_ms:
+        args.llm_latency_ms = 500
+
+    llm = start_stub_llm(args.llm_latency_ms)
+    workdir = tempfile.mkdtemp(prefix='kolo-bench-')
+    os.environ['OPENAI_API_BASE'] = f'http://127.0.0.1:{llm.server_address[1]}/v1'
+    os.environ['OPENAI_API_KEY'] = 'stub'
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from src.main import app
+
+    if args.push_throughput:
+        llm.shutdown()
+        return measure_push_throughput(app, args.subscriptions, args.push_latency_ms)
+
+    config = {
+        'users': args.users,
+        'years': args.years,
+        'journal_per_user': args.journal_per_user,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'llm_latency_ms': args.llm_latency_ms,
+        'seed': args.seed
+    }
+
+    print(f'Seeding {args.users} users into {workdir} ...')
+    fixtures = seed_dataset(app, args.users, args.years, args.journal_per_user, args.seed)
+
+    if args.compare_serving:
+        compare_serving(args, app, fixtures)
+        llm.shutdown()
+        return 0
+
+    if args.backup:
+        llm.shutdown()
+        return measure_backup(app, fixtures, os.path.join(workdir, 'bench.db'), writers=args.writers)
+
+    scenarios = pick_scenarios(args.requests, args.seed)
+    report = run_traffic(app, fixtures, scenarios, args.concurrency, args.seed)
+    llm.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump({'config': config, 'endpoints': report}, f, indent=2)
+        print(f'Baseline written to {BASELINE_PATH}')
+        return 0
+
+    regressions = compare_with_baseline(report, config, args.tolerance)
+    for message in regressions:
+        print(f'REGRESSION {message}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
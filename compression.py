@@ -0,0 +1,106 @@
+"""
+Negotiated compression of API responses.
+
+JSON (and other text) responses above COMPRESS_MIN_BYTES are compressed with
+brotli when the client accepts it and the package is installed, otherwise with
+gzip. The body is compressed incrementally while it is being sent instead of
+building a second, compressed copy in memory first.
+"""
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv('KOLO_COMPRESS_MIN_BYTES', 1024))
+COMPRESS_LEVEL = 6
+CHUNK_SIZE = 64 * 1024
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'text/plain',
+    'text/csv',
+}
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _chunks(body, streamed):
+    for piece in body:
+        if isinstance(piece, str):
+            piece = piece.encode('utf-8')
+        if streamed:
+            yield piece, True
+            continue
+        view = memoryview(piece)
+        for start in range(0, len(view), CHUNK_SIZE):
+            yield view[start:start + CHUNK_SIZE], False
+
+
+def _gzip_stream(body, streamed):
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    for piece, flush in _chunks(body, streamed):
+        data = compressor.compress(piece)
+        if flush:
+            # Keep streamed responses (exports, NDJSON) flowing to the client
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _brotli_stream(body, streamed):
+    compressor = brotli.Compressor(quality=5)
+    for piece, flush in _chunks(body, streamed):
+        data = compressor.process(bytes(piece))
+        if flush:
+            data += compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress_response(response):
+    if request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    streamed = response.is_streamed
+    if not streamed and (response.content_length or 0) < COMPRESS_MIN_BYTES:
+        return response
+
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    body = response.response
+    response.response = _brotli_stream(body, streamed) if encoding == 'br' else _gzip_stream(body, streamed)
+    response.headers.pop('Content-Length', None)
+    response.content_encoding = encoding
+
+    # A strong ETag identifies one representation, keep compressed ones distinct
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
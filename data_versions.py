@@ -0,0 +1,131 @@
+"""
+Per-user data versions and conditional GET.
+
+Every flush that adds, changes or deletes a user's wellness, journal or
+inspiration rows bumps that user's version counter for the affected scope in
+the same transaction. GET handlers decorated with @conditional_on turn the
+version into a strong ETag before touching the data, so an unchanged
+resource costs one primary-key lookup and a 304.
+"""
+import hashlib
+from datetime import date, datetime
+from functools import wraps
+
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event
+from src.models.user import db, WellnessCategory, WellnessEntry, JournalEntry, AIInspiration
+
+# Which version scope a change to each model invalidates
+MODEL_SCOPES = {
+    WellnessCategory: 'wellness',
+    WellnessEntry: 'wellness',
+    JournalEntry: 'journal',
+    AIInspiration: 'inspiration',
+}
+
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def register_scope(model, scope):
+    """Let changes to another user-owned model invalidate a scope"""
+    MODEL_SCOPES[model] = scope
+
+
+def _changed_scopes(session):
+    changed = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        scope = MODEL_SCOPES.get(type(obj))
+        if scope and getattr(obj, 'user_id', None) is not None:
+            changed.add((int(obj.user_id), scope))
+    return changed
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_changes(session, flush_context, instances):
+    session.info.setdefault('changed_scopes', set()).update(_changed_scopes(session))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _bump_versions(session, flush_context):
+    changed = session.info.pop('changed_scopes', None)
+    if not changed:
+        return
+
+    # Routed like DataVersion itself, which lives on the user's shard
+    _bump(session.connection(bind_arguments={'mapper': DataVersion}), changed)
+
+
+def _bump(connection, changed):
+    table = DataVersion.__table__
+    now = datetime.utcnow()
+    for user_id, scope in changed:
+        result = connection.execute(
+            table.update()
+            .where(table.c.user_id == user_id, table.c.scope == scope)
+            .values(version=table.c.version + 1, updated_at=now)
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(user_id=user_id, scope=scope, version=1, updated_at=now))
+
+
+def bump_version(user_id, scope):
+    """Invalidate a scope after a bulk statement that bypasses the ORM flush"""
+    db.session.info.setdefault('changed_scopes', set()).add((int(user_id), scope))
+    _bump_versions(db.session, None)
+
+
+def bump_all_scopes(connection, user_id):
+    """Invalidate every scope of a user on a connection to their shard
+
+    For rows rewritten outside the ORM, e.g. copied to another shard with new ids.
+    """
+    _bump(connection, {(int(user_id), scope) for scope in set(MODEL_SCOPES.values())})
+
+
+def current_versions(user_id, scopes):
+    rows = db.session.query(DataVersion.scope, DataVersion.version).filter(
+        DataVersion.user_id == user_id,
+        DataVersion.scope.in_(scopes)
+    ).all()
+    versions = dict(rows)
+    return [versions.get(scope, 0) for scope in scopes]
+
+
+def compute_etag(user_id, scopes):
+    """Strong ETag for the current request over the given data scopes"""
+    parts = [
+        str(user_id),
+        ','.join(f'{scope}:{version}' for scope, version in zip(scopes, current_versions(user_id, scopes))),
+        request.full_path,
+        # Some views depend on the current day (today's entries, stats windows)
+        date.today().isoformat(),
+    ]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def conditional_on(*scopes):
+    """Answer GET requests with 304 while the user's data in these scopes is unchanged"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = compute_etag(get_jwt_identity(), scopes)
+            # Compressed representations carry an encoding suffix, see src.compression
+            for candidate in (etag, f'{etag}-gzip', f'{etag}-br'):
+                if request.if_none_match.contains(candidate):
+                    return '', 304, {'ETag': f'"{candidate}"', 'Cache-Control': 'private, no-cache'}
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
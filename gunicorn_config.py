@@ -0,0 +1,66 @@
+"""
+Gunicorn configuration for Kolo Pohody.
+
+Usage:
+    gunicorn -c python:src.gunicorn_config src.main:app
+
+Environment:
+    KOLO_WORKER_CLASS   gthread (default), gevent or sync
+    WEB_CONCURRENCY     fixed number of workers, disables autotuning
+    KOLO_THREADS        threads per gthread worker (default 16)
+    KOLO_MAX_WORKERS    upper bound for autotuned workers (default 8)
+    KOLO_PRELOAD        load the app once in the master before forking (default 1)
+"""
+import os
+
+from src import serving
+
+# Workers never run schema checks, the master does it once in on_starting
+os.environ.setdefault('KOLO_INIT_SCHEMA', '0')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+worker_class = serving.worker_class()
+workers = serving.recommended_workers(worker_class)
+threads = serving.recommended_threads(worker_class)
+
+# Each gevent worker can keep this many slow requests in flight at once
+worker_connections = int(os.getenv('KOLO_WORKER_CONNECTIONS', 1000))
+
+# Slow LLM calls are bounded by OPENAI_TIMEOUT, this only catches stuck workers
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Workers share the imported code and static manifest copy-on-write
+preload_app = os.getenv('KOLO_PRELOAD', '1') == '1'
+
+
+def on_starting(server):
+    from src.main import app
+    from src.models.user import db
+    from src.schema import init_db
+
+    with app.app_context():
+        init_db()
+        # Connections opened here must not be inherited by the workers
+        db.engine.dispose()
+
+    server.log.info(f'Serving with {workers} {worker_class} workers x {threads} threads')
+
+
+def post_fork(server, worker):
+    from src.main import app
+    from src.models.user import db
+
+    with app.app_context():
+        # Drop pooled connections copied from the master without closing them
+        db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    from src import profiler
+
+    # After the worker reset its signal handlers: kill -USR2 <worker pid>
+    # toggles the sampling profiler, see src/profiler.py
+    profiler.install_signal_handler()
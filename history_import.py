@@ -0,0 +1,369 @@
+"""
+Bulk import of wellness and journal history.
+
+The upload is spooled to a temporary file and parsed line by line in a
+background thread, so memory stays flat however large the file is. Rows are
+validated and written in chunks, one transaction per chunk:
+
+- category names are resolved to the user's WellnessCategory ids from one
+  in-memory map loaded at the start
+- wellness scores are upserted on (user_id, category_id, entry_date), the
+  uq_wellness_entries_user_category_date index of src.schema, so
+  re-importing a file updates instead of duplicating; scores of days already
+  moved to the archive are read-only and reported as invalid rows
+- journal entries are bulk-inserted, long bodies go to the compressed
+  content store like entries written through the API
+
+Progress and the first validation errors are recorded in import_jobs and
+reported by GET /api/import/<id>.
+
+Rows are CSV with a header or NDJSON objects with these keys:
+    type       'wellness' or 'journal' (inferred from score/content when missing)
+    date       YYYY-MM-DD (or DD.MM.YYYY)
+    category   category name, for wellness rows
+    score      1-10, for wellness rows
+    note       optional, for wellness rows
+    title, content, tags, is_private   for journal rows, tags as JSON list or 'a;b'
+"""
+import csv
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+from sqlalchemy import insert
+from src.models.user import db, WellnessCategory, WellnessEntry, JournalEntry
+from src.data_versions import bump_version
+from src import activity_calendar, archive
+from src.sharding import using_user
+from src import journal_store
+from src.journal_store import JournalContent
+
+IMPORT_CHUNK_ROWS = 500
+MAX_IMPORT_BYTES = int(os.getenv('KOLO_MAX_IMPORT_MB', 50)) * 1024 * 1024
+MAX_REPORTED_ERRORS = 20
+FORMATS = ('csv', 'ndjson')
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y')
+SPOOL_DIR = os.getenv('KOLO_IMPORT_DIR', tempfile.gettempdir())
+
+class ImportJob(db.Model):
+    __tablename__ = 'import_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    format = db.Column(db.String(10), nullable=False)
+    filename = db.Column(db.String(255))
+    bytes_total = db.Column(db.Integer, default=0)
+    bytes_read = db.Column(db.Integer, default=0)
+    wellness_rows = db.Column(db.Integer, default=0)
+    journal_rows = db.Column(db.Integer, default=0)
+    invalid_rows = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Text)  # JSON list of the first validation errors
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'format': self.format,
+            'filename': self.filename,
+            'progress': round(self.bytes_read / self.bytes_total, 3) if self.bytes_total else 0,
+            'wellness_rows': self.wellness_rows,
+            'journal_rows': self.journal_rows,
+            'invalid_rows': self.invalid_rows,
+            'errors': json.loads(self.errors) if self.errors else [],
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+def detect_format(filename, content_type, requested=None):
+    if requested:
+        return requested if requested in FORMATS else None
+    name = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonlines' in content_type:
+        return 'ndjson'
+    if name.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    return None
+
+
+def spool_upload(stream):
+    """Copy an upload stream to a temporary file in fixed-size pieces, returns (path, size)"""
+    fd, path = tempfile.mkstemp(prefix='kolo-import-', dir=SPOOL_DIR)
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as spool:
+            while True:
+                piece = stream.read(64 * 1024)
+                if not piece:
+                    break
+                size += len(piece)
+                if size > MAX_IMPORT_BYTES:
+                    raise ValueError('Import file is too large')
+                spool.write(piece)
+        return path, size
+    except Exception:
+        os.remove(path)
+        raise
+
+
+class _ProgressFile:
+    """Text file wrapper counting the bytes consumed by the parser"""
+
+    def __init__(self, path):
+        self._text = open(path, 'r', encoding='utf-8-sig', newline='')
+
+    @property
+    def position(self):
+        # tell() on a text file is an opaque cookie, ask the OS for the real offset
+        return os.lseek(self._text.fileno(), 0, os.SEEK_CUR)
+
+    def close(self):
+        self._text.close()
+
+
+def _rows(source, fmt):
+    """(line_number, dict) per row, parsed lazily"""
+    if fmt == 'csv':
+        reader = csv.DictReader(source._text)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for number, line in enumerate(source._text, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                value = json.loads(line)
+            except json.JSONDecodeError:
+                yield number, None
+                continue
+            yield number, value if isinstance(value, dict) else None
+
+
+def _parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f'Invalid date {value!r}')
+
+
+def _parse_tags(value):
+    if isinstance(value, list):
+        return [str(tag).strip() for tag in value if str(tag).strip()]
+    value = str(value or '').strip()
+    if value.startswith('['):
+        tags = json.loads(value)
+        if not isinstance(tags, list):
+            raise ValueError('Tags must be a list')
+        return _parse_tags(tags)
+    return [tag.strip() for tag in value.split(';') if tag.strip()]
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'ano')
+
+
+def validate_row(row, categories, now):
+    """Return ('wellness' | 'journal', values) or raise ValueError"""
+    kind = str(row.get('type') or '').strip().lower()
+    if not kind:
+        kind = 'wellness' if row.get('score') not in (None, '') else 'journal'
+    entry_date = _parse_date(row.get('date') or row.get('entry_date') or '')
+
+    if kind == 'wellness':
+        name = str(row.get('category') or '').strip()
+        category_id = categories.get(name.casefold())
+        if category_id is None:
+            raise ValueError(f'Unknown category {name!r}')
+        try:
+            score = int(row.get('score'))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid score {row.get('score')!r}")
+        if not 1 <= score <= 10:
+            raise ValueError('Score must be between 1 and 10')
+        return kind, {
+            'category_id': category_id,
+            'score': score,
+            'note': str(row.get('note') or ''),
+            'entry_date': entry_date,
+            'created_at': now,
+            'updated_at': now
+        }
+
+    if kind == 'journal':
+        content = str(row.get('content') or '')
+        if not content.strip():
+            raise ValueError('Content is required')
+        return kind, {
+            'title': str(row.get('title') or '')[:255],
+            'content': content,
+            'entry_date': entry_date,
+            'is_private': _parse_bool(row.get('is_private')),
+            'tags': json.dumps(_parse_tags(row.get('tags'))),
+            'created_at': now,
+            'updated_at': now
+        }
+
+    raise ValueError(f'Unknown row type {kind!r}')
+
+
+def _archived_keys(user_id, rows):
+    """(category_id, entry_date) of the rows that already exist in the archive"""
+    dates = [row['entry_date'] for row in rows]
+    return {
+        (row['category_id'], row['entry_date'])
+        for row in archive.read(user_id, 'wellness', min(dates), max(dates))
+    }
+
+
+def _upsert_wellness(user_id, rows):
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+    # The last row for a day and category wins, like repeated API saves
+    unique = {(row['category_id'], row['entry_date']): dict(row, user_id=user_id) for row in rows}
+    statement = dialect_insert(WellnessEntry)
+    statement = statement.on_conflict_do_update(
+        index_elements=['user_id', 'category_id', 'entry_date'],
+        set_={
+            'score': statement.excluded.score,
+            'note': statement.excluded.note,
+            'updated_at': statement.excluded.updated_at
+        }
+    )
+    db.session.execute(statement, list(unique.values()))
+
+
+def _insert_journal(user_id, rows):
+    texts = [row['content'] for row in rows]
+    values = [dict(row, user_id=user_id, content=journal_store.preview(row['content'])) for row in rows]
+    ids = db.session.execute(
+        insert(JournalEntry).returning(JournalEntry.id, sort_by_parameter_order=True),
+        values
+    ).scalars().all()
+
+    contents = []
+    bodies = {}
+    for entry_id, text in zip(ids, texts):
+        if len(text) > journal_store.INLINE_LIMIT:
+            codec, data = journal_store.codecs.compress(text)
+            contents.append({'entry_id': entry_id, 'codec': codec, 'size': len(text), 'data': data})
+            bodies[entry_id] = text
+    if contents:
+        db.session.execute(insert(JournalContent), contents)
+        journal_store.index_bodies(bodies)
+
+
+def run_import(job_id, path):
+    """Parse and write an uploaded file, needs an app context"""
+    job = db.session.get(ImportJob, job_id)
+    job.status = 'running'
+    db.session.commit()
+
+    user_id = job.user_id
+    categories = {
+        name.casefold(): category_id
+        for category_id, name in db.session.query(WellnessCategory.id, WellnessCategory.name)
+        .filter_by(user_id=user_id, is_active=True)
+    }
+    errors = []
+    now = datetime.utcnow()
+    source = _ProgressFile(path)
+
+    def write_chunk(wellness, journal, invalid):
+        archived = _archived_keys(user_id, wellness) if wellness else set()
+        if archived:
+            # The upsert cannot see archived rows and would add a second score for the day
+            kept = []
+            for row in wellness:
+                if (row['category_id'], row['entry_date']) not in archived:
+                    kept.append(row)
+                elif len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'line': None, 'error': f"Score for {row['entry_date'].isoformat()} is archived"})
+            invalid += len(wellness) - len(kept)
+            wellness = kept
+        if wellness:
+            _upsert_wellness(user_id, wellness)
+            bump_version(user_id, 'wellness')
+        if journal:
+            _insert_journal(user_id, journal)
+            bump_version(user_id, 'journal')
+        # Bulk statements bypass the flush that keeps calendars current
+        activity_calendar.refresh_days(user_id, {row['entry_date'] for row in wellness + journal})
+        job.wellness_rows += len(wellness)
+        job.journal_rows += len(journal)
+        job.invalid_rows += invalid
+        job.bytes_read = source.position
+        job.errors = json.dumps(errors, ensure_ascii=False)
+        db.session.commit()
+
+    try:
+        wellness, journal, invalid = [], [], 0
+        for line_number, row in _rows(source, job.format):
+            try:
+                if row is None:
+                    raise ValueError('Not a JSON object')
+                kind, values = validate_row(row, categories, now)
+            except ValueError as e:
+                invalid += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'line': line_number, 'error': str(e)})
+                continue
+            (wellness if kind == 'wellness' else journal).append(values)
+
+            if len(wellness) + len(journal) >= IMPORT_CHUNK_ROWS:
+                write_chunk(wellness, journal, invalid)
+                wellness, journal, invalid = [], [], 0
+
+        write_chunk(wellness, journal, invalid)
+        job.status = 'done'
+        job.bytes_read = job.bytes_total
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error importing history for job {job_id}: {e}")
+        job = db.session.get(ImportJob, job_id)
+        job.status = 'failed'
+        errors.append({'line': None, 'error': 'Import failed, rows up to the reported progress were saved'})
+        job.errors = json.dumps(errors[-MAX_REPORTED_ERRORS:], ensure_ascii=False)
+    finally:
+        source.close()
+        os.remove(path)
+
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+    if job.journal_rows:
+        # Imported entries join semantic search through a rebuild of the user's index
+        from flask import current_app
+        from src.semantic_index import index_queue
+        index_queue.rebuild(current_app._get_current_object(), user_id)
+    return job
+
+
+def start_import(app, job_id, path):
+    """Run the import in a background thread with its own app context and session"""
+    def worker():
+        with app.app_context():
+            try:
+                user_id = db.session.get(ImportJob, job_id).user_id
+                with using_user(user_id):
+                    run_import(job_id, path)
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    return thread
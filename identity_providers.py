@@ -0,0 +1,145 @@
+"""
+Outbound calls to OAuth identity providers.
+
+OpenID provider metadata and signing keys (JWKS) are cached per worker with a
+TTL and refreshed by a background thread before they expire, so a login burst
+never waits on discovery documents and ID tokens are validated offline
+against the cached keys. Userinfo calls share one pooled HTTP session with
+explicit timeouts.
+
+Every provider URL can be overridden from the environment, which is how
+local stub identity providers are wired in for testing:
+
+    GOOGLE_METADATA_URL=http://127.0.0.1:8001/.well-known/openid-configuration
+    MICROSOFT_AUTHORITY=http://127.0.0.1:8001     # /<tenant>/oauth2/v2.0/authorize|token
+    MICROSOFT_GRAPH_URL=http://127.0.0.1:8001/v1.0  # GET /me with the bearer token
+
+The stub must serve the discovery document with a jwks_uri and the JWKS
+itself. `python src/benchmark.py --identity-check` starts such a stub and
+checks the metadata cache and the Graph call against it.
+"""
+import os
+import threading
+import time
+
+GOOGLE_METADATA_URL = os.getenv(
+    'GOOGLE_METADATA_URL',
+    'https://accounts.google.com/.well-known/openid-configuration'
+)
+MICROSOFT_AUTHORITY = os.getenv('MICROSOFT_AUTHORITY', 'https://login.microsoftonline.com')
+MICROSOFT_GRAPH_URL = os.getenv('MICROSOFT_GRAPH_URL', 'https://graph.microsoft.com/v1.0')
+
+# (connect, read) timeouts in seconds for every call to a provider
+HTTP_TIMEOUT = (
+    float(os.getenv('OAUTH_CONNECT_TIMEOUT', 3)),
+    float(os.getenv('OAUTH_READ_TIMEOUT', 10))
+)
+METADATA_TTL_SECONDS = int(os.getenv('OAUTH_METADATA_TTL', 3600))
+RETRY_AFTER_FAILURE_SECONDS = 60
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    """Shared connection-pooled session for identity provider calls"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # Imported on first login rather than at app start-up
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                session = requests.Session()
+                retries = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504],
+                                allowed_methods=['GET'])
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retries)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def get_json(url, headers=None):
+    """GET a JSON document from a provider with pooling and timeouts"""
+    response = http_session().get(url, headers=headers, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+class ProviderMetadataCache:
+    """OpenID Connect discovery document plus JWKS, refreshed in the background"""
+
+    def __init__(self, metadata_url, ttl=METADATA_TTL_SECONDS):
+        self.metadata_url = metadata_url
+        self.ttl = ttl
+        self._metadata = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refresher_pid = None
+        self._refresher_lock = threading.Lock()
+
+    def _fetch(self):
+        metadata = get_json(self.metadata_url)
+        if metadata.get('jwks_uri'):
+            metadata['jwks'] = get_json(metadata['jwks_uri'])
+        self._metadata = metadata
+        self._fetched_at = time.time()
+
+    def _refresh_loop(self):
+        while True:
+            delay = max(1.0, self._fetched_at + self.ttl * 0.8 - time.time())
+            time.sleep(delay)
+            try:
+                with self._lock:
+                    self._fetch()
+            except Exception as e:
+                # Keep serving the stale copy, providers rotate keys with overlap
+                print(f'Error refreshing {self.metadata_url}: {e}')
+                time.sleep(RETRY_AFTER_FAILURE_SECONDS)
+
+    def _ensure_refresher(self):
+        # Threads do not survive fork, start one per worker process
+        if self._refresher_pid != os.getpid():
+            with self._refresher_lock:
+                if self._refresher_pid != os.getpid():
+                    self._refresher_pid = os.getpid()
+                    threading.Thread(target=self._refresh_loop, daemon=True).start()
+
+    def get(self, force=False):
+        """Return the cached metadata, fetching it once if missing or expired"""
+        if force or self._metadata is None or time.time() - self._fetched_at > self.ttl:
+            with self._lock:
+                # Concurrent first logins share a single fetch
+                if force or self._metadata is None or time.time() - self._fetched_at > self.ttl:
+                    self._fetch()
+        self._ensure_refresher()
+        return self._metadata
+
+    def prime(self, client):
+        """Hand the cached metadata and keys to an Authlib client
+
+        Authlib then validates ID tokens offline against these keys and skips
+        its own lazy discovery request. An unknown key id still makes Authlib
+        refetch the JWKS, which covers provider key rotation.
+        """
+        metadata = self.get()
+        client.server_metadata.update(metadata)
+        client.server_metadata['_loaded_at'] = self._fetched_at
+
+
+google_metadata = ProviderMetadataCache(GOOGLE_METADATA_URL)
+
+
+def microsoft_url(tenant, path):
+    return f'{MICROSOFT_AUTHORITY}/{tenant}/oauth2/v2.0/{path}'
+
+
+def fetch_microsoft_profile(access_token):
+    """Load the signed-in user's profile from Microsoft Graph"""
+    return get_json(
+        f'{MICROSOFT_GRAPH_URL}/me',
+        headers={'Authorization': f'Bearer {access_token}'}
+    )
@@ -0,0 +1,67 @@
+from flask import Blueprint, current_app, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from src.models.user import db, WellnessEntry
+from src.history_import import ImportJob, detect_format, spool_upload, start_import
+from src.schema import WELLNESS_DAY_INDEX, has_index
+import os
+
+imports_bp = Blueprint('imports', __name__)
+
+@imports_bp.route('/import', methods=['POST'])
+@jwt_required()
+def create_import():
+    """Upload CSV or NDJSON history, imported in the background"""
+    current_user_id = get_jwt_identity()
+
+    # The wellness upsert needs the unique index, without it every chunk would fail
+    connection = db.session.connection(bind_arguments={'mapper': WellnessEntry})
+    if not has_index(connection, WellnessEntry.__table__.name, WELLNESS_DAY_INDEX):
+        print(f"Error starting import: {WELLNESS_DAY_INDEX} is missing, run flask init-db")
+        return jsonify({'error': 'Import is not available right now'}), 503
+
+    upload = request.files.get('file')
+    if upload is not None:
+        filename, content_type, stream = upload.filename, upload.mimetype, upload.stream
+    else:
+        # Raw body upload, e.g. curl --data-binary @history.ndjson
+        filename, content_type, stream = request.args.get('filename'), request.mimetype, request.stream
+
+    fmt = detect_format(filename, content_type, request.args.get('format') or request.form.get('format'))
+    if fmt is None:
+        return jsonify({'error': 'Unknown format, upload a .csv or .ndjson file or pass format=csv|ndjson'}), 400
+
+    try:
+        path, size = spool_upload(stream)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 413
+    if size == 0:
+        os.remove(path)
+        return jsonify({'error': 'Import file is empty'}), 400
+
+    job = ImportJob(
+        user_id=current_user_id,
+        format=fmt,
+        filename=(filename or '')[:255] or None,
+        bytes_total=size,
+        bytes_read=0,
+        wellness_rows=0,
+        journal_rows=0,
+        invalid_rows=0
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    start_import(current_app._get_current_object(), job.id, path)
+    return jsonify(job.to_dict()), 202
+
+@imports_bp.route('/import/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_import(job_id):
+    """Progress of an import job"""
+    current_user_id = get_jwt_identity()
+    job = ImportJob.query.filter_by(id=job_id, user_id=current_user_id).first()
+
+    if not job:
+        return jsonify({'error': 'Import not found'}), 404
+
+    return jsonify(job.to_dict())
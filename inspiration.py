@@ -1,13 +1,32 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.models.user import db, AIInspiration, User
+from src.data_versions import conditional_on
+from src.projection import Projection, ProjectionError
+from src import user_context
+from src.single_flight import single_flight
+from src import archive
 from datetime import datetime, timedelta
-import openai
 import os
 import random
+import threading
 
 inspiration_bp = Blueprint('inspiration', __name__)
 
+_openai_client = None
+_openai_lock = threading.Lock()
+
+HISTORY_PROJECTION = Projection(
+    columns={
+        'id': AIInspiration.id,
+        'type': AIInspiration.inspiration_type,
+        'content': AIInspiration.content,
+        'created_date': AIInspiration.created_date,
+    },
+    summary=['id', 'type', 'content', 'created_date'],
+    text_fields=['content']
+)
+
 # Wellness-themed prompts for different categories
 INSPIRATION_PROMPTS = {
     'daily_quote': [
@@ -40,32 +59,41 @@ INSPIRATION_PROMPTS = {
     ]
 }
 
-@inspiration_bp.route('/daily', methods=['GET'])
-@jwt_required()
-def get_daily_inspiration():
-    """Get daily inspiration for the current user"""
-    try:
-        user_id = get_jwt_identity()
-        today = datetime.now().date()
-        
+def daily_inspiration_dict(inspiration, is_cached):
+    return {
+        'id': inspiration.id,
+        'type': inspiration.inspiration_type,
+        'content': inspiration.content,
+        'created_date': inspiration.created_date.isoformat(),
+        'is_cached': is_cached
+    }
+
+def get_or_create_daily_inspiration(user_id, personalized=False, generate=None):
+    """Today's inspiration of a user as a dict, generated on first request
+
+    Concurrent first requests of a user (phone and laptop, a double-mounted
+    card) share one generation, also across workers, see src.single_flight.
+    generate(inspiration_type) replaces the generic generation, bulk jobs pass a
+    memoized one so all users without personal context share a few LLM calls.
+    """
+    today = datetime.now().date()
+
+    def lookup():
         # Check if user already has inspiration for today
         existing_inspiration = AIInspiration.query.filter_by(
             user_id=user_id,
             created_date=today
-        ).first()
-        
-        if existing_inspiration:
-            return jsonify({
-                'id': existing_inspiration.id,
-                'type': existing_inspiration.inspiration_type,
-                'content': existing_inspiration.content,
-                'created_date': existing_inspiration.created_date.isoformat(),
-                'is_cached': True
-            })
-        
+        ).order_by(AIInspiration.id).first()
+        return daily_inspiration_dict(existing_inspiration, True) if existing_inspiration else None
+
+    def create():
         # Generate new inspiration
         inspiration_type = random.choice(['daily_quote', 'wellness_tip', 'reflection_prompt', 'affirmation'])
-        content = generate_ai_inspiration(inspiration_type)
+        content = None
+        if personalized:
+            content = user_context.personalized_content(user_id, inspiration_type, generate_personalized, first=True)
+        if content is None:
+            content = (generate or generate_ai_inspiration)(inspiration_type)
         
         # Save to database
         new_inspiration = AIInspiration(
@@ -77,14 +105,18 @@ def get_daily_inspiration():
         
         db.session.add(new_inspiration)
         db.session.commit()
-        
-        return jsonify({
-            'id': new_inspiration.id,
-            'type': new_inspiration.inspiration_type,
-            'content': new_inspiration.content,
-            'created_date': new_inspiration.created_date.isoformat(),
-            'is_cached': False
-        })
+        return daily_inspiration_dict(new_inspiration, False)
+
+    return single_flight(('daily-inspiration', int(user_id), today.isoformat()), create, lookup)
+
+@inspiration_bp.route('/daily', methods=['GET'])
+@jwt_required()
+def get_daily_inspiration():
+    """Get daily inspiration for the current user"""
+    try:
+        user_id = get_jwt_identity()
+        personalized = request.args.get('personalized', 'false').lower() == 'true'
+        return jsonify(get_or_create_daily_inspiration(user_id, personalized=personalized))
         
     except Exception as e:
         print(f"Error getting daily inspiration: {e}")
@@ -102,7 +134,11 @@ def generate_inspiration():
         if inspiration_type not in INSPIRATION_PROMPTS:
             return jsonify({'error': 'Invalid inspiration type'}), 400
         
-        content = generate_ai_inspiration(inspiration_type)
+        content = None
+        if data.get('personalized'):
+            content = user_context.personalized_content(user_id, inspiration_type, generate_personalized)
+        if content is None:
+            content = generate_ai_inspiration(inspiration_type)
         
         # Save to database
         new_inspiration = AIInspiration(
@@ -126,25 +162,45 @@ def generate_inspiration():
         print(f"Error generating inspiration: {e}")
         return jsonify({'error': 'Failed to generate inspiration'}), 500
 
+def history_dict(inspiration):
+    return {
+        'id': inspiration.id,
+        'type': inspiration.inspiration_type,
+        'content': inspiration.content,
+        'created_date': inspiration.created_date.isoformat()
+    }
+
 @inspiration_bp.route('/history', methods=['GET'])
 @jwt_required()
+@conditional_on('inspiration')
 def get_inspiration_history():
     """Get user's inspiration history"""
     try:
         user_id = get_jwt_identity()
         limit = request.args.get('limit', 20, type=int)
+
+        try:
+            fields = HISTORY_PROJECTION.requested()
+        except ProjectionError as e:
+            return jsonify({'error': str(e)}), 400
         
-        inspirations = AIInspiration.query.filter_by(user_id=user_id)\
+        query = AIInspiration.query.filter_by(user_id=user_id)\
             .order_by(AIInspiration.created_date.desc())\
-            .limit(limit)\
-            .all()
+            .limit(limit)
+
+        archived = archive.read(user_id, 'inspiration', limit=limit)
+        if archived:
+            return jsonify(archive.with_archive(
+                HISTORY_PROJECTION, query, fields, archived, 'created_date', limit,
+                lambda inspirations: [history_dict(insp) for insp in inspirations]
+            ))
+
+        if fields:
+            return jsonify(HISTORY_PROJECTION.fetch(query, fields))
+
+        inspirations = query.all()
         
-        return jsonify([{
-            'id': insp.id,
-            'type': insp.inspiration_type,
-            'content': insp.content,
-            'created_date': insp.created_date.isoformat()
-        } for insp in inspirations])
+        return jsonify([history_dict(insp) for insp in inspirations])
         
     except Exception as e:
         print(f"Error getting inspiration history: {e}")
@@ -174,39 +230,63 @@ def delete_inspiration(inspiration_id):
         print(f"Error deleting inspiration: {e}")
         return jsonify({'error': 'Failed to delete inspiration'}), 500
 
+def get_openai_client():
+    """Shared OpenAI client, the SDK is imported on the first generation only"""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_lock:
+            if _openai_client is None:
+                import openai
+
+                _openai_client = openai.OpenAI(
+                    api_key=os.getenv('OPENAI_API_KEY'),
+                    base_url=os.getenv('OPENAI_API_BASE'),
+                    # Never let a slow LLM hold a worker thread for longer than this
+                    timeout=float(os.getenv('OPENAI_TIMEOUT', 20)),
+                    max_retries=1
+                )
+    return _openai_client
+
+def request_ai_inspiration(inspiration_type, context=None):
+    """Ask the LLM for an inspiration, raises on failure"""
+    # Get random prompt for the type
+    prompts = INSPIRATION_PROMPTS.get(inspiration_type, INSPIRATION_PROMPTS['daily_quote'])
+    prompt = random.choice(prompts)
+
+    # User context goes last so the system prompt and instructions form a stable,
+    # cacheable prefix shared by every request
+    if context:
+        prompt = f"{prompt}\n\nTailor it gently to this person without naming the data: {context}"
+    
+    # Use OpenAI to generate content
+    response = get_openai_client().chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=[
+            {
+                "role": "system", 
+                "content": "You are a wellness coach and mindfulness expert. Generate content in Czech language that is warm, encouraging, and practical. Keep responses concise and meaningful."
+            },
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=150,
+        temperature=0.8
+    )
+    
+    content = response.choices[0].message.content.strip()
+    
+    # Remove quotes if present
+    if content.startswith('"') and content.endswith('"'):
+        content = content[1:-1]
+    
+    return content
+
+def generate_personalized(inspiration_type, context):
+    return request_ai_inspiration(inspiration_type, context)
+
 def generate_ai_inspiration(inspiration_type):
     """Generate AI inspiration using OpenAI"""
     try:
-        # Get random prompt for the type
-        prompts = INSPIRATION_PROMPTS.get(inspiration_type, INSPIRATION_PROMPTS['daily_quote'])
-        prompt = random.choice(prompts)
-        
-        # Use OpenAI to generate content
-        client = openai.OpenAI(
-            api_key=os.getenv('OPENAI_API_KEY'),
-            base_url=os.getenv('OPENAI_API_BASE')
-        )
-        
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a wellness coach and mindfulness expert. Generate content in Czech language that is warm, encouraging, and practical. Keep responses concise and meaningful."
-                },
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=150,
-            temperature=0.8
-        )
-        
-        content = response.choices[0].message.content.strip()
-        
-        # Remove quotes if present
-        if content.startswith('"') and content.endswith('"'):
-            content = content[1:-1]
-        
-        return content
+        return request_ai_inspiration(inspiration_type)
         
     except Exception as e:
         print(f"Error generating AI content: {e}")
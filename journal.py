@@ -1,13 +1,37 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.models.user import db, JournalEntry
+from src.data_versions import conditional_on
+from src.projection import Projection, ProjectionError
+from src import journal_store
+from src.journal_store import JournalAttachment
+from src.semantic_index import index_queue, entry_text
+from src import semantic_index
 from datetime import datetime, date
 import json
 
 journal_bp = Blueprint('journal', __name__)
 
+# content selects the inline preview, long bodies are filled in by journal_store.project_contents
+JOURNAL_PROJECTION = Projection(
+    columns={
+        'id': JournalEntry.id,
+        'title': JournalEntry.title,
+        'content': JournalEntry.content,
+        'entry_date': JournalEntry.entry_date,
+        'is_private': JournalEntry.is_private,
+        'tags': JournalEntry.tags,
+        'created_at': JournalEntry.created_at,
+        'updated_at': JournalEntry.updated_at,
+    },
+    summary=['id', 'title', 'content', 'entry_date', 'is_private', 'tags'],
+    text_fields=['title', 'content'],
+    json_fields=['tags']
+)
+
 @journal_bp.route('/journal', methods=['GET'])
 @jwt_required()
+@conditional_on('journal')
 def get_journal_entries():
     """Get journal entries with optional filtering"""
     current_user_id = get_jwt_identity()
@@ -18,6 +42,11 @@ def get_journal_entries():
     include_private = request.args.get('include_private', 'true').lower() == 'true'
     limit = request.args.get('limit', type=int, default=50)
     search = request.args.get('search', '').strip()
+
+    try:
+        fields = JOURNAL_PROJECTION.requested()
+    except ProjectionError as e:
+        return jsonify({'error': str(e)}), 400
     
     # Build query
     query = JournalEntry.query.filter_by(user_id=current_user_id)
@@ -48,13 +77,23 @@ def get_journal_entries():
             db.or_(
                 JournalEntry.title.ilike(search_term),
                 JournalEntry.content.ilike(search_term),
-                JournalEntry.tags.ilike(search_term)
+                JournalEntry.tags.ilike(search_term),
+                # Long bodies live compressed in the content store
+                JournalEntry.id.in_(journal_store.matching_entry_ids(current_user_id, search))
             )
         )
     
-    entries = query.order_by(JournalEntry.entry_date.desc(), JournalEntry.created_at.desc()).limit(limit).all()
+    query = query.order_by(JournalEntry.entry_date.desc(), JournalEntry.created_at.desc()).limit(limit)
+
+    if fields:
+        rows = JOURNAL_PROJECTION.fetch(query, fields)
+        if 'content' in fields:
+            journal_store.project_contents(rows, JOURNAL_PROJECTION.truncate_length())
+        return jsonify(rows)
+
+    entries = query.all()
     
-    return jsonify([entry.to_dict() for entry in entries])
+    return jsonify(journal_store.entries_to_dicts(entries))
 
 @journal_bp.route('/journal', methods=['POST'])
 @jwt_required()
@@ -86,19 +125,23 @@ def create_journal_entry():
     entry = JournalEntry(
         user_id=current_user_id,
         title=data.get('title', ''),
-        content=data['content'],
+        content=journal_store.preview(data['content']),
         entry_date=entry_date,
         is_private=data.get('is_private', False),
         tags=tags_json
     )
     
     db.session.add(entry)
+    db.session.flush()
+    journal_store.set_content(entry, data['content'])
     db.session.commit()
+    index_queue.index_entry(entry.user_id, entry.id, entry_text(entry.title, data['content']))
     
-    return jsonify(entry.to_dict()), 201
+    return jsonify(journal_store.entry_to_dict(entry)), 201
 
 @journal_bp.route('/journal/<int:entry_id>', methods=['GET'])
 @jwt_required()
+@conditional_on('journal')
 def get_journal_entry(entry_id):
     """Get specific journal entry"""
     current_user_id = get_jwt_identity()
@@ -110,7 +153,7 @@ def get_journal_entry(entry_id):
     if not entry:
         return jsonify({'error': 'Entry not found'}), 404
     
-    return jsonify(entry.to_dict())
+    return jsonify(journal_store.entry_to_dict(entry))
 
 @journal_bp.route('/journal/<int:entry_id>', methods=['PUT'])
 @jwt_required()
@@ -134,7 +177,7 @@ def update_journal_entry(entry_id):
         entry.title = data['title']
     
     if 'content' in data:
-        entry.content = data['content']
+        journal_store.set_content(entry, data['content'])
     
     if 'entry_date' in data:
         try:
@@ -154,8 +197,12 @@ def update_journal_entry(entry_id):
     
     entry.updated_at = datetime.utcnow()
     db.session.commit()
+
+    result = journal_store.entry_to_dict(entry)
+    if 'title' in data or 'content' in data:
+        index_queue.index_entry(entry.user_id, entry.id, entry_text(result['title'], result['content']))
     
-    return jsonify(entry.to_dict())
+    return jsonify(result)
 
 @journal_bp.route('/journal/<int:entry_id>', methods=['DELETE'])
 @jwt_required()
@@ -170,8 +217,16 @@ def delete_journal_entry(entry_id):
     if not entry:
         return jsonify({'error': 'Entry not found'}), 404
     
+    attachments = JournalAttachment.query.filter_by(entry_id=entry.id).all()
+    for attachment in attachments:
+        db.session.delete(attachment)
+    journal_store.delete_content(entry.id)
     db.session.delete(entry)
     db.session.commit()
+    index_queue.remove_entry(current_user_id, entry_id)
+
+    for attachment in attachments:
+        journal_store.remove_attachment_file_if_unused(attachment.sha256)
     
     return '', 204
 
@@ -202,8 +257,42 @@ def toggle_journal_privacy(entry_id):
         'message': 'Privacy setting updated'
     })
 
+@journal_bp.route('/journal/semantic', methods=['GET'])
+@jwt_required()
+def semantic_search_journal():
+    """Find journal entries close in meaning to a free-text query"""
+    current_user_id = get_jwt_identity()
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Query parameter q is required'}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+
+    try:
+        matches = semantic_index.search(current_user_id, query, limit)
+    except Exception as e:
+        print(f"Error in semantic search: {e}")
+        return jsonify({'error': 'Semantic search is not available'}), 503
+
+    if matches is None:
+        # First search of this user, build the index in the background
+        index_queue.rebuild(current_app._get_current_object(), current_user_id)
+        return jsonify({'results': [], 'indexing': True})
+
+    scores = dict(matches)
+    entries = JournalEntry.query.filter(
+        JournalEntry.id.in_(list(scores)),
+        JournalEntry.user_id == current_user_id
+    ).all()
+    entries.sort(key=lambda entry: scores[entry.id], reverse=True)
+
+    results = journal_store.entries_to_dicts(entries)
+    for result in results:
+        result['score'] = round(scores[result['id']], 4)
+    return jsonify({'results': results, 'indexing': False})
+
 @journal_bp.route('/journal/today', methods=['GET'])
 @jwt_required()
+@conditional_on('journal')
 def get_today_entries():
     """Get today's journal entries"""
     current_user_id = get_jwt_identity()
@@ -214,10 +303,11 @@ def get_today_entries():
         entry_date=today
     ).order_by(JournalEntry.created_at.desc()).all()
     
-    return jsonify([entry.to_dict() for entry in entries])
+    return jsonify(journal_store.entries_to_dicts(entries))
 
 @journal_bp.route('/journal/stats', methods=['GET'])
 @jwt_required()
+@conditional_on('journal')
 def get_journal_stats():
     """Get journal statistics"""
     current_user_id = get_jwt_identity()
@@ -285,6 +375,7 @@ def get_journal_stats():
 
 @journal_bp.route('/journal/tags', methods=['GET'])
 @jwt_required()
+@conditional_on('journal')
 def get_all_tags():
     """Get all unique tags used by the user"""
     current_user_id = get_jwt_identity()
@@ -302,3 +393,97 @@ def get_all_tags():
     
     return jsonify(sorted(list(all_tags)))
 
+@journal_bp.route('/journal/<int:entry_id>/attachments', methods=['GET'])
+@jwt_required()
+def get_journal_attachments(entry_id):
+    """List attachments of a journal entry"""
+    current_user_id = get_jwt_identity()
+    attachments = JournalAttachment.query.filter_by(
+        entry_id=entry_id,
+        user_id=current_user_id
+    ).order_by(JournalAttachment.created_at).all()
+    
+    return jsonify([attachment.to_dict() for attachment in attachments])
+
+@journal_bp.route('/journal/<int:entry_id>/attachments', methods=['POST'])
+@jwt_required()
+def add_journal_attachment(entry_id):
+    """Attach a photo to a journal entry"""
+    current_user_id = get_jwt_identity()
+    entry = JournalEntry.query.filter_by(
+        id=entry_id, 
+        user_id=current_user_id
+    ).first()
+    
+    if not entry:
+        return jsonify({'error': 'Entry not found'}), 404
+    
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({'error': 'file is required'}), 400
+    
+    if upload.mimetype not in journal_store.ATTACHMENT_MIMETYPES:
+        return jsonify({'error': 'Unsupported attachment type'}), 400
+    
+    try:
+        sha256, size = journal_store.store_attachment(upload.stream)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 413
+    
+    attachment = JournalAttachment(
+        entry_id=entry.id,
+        user_id=current_user_id,
+        sha256=sha256,
+        mimetype=upload.mimetype,
+        size=size,
+        filename=upload.filename
+    )
+    db.session.add(attachment)
+    entry.updated_at = datetime.utcnow()
+    db.session.commit()
+    
+    return jsonify(attachment.to_dict()), 201
+
+@journal_bp.route('/journal/<int:entry_id>/attachments/<int:attachment_id>', methods=['DELETE'])
+@jwt_required()
+def delete_journal_attachment(entry_id, attachment_id):
+    """Remove an attachment from a journal entry"""
+    current_user_id = get_jwt_identity()
+    attachment = JournalAttachment.query.filter_by(
+        id=attachment_id,
+        entry_id=entry_id,
+        user_id=current_user_id
+    ).first()
+    
+    if not attachment:
+        return jsonify({'error': 'Attachment not found'}), 404
+    
+    db.session.delete(attachment)
+    db.session.commit()
+    journal_store.remove_attachment_file_if_unused(attachment.sha256)
+    
+    return '', 204
+
+@journal_bp.route('/attachments/<sha256>', methods=['GET'])
+@jwt_required()
+def get_attachment(sha256):
+    """Serve attachment content; the file is handed to the server for sendfile"""
+    current_user_id = get_jwt_identity()
+    attachment = JournalAttachment.query.filter_by(
+        sha256=sha256,
+        user_id=current_user_id
+    ).first()
+    
+    if not attachment:
+        return jsonify({'error': 'Attachment not found'}), 404
+    
+    # Content-addressed, so the bytes behind this URL never change
+    response = send_file(
+        journal_store.attachment_path(sha256),
+        mimetype=attachment.mimetype,
+        etag=sha256,
+        conditional=True,
+        max_age=31536000
+    )
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
@@ -0,0 +1,458 @@
+"""
+Content store for journal bodies and attachments.
+
+Short journal bodies stay inline in journal_entries.content. Bodies longer
+than INLINE_LIMIT characters are compressed into the separate
+journal_contents table and journal_entries.content only keeps a preview, so
+list queries and scans over journal_entries never drag long texts through
+the page cache.
+
+Keyword search over compressed bodies goes through journal_search_index, which
+holds only the words of each body: a contentless FTS5 table on SQLite, a
+stripped tsvector on PostgreSQL. It narrows a search to the entries containing
+the words (or word beginnings) of the term, and only those bodies are
+decompressed to check the exact match. A term that starts in the middle of a
+word is still found in titles, tags and the inline preview, not in the rest of
+a long body. Other databases have no index and only search the preview.
+
+Compression uses zstd with a dictionary trained on our own Czech entries when
+the zstandard package and a trained dictionary are available, and zlib with a
+built-in Czech preset dictionary otherwise. The codec is recorded per row, so
+both can be read back at any time.
+
+Attachments (photos) are stored once per content hash on disk and served
+with sendfile by the WSGI server.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import zlib
+from datetime import datetime
+
+from sqlalchemy import inspect, select, text as sql_text
+from src.models.user import db, JournalEntry
+from src import sharding
+
+try:
+    import zstandard
+except ImportError:  # zlib with the preset dictionary is always available
+    zstandard = None
+
+INLINE_LIMIT = int(os.getenv('KOLO_JOURNAL_INLINE_LIMIT', 1024))
+PREVIEW_LENGTH = 300
+# Every trained dictionary is kept as journal-cs-<dict id>.zdict so older rows stay
+# readable, journal-cs.zdict is the one used for new writes
+ZSTD_DICT_DIR = os.getenv(
+    'KOLO_ZSTD_DICT_DIR',
+    os.path.join(os.path.dirname(__file__), 'database')
+)
+ZSTD_DICT_PATH = os.path.join(ZSTD_DICT_DIR, 'journal-cs.zdict')
+ATTACHMENT_DIR = os.getenv(
+    'KOLO_ATTACHMENT_DIR',
+    os.path.join(os.path.dirname(__file__), 'database', 'attachments')
+)
+MAX_ATTACHMENT_BYTES = 10 * 1024 * 1024
+ATTACHMENT_MIMETYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/gif', 'image/heic'}
+
+# zlib preset dictionary: frequent Czech words and phrases of journal entries.
+# zlib prefers the most common strings at the end of the dictionary.
+ZLIB_CS_DICTIONARY = (
+    'protože, ale, nebo, když, jsem byl, jsem byla, jsme byli, bylo to, '
+    'ráno, večer, odpoledne, dopoledne, v noci, o víkendu, v práci, doma, venku, '
+    'procházka, procházku, les, lesem, park, příroda, zahrada, moře, hory, '
+    'káva, kávu, čaj, snídaně, oběd, večeře, jídlo, vařil jsem, vařila jsem, '
+    'rodina, rodinou, děti, dětmi, maminka, tatínek, přítel, přítelkyně, kamarád, kamarádka, '
+    'kolegové, kolegy, šéf, porada, projekt, úkol, úkoly, termín, stres, únava, '
+    'spánek, vyspal jsem se, vyspala jsem se, cvičení, běh, jóga, meditace, dech, '
+    'cítím se, cítil jsem se, cítila jsem se, mám radost, měl jsem radost, měla jsem radost, '
+    'jsem vděčný, jsem vděčná, vděčnost, radost, klid, pohoda, smutek, úzkost, energie, '
+    'dnes jsem, dneska jsem, dnes mi, dnes byl, dnes byla, dnešní den, celý den, '
+    'velmi, hodně, trochu, opravdu, konečně, zase, ještě, už, také, taky, '
+    'který, která, které, jsem si, jsem se, jsme se, mi to, to bylo, '
+    'a pak jsem, a potom, a také, a to, a jsem, se mi, si to, je to, '
+)
+
+CODEC_RAW = 'raw'
+CODEC_ZLIB = 'zlib-cs1'
+
+SEARCH_INDEX = 'journal_search_index'
+# Same word boundaries as the FTS5 unicode61 tokenizer
+_WORD = re.compile(r'[^\W_]+')
+# Statements of the search index per dialect, documents are keyed by entry id
+SEARCH_INDEX_SQL = {
+    'sqlite': {
+        'create': [
+            f"CREATE VIRTUAL TABLE {SEARCH_INDEX} USING fts5(body, content='', detail=none)",
+        ],
+        'insert': f'INSERT INTO {SEARCH_INDEX} (rowid, body) VALUES (:entry_id, :body)',
+        # A contentless table removes a document given the text it indexed
+        'delete': f"INSERT INTO {SEARCH_INDEX} ({SEARCH_INDEX}, rowid, body) VALUES ('delete', :entry_id, :body)",
+        'match': f'SELECT rowid AS entry_id FROM {SEARCH_INDEX} WHERE {SEARCH_INDEX} MATCH :query',
+        'word': '"{}"*',
+        'and': ' ',
+    },
+    'postgresql': {
+        'create': [
+            f'CREATE TABLE {SEARCH_INDEX} (entry_id INTEGER PRIMARY KEY '
+            f'REFERENCES journal_entries (id) ON DELETE CASCADE, terms TSVECTOR NOT NULL)',
+            f'CREATE INDEX ix_{SEARCH_INDEX}_terms ON {SEARCH_INDEX} USING gin (terms)',
+        ],
+        'insert': f"INSERT INTO {SEARCH_INDEX} (entry_id, terms) VALUES (:entry_id, strip(to_tsvector('simple', :body))) "
+                  f'ON CONFLICT (entry_id) DO UPDATE SET terms = excluded.terms',
+        'delete': f'DELETE FROM {SEARCH_INDEX} WHERE entry_id = :entry_id',
+        'match': f"SELECT entry_id FROM {SEARCH_INDEX} WHERE terms @@ to_tsquery('simple', :query)",
+        'word': '{}:*',
+        'and': ' & ',
+    },
+}
+
+
+class JournalContent(db.Model):
+    __tablename__ = 'journal_contents'
+
+    entry_id = db.Column(db.Integer, db.ForeignKey('journal_entries.id', ondelete='CASCADE'), primary_key=True)
+    codec = db.Column(db.String(20), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
+class JournalAttachment(db.Model):
+    __tablename__ = 'journal_attachments'
+
+    id = db.Column(db.Integer, primary_key=True)
+    entry_id = db.Column(db.Integer, db.ForeignKey('journal_entries.id', ondelete='CASCADE'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    mimetype = db.Column(db.String(50), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'entry_id': self.entry_id,
+            'sha256': self.sha256,
+            'mimetype': self.mimetype,
+            'size': self.size,
+            'filename': self.filename,
+            'url': f'/api/attachments/{self.sha256}',
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class _Codecs:
+    """Compressors for writing and decompressors for every codec ever written"""
+
+    def __init__(self):
+        self._zstd_dict = None
+        self._zstd_loaded = False
+        self._zstd_by_id = {}
+
+    def zstd_dictionary(self):
+        """Dictionary used for new writes, or None to fall back to zlib"""
+        if not self._zstd_loaded:
+            self._zstd_loaded = True
+            if zstandard is not None and os.path.exists(ZSTD_DICT_PATH):
+                with open(ZSTD_DICT_PATH, 'rb') as f:
+                    self._zstd_dict = zstandard.ZstdCompressionDict(f.read())
+        return self._zstd_dict
+
+    def zstd_dictionary_by_id(self, dict_id):
+        if dict_id not in self._zstd_by_id:
+            path = os.path.join(ZSTD_DICT_DIR, f'journal-cs-{dict_id}.zdict')
+            try:
+                with open(path, 'rb') as f:
+                    self._zstd_by_id[dict_id] = zstandard.ZstdCompressionDict(f.read())
+            except FileNotFoundError:
+                raise RuntimeError(f'zstd dictionary {dict_id} is missing, restore {path} '
+                                   f'(KOLO_ZSTD_DICT_DIR) to read these journal bodies') from None
+        return self._zstd_by_id[dict_id]
+
+    def compress(self, text):
+        raw = text.encode('utf-8')
+        dictionary = self.zstd_dictionary()
+        if dictionary is not None:
+            codec = f'zstd-{dictionary.dict_id()}'
+            data = zstandard.ZstdCompressor(level=9, dict_data=dictionary).compress(raw)
+        else:
+            codec = CODEC_ZLIB
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY,
+                                          ZLIB_CS_DICTIONARY.encode('utf-8'))
+            data = compressor.compress(raw) + compressor.flush()
+
+        if len(data) >= len(raw):
+            return CODEC_RAW, raw
+        return codec, data
+
+    def decompress(self, codec, data):
+        if codec == CODEC_RAW:
+            raw = data
+        elif codec == CODEC_ZLIB:
+            decompressor = zlib.decompressobj(-15, ZLIB_CS_DICTIONARY.encode('utf-8'))
+            raw = decompressor.decompress(data) + decompressor.flush()
+        elif codec.startswith('zstd-'):
+            if zstandard is None:
+                raise RuntimeError(f'zstandard is required to read journal codec {codec}')
+            dictionary = self.zstd_dictionary_by_id(int(codec[len('zstd-'):]))
+            raw = zstandard.ZstdDecompressor(dict_data=dictionary).decompress(data)
+        else:
+            raise RuntimeError(f'Unknown journal codec {codec}')
+        return raw.decode('utf-8')
+
+
+codecs = _Codecs()
+
+
+def preview(text):
+    return text if len(text) <= PREVIEW_LENGTH else text[:PREVIEW_LENGTH]
+
+
+def _index_connection():
+    # Routed like JournalContent, which lives on the user's shard
+    return db.session.connection(bind_arguments={'mapper': JournalContent})
+
+
+def index_bodies(bodies, connection=None):
+    """Add full bodies {entry id: text} to the search index"""
+    connection = connection or _index_connection()
+    statements = SEARCH_INDEX_SQL.get(connection.dialect.name)
+    if statements and bodies:
+        connection.execute(sql_text(statements['insert']),
+                           [{'entry_id': entry_id, 'body': body} for entry_id, body in bodies.items()])
+
+
+def _unindex(connection, rows):
+    """Take stored bodies, rows of (entry_id, codec, data), out of the search index"""
+    statements = SEARCH_INDEX_SQL.get(connection.dialect.name)
+    if not statements or not rows:
+        return
+    if connection.dialect.name == 'sqlite':
+        params = [{'entry_id': row.entry_id, 'body': codecs.decompress(row.codec, row.data)} for row in rows]
+    else:
+        params = [{'entry_id': row.entry_id} for row in rows]
+    connection.execute(sql_text(statements['delete']), params)
+
+
+def create_search_index(engine, batch_size=500):
+    """Create the search index on a database and index the bodies stored before it
+
+    Returns the number of indexed bodies, 0 when the index already exists.
+    """
+    statements = SEARCH_INDEX_SQL.get(engine.dialect.name)
+    if statements is None or inspect(engine).has_table(SEARCH_INDEX):
+        return 0
+    table = JournalContent.__table__
+    indexed = 0
+    try:
+        with engine.begin() as connection:
+            for statement in statements['create']:
+                connection.execute(sql_text(statement))
+            last_id = 0
+            while True:
+                rows = connection.execute(
+                    select(table.c.entry_id, table.c.codec, table.c.data)
+                    .where(table.c.entry_id > last_id).order_by(table.c.entry_id).limit(batch_size)
+                ).all()
+                if not rows:
+                    return indexed
+                index_bodies({row.entry_id: codecs.decompress(row.codec, row.data) for row in rows}, connection)
+                last_id = rows[-1].entry_id
+                indexed += len(rows)
+    except Exception as e:
+        # e.g. SQLite built without FTS5, search would miss every long body
+        raise RuntimeError(f'Cannot create {SEARCH_INDEX} on {engine.url.database}: {e}') from e
+
+
+def set_content(entry, text):
+    """Store the body of a journal entry, inline or compressed out of line
+
+    The entry must already have an id (flush before calling for new entries).
+    """
+    stored = db.session.get(JournalContent, entry.id)
+    if stored is not None:
+        _unindex(_index_connection(), [stored])
+    if len(text) <= INLINE_LIMIT:
+        entry.content = text
+        if stored is not None:
+            db.session.delete(stored)
+        return
+
+    codec, data = codecs.compress(text)
+    entry.content = preview(text)
+    if stored is None:
+        db.session.add(JournalContent(entry_id=entry.id, codec=codec, size=len(text), data=data))
+    else:
+        stored.codec = codec
+        stored.size = len(text)
+        stored.data = data
+    index_bodies({entry.id: text})
+
+
+def delete_content(entry_id):
+    stored = db.session.get(JournalContent, entry_id)
+    if stored is not None:
+        _unindex(_index_connection(), [stored])
+        db.session.delete(stored)
+
+
+def load_contents(entry_ids):
+    """Full bodies of the entries stored out of line, by entry id, in one query"""
+    if not entry_ids:
+        return {}
+    rows = JournalContent.query.filter(JournalContent.entry_id.in_(list(entry_ids))).all()
+    return {row.entry_id: codecs.decompress(row.codec, row.data) for row in rows}
+
+
+def entries_to_dicts(entries):
+    """to_dict() of journal entries with their full content"""
+    contents = load_contents([entry.id for entry in entries])
+    result = []
+    for entry in entries:
+        data = entry.to_dict()
+        if entry.id in contents:
+            data['content'] = contents[entry.id]
+        result.append(data)
+    return result
+
+
+def entry_to_dict(entry):
+    return entries_to_dicts([entry])[0]
+
+
+def full_content(entry):
+    return load_contents([entry.id]).get(entry.id, entry.content)
+
+
+def project_contents(rows, length=None):
+    """Replace the previews in projected rows with full bodies, cut to length"""
+    if length and length <= PREVIEW_LENGTH:
+        return rows
+    contents = load_contents([row['id'] for row in rows])
+    for row in rows:
+        if row['id'] in contents:
+            text = contents[row['id']]
+            row['content'] = text[:length] if length else text
+    return rows
+
+
+def matching_entry_ids(user_id, term):
+    """Ids of the user's out-of-line entries whose full body contains term
+
+    The search index picks the candidates, only their bodies are decompressed.
+    """
+    words = _WORD.findall(term)
+    statements = SEARCH_INDEX_SQL.get(_index_connection().dialect.name)
+    if not words or statements is None:
+        return []
+    query = statements['and'].join(statements['word'].format(word) for word in words)
+    candidates = sql_text(statements['match']).bindparams(query=query).columns(entry_id=db.Integer)
+    rows = db.session.query(JournalContent.entry_id, JournalContent.codec, JournalContent.data).join(
+        JournalEntry, JournalEntry.id == JournalContent.entry_id
+    ).filter(JournalEntry.user_id == user_id, JournalContent.entry_id.in_(candidates))
+    needle = term.casefold()
+    return [entry_id for entry_id, codec, data in rows if needle in codecs.decompress(codec, data).casefold()]
+
+
+def _unindex_user(connection, user_id):
+    table = JournalContent.__table__
+    _unindex(connection, connection.execute(
+        select(table.c.entry_id, table.c.codec, table.c.data).where(sharding.user_filter(table, user_id))
+    ).all())
+
+
+def _index_moved_user(user_id, id_maps):
+    """Index the bodies of a user copied onto their shard with new ids"""
+    with sharding.using_user(user_id):
+        rows = db.session.query(JournalContent.entry_id, JournalContent.codec, JournalContent.data).join(
+            JournalEntry, JournalEntry.id == JournalContent.entry_id
+        ).filter(JournalEntry.user_id == user_id).all()
+        index_bodies({entry_id: codecs.decompress(codec, data) for entry_id, codec, data in rows})
+        db.session.commit()
+
+
+sharding.DELETE_HOOKS.append(_unindex_user)
+sharding.MOVE_HOOKS.append(_index_moved_user)
+
+
+def compact_existing(batch_size=500):
+    """Move long inline bodies of existing entries into the content store"""
+    moved = 0
+    last_id = 0
+    while True:
+        entries = JournalEntry.query.filter(
+            JournalEntry.id > last_id,
+            db.func.length(JournalEntry.content) > INLINE_LIMIT
+        ).order_by(JournalEntry.id).limit(batch_size).all()
+        if not entries:
+            return moved
+        for entry in entries:
+            set_content(entry, entry.content)
+            last_id = entry.id
+        db.session.commit()
+        moved += len(entries)
+
+
+def train_zstd_dictionary(size=64 * 1024, sample_limit=20000):
+    """Train a zstd dictionary on existing journal bodies and save it"""
+    if zstandard is None:
+        raise RuntimeError('zstandard is not installed')
+
+    samples = []
+    for entry in JournalEntry.query.order_by(JournalEntry.id.desc()).limit(sample_limit):
+        samples.append(full_content(entry).encode('utf-8'))
+
+    dictionary = zstandard.train_dictionary(size, samples)
+    os.makedirs(ZSTD_DICT_DIR, exist_ok=True)
+    for path in (os.path.join(ZSTD_DICT_DIR, f'journal-cs-{dictionary.dict_id()}.zdict'), ZSTD_DICT_PATH):
+        with open(path, 'wb') as f:
+            f.write(dictionary.as_bytes())
+
+    # Start compressing with the new dictionary in this process
+    codecs._zstd_loaded = False
+    return dictionary.dict_id()
+
+
+def attachment_path(sha256):
+    return os.path.join(ATTACHMENT_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+def store_attachment(stream):
+    """Write an upload to content-addressed storage, returns (sha256, size)"""
+    os.makedirs(ATTACHMENT_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=ATTACHMENT_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            while True:
+                chunk = stream.read(64 * 1024)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_ATTACHMENT_BYTES:
+                    raise ValueError('Attachment is too large')
+                digest.update(chunk)
+                tmp.write(chunk)
+
+        sha256 = digest.hexdigest()
+        path = attachment_path(sha256)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return sha256, size
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def remove_attachment_file_if_unused(sha256):
+    if JournalAttachment.query.filter_by(sha256=sha256).first() is None:
+        try:
+            os.remove(attachment_path(sha256))
+        except FileNotFoundError:
+            pass
@@ -1,70 +1,263 @@
 import os
 import sys
+from datetime import timedelta
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
+import click
+from flask import Flask, jsonify
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager
-from src.models.user import db
+from src.models.user import db, User
 from src.routes.user import user_bp
-from src.routes.auth import auth_bp, oauth
+from src.routes.auth import auth_bp
 from src.routes.wellness import wellness_bp
 from src.routes.journal import journal_bp
 from src.routes.inspiration import inspiration_bp
+from src.routes.reminders import reminders_bp
+from src.routes.notifications import notifications_bp
+from src.routes.imports import imports_bp
+from src.routes.activity import activity_bp
+from src.serving import configure_sqlite_engine
+from src.schema import init_db
+from src.provisioning import import_users_csv
+from src.static_assets import StaticAssetManifest, precompress
+from src.token_blocklist import CachingJWTManager, blocklist
+from src import compression
+from src import journal_store
+from src import semantic_index
+from src.reminder_scheduler import ReminderScheduler
+from src.push_delivery import push_daily_inspiration
+from src import sharding
+from src import replicas
+from src import archive
+from src import activity_calendar
+from src import profiler
+from src import backup
 
-app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
-
-# Configuration
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-string')
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = False  # For demo purposes
-
-# Enable CORS for all routes
-CORS(app, origins="*")
-
-# Initialize JWT
-jwt = JWTManager(app)
-
-# Initialize OAuth
-oauth.init_app(app)
-
-# Register blueprints
-app.register_blueprint(user_bp, url_prefix='/api')
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(wellness_bp, url_prefix='/api')
-app.register_blueprint(journal_bp, url_prefix='/api')
-app.register_blueprint(inspiration_bp, url_prefix='/api/inspiration')
-
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
-
-# Create tables
-with app.app_context():
-    db.create_all()
-
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
-            return "Static folder not configured", 404
-
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
+
+def create_app(config=None):
+    """Create and configure the Flask application
+
+    Heavy optional dependencies (OpenAI SDK, Authlib, requests) are imported
+    on first use by the blueprints, not here. The schema is only checked when
+    KOLO_INIT_SCHEMA is enabled; under gunicorn it runs once in the master
+    process instead of in every worker (see src/gunicorn_config.py).
+    """
+    app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+
+    # Configuration
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+    app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-string')
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(minutes=int(os.getenv('JWT_ACCESS_TOKEN_MINUTES', 15)))
+    app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=int(os.getenv('JWT_REFRESH_TOKEN_DAYS', 30)))
+
+    # Database configuration
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
+        'DATABASE_URL',
+        f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+    )
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['KOLO_INIT_SCHEMA'] = os.getenv('KOLO_INIT_SCHEMA', '1') == '1'
+    # Extra databases holding per-user data, see src/sharding.py,
+    # and read replicas of the default database, see src/replicas.py
+    app.config['SQLALCHEMY_BINDS'] = {**sharding.binds_from_env(), **replicas.binds_from_env()}
+
+    if config:
+        app.config.update(config)
+
+    # Enable CORS for all routes
+    CORS(app, origins="*", expose_headers=['ETag'])
+
+    # Compress large API responses
+    compression.init_app(app)
+
+    # Per-request profile capture, only with KOLO_PROFILE_SECRET set
+    profiler.init_app(app)
+
+    # Initialize JWT
+    jwt = CachingJWTManager(app)
+
+    @jwt.token_in_blocklist_loader
+    def check_if_token_revoked(jwt_header, jwt_payload):
+        return blocklist.is_revoked(jwt_payload['jti'])
+
+    # Register blueprints
+    app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(wellness_bp, url_prefix='/api')
+    app.register_blueprint(journal_bp, url_prefix='/api')
+    app.register_blueprint(inspiration_bp, url_prefix='/api/inspiration')
+    app.register_blueprint(reminders_bp, url_prefix='/api')
+    app.register_blueprint(notifications_bp, url_prefix='/api')
+    app.register_blueprint(imports_bp, url_prefix='/api')
+    app.register_blueprint(activity_bp, url_prefix='/api')
+
+    db.init_app(app)
+
+    with app.app_context():
+        for shard in sharding.shard_names():
+            configure_sqlite_engine(sharding.shard_engine(shard))
+        if app.config['KOLO_INIT_SCHEMA']:
+            init_db()
+
+    @app.errorhandler(sharding.ShardMoving)
+    def user_moving(e):
+        return jsonify({'error': 'Your data is being moved, try again in a few seconds'}), 503, {'Retry-After': '10'}
+
+    register_commands(app)
+
+    # In-memory manifest of the React build, scanned once per process
+    static_assets = StaticAssetManifest(app.static_folder)
+
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve(path):
+        return static_assets.serve(path)
+
+    # Health check endpoint
+    @app.route('/health')
+    def health_check():
+        return {'status': 'healthy', 'message': 'Kolo Pohody API is running'}
+
+    return app
+
+
+def register_commands(app):
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create missing tables and indexes"""
+        init_db()
+        print('Database schema is up to date')
+
+    @app.cli.command('prune-revoked-tokens')
+    def prune_revoked_tokens():
+        """Remove revocations of already expired tokens"""
+        print(f'Pruned {blocklist.prune_expired()} revoked tokens')
+
+    @app.cli.command('import-users')
+    @click.argument('csv_file', type=click.File('r', encoding='utf-8'))
+    @click.option('--provider', default='import', help='Provider for rows without one')
+    def import_users(csv_file, provider):
+        """Bulk-create users with default categories from a CSV file"""
+        result = import_users_csv(csv_file, default_provider=provider)
+        print(f"Created {result['created']} users, {result['invalid']} invalid rows")
+
+    @app.cli.command('compact-journal')
+    def compact_journal():
+        """Move long journal bodies of existing entries into the compressed content store"""
+        moved = 0
+        for shard in sharding.shard_names():
+            with sharding.using_shard(shard):
+                moved += journal_store.compact_existing()
+        print(f'Moved {moved} journal bodies')
+
+    @app.cli.command('train-journal-dictionary')
+    def train_journal_dictionary():
+        """Train the zstd dictionary for journal bodies on existing entries"""
+        # Samples come from the default database, which holds every user from before sharding
+        with sharding.using_shard(sharding.DEFAULT_SHARD):
+            print(f'Trained zstd dictionary {journal_store.train_zstd_dictionary()}')
+
+    @app.cli.command('index-journal')
+    @click.option('--user-id', type=int, default=None, help='Only rebuild this user')
+    def index_journal(user_id):
+        """Rebuild the semantic search index of journal entries"""
+        user_ids = [user_id] if user_id else [row[0] for row in db.session.query(User.id)]
+        entries = 0
+        for uid in user_ids:
+            with sharding.using_user(uid):
+                entries += semantic_index.rebuild_user(uid)
+            db.session.expunge_all()
+        print(f'Indexed {entries} journal entries of {len(user_ids)} users')
+
+    @app.cli.command('archive-old')
+    @click.option('--days', type=int, default=None, help='Archive rows older than this many days')
+    @click.option('--user-id', type=int, default=None, help='Only archive this user')
+    def archive_old(days, user_id):
+        """Move old wellness entries and inspirations into archive partitions"""
+        before = archive.horizon(days)
+        user_ids = [user_id] if user_id else [row[0] for row in db.session.query(User.id)]
+        rows = 0
+        for uid in user_ids:
+            with sharding.using_user(uid):
+                rows += archive.archive_user(uid, before)
+            db.session.expunge_all()
+        print(f'Archived {rows} rows older than {before.isoformat()} of {len(user_ids)} users')
+
+    @app.cli.command('rebuild-calendars')
+    @click.option('--user-id', type=int, default=None, help='Only rebuild this user')
+    def rebuild_calendars(user_id):
+        """Recompute the activity calendars behind streaks and heatmaps"""
+        user_ids = [user_id] if user_id else [row[0] for row in db.session.query(User.id)]
+        years = 0
+        for uid in user_ids:
+            with sharding.using_user(uid):
+                years += activity_calendar.rebuild_user(uid)
+            db.session.expunge_all()
+        print(f'Rebuilt {years} calendar years of {len(user_ids)} users')
+
+    @app.cli.command('run-reminders')
+    @click.option('--once', is_flag=True, help='Fire what is due now and exit')
+    def run_reminders(once):
+        """Run the reminder scheduler"""
+        scheduler = ReminderScheduler(app)
+        if once:
+            print(f'Delivered {scheduler.run_once()} reminders')
         else:
-            return "index.html not found", 404
+            scheduler.run_forever()
+
+    @app.cli.command('push-daily-inspiration')
+    @click.option('--generic', is_flag=True, help='Skip personalization')
+    def push_daily_inspiration_command(generic):
+        """Push today's inspiration to every subscribed user"""
+        print(f'Push fan-out: {push_daily_inspiration(personalized=not generic)}')
+
+    @app.cli.command('move-user')
+    @click.argument('user_id', type=int)
+    @click.argument('shard')
+    def move_user(user_id, shard):
+        """Move a user's data to another shard while the app keeps running"""
+        copied = sharding.move_user(user_id, shard)
+        # Entry ids change on the target shard
+        semantic_index.drop_user(user_id)
+        print(f'Moved user {user_id} to {shard}, {copied} rows copied')
+
+    @app.cli.command('backup')
+    @click.option('--dir', 'directory', default=None, help='Target directory, a new timestamped one by default')
+    @click.option('--pages', type=int, default=backup.BACKUP_PAGES, help='Pages copied per step')
+    @click.option('--sleep-ms', type=float, default=backup.BACKUP_SLEEP * 1000, help='Pause between steps')
+    def backup_command(directory, pages, sleep_ms):
+        """Back up all SQLite databases while the app keeps writing"""
+        print(f'Backup written to {backup.backup_all(directory, pages, sleep_ms / 1000)}')
+
+    @app.cli.command('snapshot-user')
+    @click.argument('user_id', type=int)
+    @click.argument('path')
+    def snapshot_user(user_id, path):
+        """Write one user's data at this point in time into a SQLite file"""
+        counts = backup.snapshot_user(user_id, path)
+        print(f'Snapshot of user {user_id} in {path}: {sum(counts.values())} rows')
+
+    @app.cli.command('restore-user')
+    @click.argument('path')
+    @click.option('--user-id', type=int, default=None, help='Check the snapshot belongs to this user')
+    def restore_user(path, user_id):
+        """Replace a user's wellness, journal and inspiration data with a snapshot"""
+        print(f'Restored {backup.restore_user(path, user_id)} rows')
+
+    @app.cli.command('profile-token')
+    @click.option('--ttl', type=int, default=600, help='Seconds the token stays valid')
+    def profile_token(ttl):
+        """Print an X-Kolo-Profile header value for per-request profiling"""
+        print(f'{profiler.HEADER}: {profiler.make_token(ttl)}')
+
+    @app.cli.command('precompress-static')
+    def precompress_static():
+        """Write gzip/brotli variants of the static build next to the originals"""
+        print(f'Wrote {precompress(app.static_folder)} precompressed files')
+
 
-# Health check endpoint
-@app.route('/health')
-def health_check():
-    return {'status': 'healthy', 'message': 'Kolo Pohody API is running'}
+app = create_app()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,50 @@
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from src.models.user import db
+from src.push_delivery import PushSubscription, save_subscription, VAPID_PUBLIC_KEY
+
+notifications_bp = Blueprint('notifications', __name__)
+
+@notifications_bp.route('/push/vapid-public-key', methods=['GET'])
+def get_vapid_public_key():
+    """Application server key for PushManager.subscribe()"""
+    if not VAPID_PUBLIC_KEY:
+        return jsonify({'error': 'Push notifications are not configured'}), 503
+    return jsonify({'public_key': VAPID_PUBLIC_KEY})
+
+@notifications_bp.route('/push/subscriptions', methods=['GET'])
+@jwt_required()
+def get_push_subscriptions():
+    """List push subscriptions of current user"""
+    current_user_id = get_jwt_identity()
+    subscriptions = PushSubscription.query.filter_by(user_id=current_user_id).all()
+    return jsonify([subscription.to_dict() for subscription in subscriptions])
+
+@notifications_bp.route('/push/subscriptions', methods=['POST'])
+@jwt_required()
+def create_push_subscription():
+    """Register a browser push subscription"""
+    current_user_id = get_jwt_identity()
+    data = request.get_json()
+
+    keys = (data or {}).get('keys') or {}
+    if not data or not data.get('endpoint') or not keys.get('p256dh') or not keys.get('auth'):
+        return jsonify({'error': 'endpoint and keys.p256dh, keys.auth are required'}), 400
+    if not data['endpoint'].startswith('https://'):
+        return jsonify({'error': 'Invalid push endpoint'}), 400
+
+    subscription = save_subscription(current_user_id, data)
+    return jsonify(subscription.to_dict()), 201
+
+@notifications_bp.route('/push/subscriptions', methods=['DELETE'])
+@jwt_required()
+def delete_push_subscription():
+    """Remove a browser push subscription by endpoint"""
+    current_user_id = get_jwt_identity()
+    data = request.get_json()
+    if not data or not data.get('endpoint'):
+        return jsonify({'error': 'endpoint is required'}), 400
+
+    PushSubscription.query.filter_by(user_id=current_user_id, endpoint=data['endpoint']).delete()
+    db.session.commit()
+    return '', 204
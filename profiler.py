@@ -0,0 +1,211 @@
+"""
+On-demand sampling profiler.
+
+A sampler thread reads the stacks of the other threads with
+sys._current_frames() at a fixed interval and counts them as folded stacks,
+one `frame;frame;frame count` line per distinct stack, ready for
+flamegraph.pl, speedscope or inferno. Nothing is sampled while it is off.
+
+Whole worker: send SIGUSR2 to a worker process (never to the gunicorn master,
+which uses it for upgrades) to start sampling all its threads, and again to
+stop and write the file. Sampling also stops by itself after
+KOLO_PROFILE_MAX_SECONDS.
+
+    kill -USR2 <worker pid>
+
+Single request: with KOLO_PROFILE_SECRET set, a request carrying a valid
+X-Kolo-Profile header (see `flask profile-token`) is sampled at a higher rate
+on its own thread; the response names the written file in
+X-Kolo-Profile-File. Without the secret no request hook is installed.
+
+Files go to KOLO_PROFILE_DIR. Threads are OS threads, so under the gevent
+worker class only the worker-wide profile is meaningful.
+"""
+import hashlib
+import hmac
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+PROFILE_DIR = os.getenv(
+    'KOLO_PROFILE_DIR',
+    os.path.join(os.path.dirname(__file__), 'database', 'profiles')
+)
+PROFILE_SECRET = os.getenv('KOLO_PROFILE_SECRET', '')
+WORKER_INTERVAL = float(os.getenv('KOLO_PROFILE_INTERVAL_MS', 10)) / 1000
+REQUEST_INTERVAL = 0.001
+MAX_SECONDS = int(os.getenv('KOLO_PROFILE_MAX_SECONDS', 300))
+REQUEST_MAX_SECONDS = 120
+HEADER = 'X-Kolo-Profile'
+
+
+class Sampler(threading.Thread):
+    """Counts folded stacks of all other threads, or of one thread"""
+
+    def __init__(self, interval, label, thread_id=None, max_seconds=MAX_SECONDS):
+        super().__init__(name='kolo-profiler', daemon=True)
+        self.interval = interval
+        self.label = label
+        self.thread_id = thread_id
+        self.max_seconds = max_seconds
+        self.stacks = Counter()
+        self.samples = 0
+        self.path = None
+        self._labels = {}
+        self._halt = threading.Event()
+
+    def _frame_label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+        return label
+
+    def _fold(self, thread_name, frame):
+        labels = []
+        while frame is not None:
+            labels.append(self._frame_label(frame.f_code))
+            frame = frame.f_back
+        labels.append(thread_name)
+        return ';'.join(reversed(labels))
+
+    def _sample(self, own_id):
+        frames = sys._current_frames()
+        if self.thread_id is not None:
+            frame = frames.get(self.thread_id)
+            if frame is not None:
+                self.stacks[self._fold('request', frame)] += 1
+            return
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in frames.items():
+            if thread_id != own_id:
+                self.stacks[self._fold(names.get(thread_id, str(thread_id)), frame)] += 1
+
+    def run(self):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.max_seconds
+        while not self._halt.wait(self.interval):
+            self._sample(own_id)
+            self.samples += 1
+            if time.monotonic() > deadline:
+                break
+        self.path = self._write()
+
+    def _write(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(PROFILE_DIR, f'{socket.gethostname()}-{os.getpid()}-{stamp}-{self.label}.folded')
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        return path
+
+    def halt(self):
+        """Stop sampling, the file is written on the sampler thread"""
+        self._halt.set()
+
+    def stop(self):
+        """Stop sampling and wait for the file, returns its path"""
+        self.halt()
+        self.join()
+        return self.path
+
+
+class WorkerProfiler:
+    """Worker-wide sampling switched on and off with a signal"""
+
+    def __init__(self):
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    def running(self):
+        return self._sampler is not None and self._sampler.is_alive()
+
+    def start(self, interval=WORKER_INTERVAL, max_seconds=MAX_SECONDS):
+        with self._lock:
+            if not self.running():
+                self._sampler = Sampler(interval, 'worker', max_seconds=max_seconds)
+                self._sampler.start()
+
+    def stop(self):
+        with self._lock:
+            sampler, self._sampler = self._sampler, None
+        if sampler is not None:
+            # Called from a signal handler, do not wait for the file here
+            sampler.halt()
+        return sampler
+
+    def toggle(self, *args):
+        if self.running():
+            self.stop()
+            print(f'Profiler stopped in worker {os.getpid()}, writing to {PROFILE_DIR}')
+        else:
+            self.start()
+            print(f'Profiler started in worker {os.getpid()}')
+
+
+worker_profiler = WorkerProfiler()
+
+
+def install_signal_handler(signum=signal.SIGUSR2):
+    """Toggle worker-wide sampling on a signal, call in every worker process"""
+    signal.signal(signum, worker_profiler.toggle)
+
+
+def _sign(expires):
+    return hmac.new(PROFILE_SECRET.encode('utf-8'), f'kolo-profile:{expires}'.encode('utf-8'),
+                    hashlib.sha256).hexdigest()
+
+
+def make_token(ttl_seconds=600):
+    """Value of the X-Kolo-Profile header, valid for ttl_seconds"""
+    if not PROFILE_SECRET:
+        raise RuntimeError('KOLO_PROFILE_SECRET is not set')
+    expires = int(time.time()) + ttl_seconds
+    return f'{expires}.{_sign(expires)}'
+
+
+def valid_token(token):
+    expires, _, signature = token.partition('.')
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _sign(int(expires)))
+
+
+def _start_request_profile():
+    token = request.headers.get(HEADER)
+    if token and valid_token(token):
+        label = request.endpoint or 'request'
+        g.kolo_profile = Sampler(REQUEST_INTERVAL, label, thread_id=threading.get_ident(),
+                                 max_seconds=REQUEST_MAX_SECONDS)
+        g.kolo_profile.start()
+
+
+def _finish_request_profile(response):
+    sampler = g.pop('kolo_profile', None)
+    if sampler is not None:
+        path = sampler.stop()
+        response.headers['X-Kolo-Profile-File'] = os.path.basename(path)
+        response.headers['X-Kolo-Profile-Samples'] = str(sampler.samples)
+    return response
+
+
+def _abandon_request_profile(exc):
+    # Requests that raised past the error handlers still stop their sampler
+    sampler = g.pop('kolo_profile', None)
+    if sampler is not None:
+        sampler.stop()
+
+
+def init_app(app):
+    """Register per-request capture when a profile secret is configured"""
+    if not PROFILE_SECRET:
+        return
+    app.before_request(_start_request_profile)
+    app.after_request(_finish_request_profile)
+    app.teardown_request(_abandon_request_profile)
@@ -0,0 +1,109 @@
+"""
+Sparse field selection for list endpoints.
+
+List endpoints accept either `fields=id,title,entry_date` or `view=summary`.
+The projection is pushed down into SQL: only the requested columns are
+selected, and long text columns are cut with SUBSTR in the database so the
+full body never leaves it. Without either parameter the endpoint returns its
+full representation as before.
+
+    ?view=summary                  the endpoint's summary fields, text cut to 200 chars
+    ?fields=id,content&truncate=80 chosen fields, text cut to 80 chars
+"""
+import json
+from datetime import date, datetime
+
+from flask import request
+from sqlalchemy import func
+
+SUMMARY_TEXT_LENGTH = 200
+
+
+class ProjectionError(ValueError):
+    pass
+
+
+class Projection:
+    """Selectable fields of one endpoint
+
+    columns maps public field names to SQL column expressions, text_fields
+    names the fields that may be truncated and json_fields those stored as
+    JSON strings (decoded on output).
+    """
+
+    def __init__(self, columns, summary, text_fields=(), json_fields=()):
+        self.columns = columns
+        self.summary = summary
+        self.text_fields = set(text_fields)
+        self.json_fields = set(json_fields)
+
+    def requested(self):
+        """Field names requested by the current request, or None for the full representation"""
+        fields = request.args.get('fields', '').strip()
+        view = request.args.get('view', '').strip()
+
+        if fields:
+            names = [name.strip() for name in fields.split(',') if name.strip()]
+            unknown = [name for name in names if name not in self.columns]
+            if unknown:
+                raise ProjectionError(f"Unknown fields: {', '.join(unknown)}")
+        elif view == 'summary':
+            names = list(self.summary)
+        elif view in ('', 'full'):
+            return None
+        else:
+            raise ProjectionError(f'Unknown view: {view}')
+
+        if 'id' in self.columns and 'id' not in names:
+            names.insert(0, 'id')
+        return names
+
+    def truncate_length(self):
+        default = SUMMARY_TEXT_LENGTH if request.args.get('view') == 'summary' else None
+        length = request.args.get('truncate', type=int, default=default)
+        return length if length and length > 0 else None
+
+    def apply(self, query, names):
+        """Restrict a query to the requested columns"""
+        length = self.truncate_length()
+        expressions = []
+        for name in names:
+            column = self.columns[name]
+            if length and name in self.text_fields:
+                column = func.substr(column, 1, length)
+            expressions.append(column.label(name))
+        return query.with_entities(*expressions)
+
+    def serialize(self, row):
+        result = {}
+        for name, value in row._mapping.items():
+            if isinstance(value, (date, datetime)):
+                value = value.isoformat()
+            elif name in self.json_fields:
+                try:
+                    value = json.loads(value) if value else []
+                except json.JSONDecodeError:
+                    value = []
+            result[name] = value
+        return result
+
+    def fetch(self, query, names):
+        return [self.serialize(row) for row in self.apply(query, names).all()]
+
+    def project(self, values, names):
+        """Serialize a row given as a dict of attribute values, like fetch() does"""
+        length = self.truncate_length()
+        result = {}
+        for name in names:
+            value = values.get(self.columns[name].key)
+            if length and name in self.text_fields and isinstance(value, str):
+                value = value[:length]
+            if isinstance(value, (date, datetime)):
+                value = value.isoformat()
+            elif name in self.json_fields:
+                try:
+                    value = json.loads(value) if value else []
+                except json.JSONDecodeError:
+                    value = []
+            result[name] = value
+        return result
@@ -0,0 +1,154 @@
+"""
+New user provisioning.
+
+A user and their default wellness categories are created in one transaction.
+Uniqueness of (email, provider) is enforced by the database with
+uq_users_email_provider (see src.schema), so two concurrent first logins
+cannot create duplicate users: the loser of the race rolls back and loads the
+row the winner inserted.
+"""
+import csv
+import io
+from datetime import datetime
+
+from sqlalchemy import insert, tuple_
+from sqlalchemy.exc import IntegrityError
+from src.models.user import db, User, WellnessCategory
+from src.sharding import assign_shard, using_shard, using_user
+from src.replicas import note_write
+
+DEFAULT_CATEGORIES = [
+    {'name': 'Tělo', 'color': '#A8B4A0', 'icon': 'body', 'order_index': 0},
+    {'name': 'Mysl', 'color': '#8C7B6F', 'icon': 'mind', 'order_index': 1},
+    {'name': 'Vztahy', 'color': '#C8A89A', 'icon': 'relationships', 'order_index': 2},
+    {'name': 'Inspirace', 'color': '#6B7F6B', 'icon': 'inspiration', 'order_index': 3},
+    {'name': 'Práce', 'color': '#5A6A70', 'icon': 'work', 'order_index': 4},
+    {'name': 'Zábava', 'color': '#E0E0D8', 'icon': 'fun', 'order_index': 5},
+]
+
+IMPORT_CHUNK_SIZE = 1000
+
+def default_category_rows(user_ids):
+    """Rows for a bulk insert of the default categories of the given users"""
+    return [
+        {'user_id': user_id, 'is_active': True, **cat_data}
+        for user_id in user_ids
+        for cat_data in DEFAULT_CATEGORIES
+    ]
+
+
+def create_default_categories(user_id, commit=True):
+    """Create default wellness categories for new users"""
+    db.session.execute(insert(WellnessCategory), default_category_rows([user_id]))
+    if commit:
+        db.session.commit()
+
+
+def provision_user(email, name, provider, provider_id, avatar_url=None):
+    """Get the user for this identity, creating it with default categories if needed"""
+    user = User.query.filter_by(email=email, provider=provider).first()
+    if user:
+        return user
+
+    try:
+        user = User(
+            email=email,
+            name=name,
+            provider=provider,
+            provider_id=provider_id,
+            avatar_url=avatar_url
+        )
+        db.session.add(user)
+        db.session.flush()
+        assign_shard(user.id)
+        # The first requests with the new token read the user row
+        note_write(user.id)
+        with using_user(user.id):
+            create_default_categories(user.id, commit=False)
+        db.session.commit()
+        return user
+    except IntegrityError:
+        # A concurrent first login for the same identity committed first
+        db.session.rollback()
+        return User.query.filter_by(email=email, provider=provider).one()
+
+
+def _import_chunk(rows):
+    """Insert the users of one chunk that do not exist yet, returns the number created"""
+    keys = {(row['email'], row['provider']) for row in rows}
+    existing = set(
+        db.session.query(User.email, User.provider)
+        .filter(tuple_(User.email, User.provider).in_(keys))
+        .all()
+    )
+
+    new_rows = []
+    for row in rows:
+        key = (row['email'], row['provider'])
+        if key in existing:
+            continue
+        existing.add(key)
+        new_rows.append(row)
+
+    if not new_rows:
+        return 0
+
+    created = db.session.execute(
+        insert(User).returning(User.id),
+        new_rows
+    ).scalars().all()
+    by_shard = {}
+    for user_id in created:
+        by_shard.setdefault(assign_shard(user_id), []).append(user_id)
+    for shard, user_ids in by_shard.items():
+        with using_shard(shard):
+            db.session.execute(insert(WellnessCategory), default_category_rows(user_ids))
+    db.session.commit()
+    return len(created)
+
+
+def import_users_csv(stream, default_provider='import', chunk_size=IMPORT_CHUNK_SIZE):
+    """Bulk-create users from CSV with columns email,name[,provider,provider_id,avatar_url]
+
+    Users are inserted in chunks, each chunk in its own transaction together
+    with the default categories of its users. Existing identities are skipped.
+    """
+    if isinstance(stream, (bytes, bytearray)):
+        stream = io.StringIO(stream.decode('utf-8'))
+
+    created = 0
+    invalid = 0
+    chunk = []
+    now = datetime.utcnow()
+
+    def flush(chunk):
+        try:
+            return _import_chunk(chunk)
+        except IntegrityError:
+            # Someone logged in concurrently, re-read existing users and retry once
+            db.session.rollback()
+            return _import_chunk(chunk)
+
+    for line in csv.DictReader(stream):
+        email = (line.get('email') or '').strip()
+        if not email:
+            invalid += 1
+            continue
+        provider = (line.get('provider') or default_provider).strip()
+        chunk.append({
+            'email': email,
+            'name': (line.get('name') or email.split('@')[0]).strip(),
+            'provider': provider,
+            'provider_id': (line.get('provider_id') or email).strip(),
+            'avatar_url': line.get('avatar_url') or None,
+            'created_at': now,
+            'updated_at': now
+        })
+        if len(chunk) >= chunk_size:
+            created += flush(chunk)
+            chunk = []
+
+    if chunk:
+        created += flush(chunk)
+
+    return {'created': created, 'invalid': invalid}
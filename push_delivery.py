@@ -0,0 +1,291 @@
+"""
+Web push delivery.
+
+Fan-out sends one message per subscription through a shared, connection-pooled
+HTTP session from a thread pool, so a morning burst to thousands of browsers
+reuses a handful of TLS connections to the few push services (FCM, Mozilla,
+Apple). Each response decides the subscription's fate:
+
+    2xx         delivered
+    404, 410    subscription is gone, deleted after the run
+    429, 5xx    retried with per-endpoint exponential backoff (or Retry-After)
+    other 4xx   dropped for this run
+
+Messages are encrypted with pywebpush and signed with VAPID when
+VAPID_PRIVATE_KEY is set. Without it (local development, the stub push
+service of benchmark.py) the JSON payload is posted as is.
+"""
+import heapq
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+from src.models.user import db
+from src.sharding import using_user
+
+VAPID_PRIVATE_KEY = os.getenv('VAPID_PRIVATE_KEY', '')
+VAPID_PUBLIC_KEY = os.getenv('VAPID_PUBLIC_KEY', '')
+VAPID_SUBJECT = os.getenv('VAPID_SUBJECT', 'mailto:podpora@kolopohody.cz')
+PUSH_CONCURRENCY = int(os.getenv('KOLO_PUSH_CONCURRENCY', 32))
+PUSH_TIMEOUT = (3, 10)
+PUSH_TTL_SECONDS = 12 * 3600
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 1.0
+MAX_RETRY_SECONDS = 300
+VAPID_TOKEN_SECONDS = 12 * 3600
+FANOUT_CHUNK = 1000
+
+
+class PushSubscription(db.Model):
+    __tablename__ = 'push_subscriptions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    endpoint = db.Column(db.Text, nullable=False, unique=True)
+    p256dh = db.Column(db.String(255), nullable=False)
+    auth = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_success_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'endpoint': self.endpoint,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_success_at': self.last_success_at.isoformat() if self.last_success_at else None
+        }
+
+
+def save_subscription(user_id, data):
+    """Store a browser PushSubscription, moving the endpoint to this user if needed"""
+    keys = data.get('keys') or {}
+    subscription = PushSubscription.query.filter_by(endpoint=data['endpoint']).first()
+    if subscription is None:
+        subscription = PushSubscription(endpoint=data['endpoint'])
+        db.session.add(subscription)
+    subscription.user_id = user_id
+    subscription.p256dh = keys['p256dh']
+    subscription.auth = keys['auth']
+    db.session.commit()
+    return subscription
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    """Shared session sized for the fan-out thread pool"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                # No automatic retries, failed endpoints go to the retry heap instead
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=PUSH_CONCURRENCY, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+@lru_cache(maxsize=32)
+def _vapid_headers(audience, expires_slot):
+    # One signature per push service and half-day instead of one per message
+    from py_vapid import Vapid
+
+    claims = {'sub': VAPID_SUBJECT, 'aud': audience, 'exp': expires_slot + VAPID_TOKEN_SECONDS}
+    return Vapid.from_string(private_key=VAPID_PRIVATE_KEY).sign(claims)
+
+
+def vapid_headers(endpoint):
+    parts = urlsplit(endpoint)
+    now = int(time.time())
+    slot = now - now % (VAPID_TOKEN_SECONDS // 2)
+    return dict(_vapid_headers(f'{parts.scheme}://{parts.netloc}', slot))
+
+
+def send_one(subscription, payload):
+    """POST one message to a subscription endpoint; returns (status, retry_after)"""
+    session = http_session()
+    data = json.dumps(payload, ensure_ascii=False)
+    try:
+        if VAPID_PRIVATE_KEY:
+            from pywebpush import WebPusher
+
+            response = WebPusher(subscription, requests_session=session).send(
+                data,
+                headers=vapid_headers(subscription['endpoint']),
+                ttl=PUSH_TTL_SECONDS,
+                timeout=PUSH_TIMEOUT
+            )
+        else:
+            response = session.post(
+                subscription['endpoint'],
+                data=data.encode('utf-8'),
+                headers={'Content-Type': 'application/json', 'TTL': str(PUSH_TTL_SECONDS)},
+                timeout=PUSH_TIMEOUT
+            )
+    except Exception as e:
+        print(f"Error sending push to {urlsplit(subscription['endpoint']).netloc}: {e}")
+        return None, None
+
+    retry_after = response.headers.get('Retry-After')
+    return response.status_code, float(retry_after) if retry_after and retry_after.isdigit() else None
+
+
+class FanOut:
+    """One bulk send: thread pool for concurrency, retry heap for failed endpoints"""
+
+    def __init__(self, concurrency=PUSH_CONCURRENCY, max_attempts=MAX_ATTEMPTS, sender=send_one):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.sender = sender
+        self.stats = {'sent': 0, 'retried': 0, 'gone': 0, 'failed': 0}
+        self.delivered_ids = []
+        self.gone_ids = []
+
+    def _handle(self, item, status, retry_after, retries):
+        subscription_id, subscription, payload, attempt = item
+        if status is not None and 200 <= status < 300:
+            self.stats['sent'] += 1
+            self.delivered_ids.append(subscription_id)
+        elif status in (404, 410):
+            self.stats['gone'] += 1
+            self.gone_ids.append(subscription_id)
+        elif (status is None or status == 429 or status >= 500) and attempt + 1 < self.max_attempts:
+            delay = retry_after or min(MAX_RETRY_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt)
+            self.stats['retried'] += 1
+            heapq.heappush(retries, (time.monotonic() + delay, subscription_id, subscription, payload, attempt + 1))
+        else:
+            self.stats['failed'] += 1
+
+    def run(self, messages):
+        """Send [(subscription_id, subscription_info, payload)], returns stats"""
+        started = time.monotonic()
+        retries = []
+        pending = {}
+        queue = iter(messages)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            def submit(item):
+                future = executor.submit(self.sender, item[1], item[2])
+                pending[future] = item
+
+            while True:
+                # Keep at most two messages per thread in flight
+                while len(pending) < self.concurrency * 2:
+                    if retries and retries[0][0] <= time.monotonic():
+                        _, subscription_id, subscription, payload, attempt = heapq.heappop(retries)
+                        submit((subscription_id, subscription, payload, attempt))
+                        continue
+                    item = next(queue, None)
+                    if item is None:
+                        break
+                    submit((item[0], item[1], item[2], 0))
+
+                if not pending:
+                    if not retries:
+                        break
+                    time.sleep(max(0.0, retries[0][0] - time.monotonic()))
+                    continue
+
+                timeout = max(0.0, retries[0][0] - time.monotonic()) if retries else None
+                done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    status, retry_after = future.result()
+                    self._handle(pending.pop(future), status, retry_after, retries)
+
+        self.stats['seconds'] = round(time.monotonic() - started, 3)
+        return self.stats
+
+
+def subscription_info(row):
+    return {'endpoint': row.endpoint, 'keys': {'p256dh': row.p256dh, 'auth': row.auth}}
+
+
+def record_results(fanout):
+    """Delete dead subscriptions and mark delivered ones, in chunks"""
+    now = datetime.utcnow()
+    for start in range(0, len(fanout.gone_ids), FANOUT_CHUNK):
+        PushSubscription.query.filter(
+            PushSubscription.id.in_(fanout.gone_ids[start:start + FANOUT_CHUNK])
+        ).delete(synchronize_session=False)
+    for start in range(0, len(fanout.delivered_ids), FANOUT_CHUNK):
+        PushSubscription.query.filter(
+            PushSubscription.id.in_(fanout.delivered_ids[start:start + FANOUT_CHUNK])
+        ).update({'last_success_at': now}, synchronize_session=False)
+    db.session.commit()
+
+
+def send_to_users(payloads_by_user, fanout=None):
+    """Push a payload to every subscription of each user, {user_id: payload}"""
+    fanout = fanout or FanOut()
+    messages = []
+    user_ids = list(payloads_by_user)
+    for start in range(0, len(user_ids), FANOUT_CHUNK):
+        rows = PushSubscription.query.filter(
+            PushSubscription.user_id.in_(user_ids[start:start + FANOUT_CHUNK])
+        ).all()
+        messages.extend((row.id, subscription_info(row), payloads_by_user[row.user_id]) for row in rows)
+    db.session.remove()
+
+    stats = fanout.run(messages)
+    record_results(fanout)
+    return stats
+
+
+def push_daily_inspiration(personalized=True):
+    """Generate today's inspiration for every subscribed user and push it as one bulk job"""
+    from src.routes.inspiration import get_or_create_daily_inspiration, generate_ai_inspiration
+
+    # Users without personal context share one generic text per inspiration type
+    shared_generic = lru_cache(maxsize=None)(generate_ai_inspiration)
+
+    user_ids = [row[0] for row in db.session.query(PushSubscription.user_id).distinct()]
+    payloads = {}
+    for user_id in user_ids:
+        try:
+            with using_user(user_id):
+                inspiration = get_or_create_daily_inspiration(
+                    user_id, personalized=personalized, generate=shared_generic
+                )
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error preparing daily inspiration for user {user_id}: {e}")
+            continue
+        finally:
+            # Row ids repeat across shards, never keep one user's rows in the identity map
+            db.session.expunge_all()
+        payloads[user_id] = {
+            'type': 'daily_inspiration',
+            'title': 'Inspirace na dnešní den',
+            'body': inspiration['content'],
+            'url': '/'
+        }
+    return send_to_users(payloads)
+
+
+class PushReminderDelivery:
+    """Reminder delivery backend, KOLO_REMINDER_DELIVERY=src.push_delivery:PushReminderDelivery"""
+
+    def deliver(self, notifications):
+        payloads = {}
+        for notification in notifications:
+            # Several reminders of one user due together become one message
+            payload = payloads.setdefault(notification['user_id'], {
+                'type': 'reminder', 'title': notification['title'],
+                'body': notification['message'] or '', 'url': '/'
+            })
+            if payload['title'] != notification['title']:
+                payload['body'] = f"{payload['body']}\n{notification['title']}".strip()
+        stats = send_to_users(payloads)
+        print(f"Pushed reminders: {stats}")
@@ -0,0 +1,283 @@
+"""
+Reminders and their scheduler.
+
+Each active reminder stores its next occurrence in the indexed next_fire_at
+column (naive UTC like every other timestamp, NULL while inactive). The
+scheduler never scans the table: every poll it range-scans the index for
+reminders due within the look-ahead window, keeps them in an in-memory heap
+and fires them in batches when they come due. Reminders edited through the
+API are picked up on the next poll.
+
+A reminder is claimed by moving next_fire_at to its following occurrence
+with a conditional UPDATE before delivery, so several scheduler processes
+never deliver the same occurrence twice. After a restart, overdue rows are
+simply the start of the first index range scan: occurrences missed by less
+than MISSED_GRACE are still delivered (once, however many were missed), older
+ones are skipped and rescheduled.
+
+Recurrence is computed in the users' local time (KOLO_TIMEZONE), so a
+reminder at 08:00 stays at 08:00 across daylight saving changes. Delivery is
+pluggable with KOLO_REMINDER_DELIVERY: 'log' (default) or package.module:factory
+returning an object with deliver(notifications).
+"""
+import calendar
+import heapq
+import importlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import update
+from src.models.user import db
+from src.data_versions import register_scope, bump_version
+from src.sharding import using_user
+
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+LOCAL_TIMEZONE = ZoneInfo(os.getenv('KOLO_TIMEZONE', 'Europe/Prague'))
+DELIVERY_BACKEND = os.getenv('KOLO_REMINDER_DELIVERY', 'log')
+POLL_INTERVAL_SECONDS = 30
+LOOKAHEAD = timedelta(minutes=10)
+MISSED_GRACE = timedelta(hours=int(os.getenv('KOLO_REMINDER_GRACE_HOURS', 6)))
+BATCH_SIZE = 500
+
+
+class Reminder(db.Model):
+    __tablename__ = 'reminders'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    title = db.Column(db.String(255), nullable=False)
+    message = db.Column(db.Text)
+    frequency = db.Column(db.String(20), nullable=False)
+    time_of_day = db.Column(db.Time, nullable=False)
+    days_of_week = db.Column(db.String(20))  # JSON array, 0 = Monday
+    day_of_month = db.Column(db.Integer)
+    is_active = db.Column(db.Boolean, default=True)
+    last_sent = db.Column(db.DateTime)
+    next_fire_at = db.Column(db.DateTime, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def weekdays(self):
+        try:
+            return sorted(set(json.loads(self.days_of_week))) if self.days_of_week else []
+        except json.JSONDecodeError:
+            return []
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'message': self.message,
+            'frequency': self.frequency,
+            'time_of_day': self.time_of_day.strftime('%H:%M') if self.time_of_day else None,
+            'days_of_week': self.weekdays(),
+            'day_of_month': self.day_of_month,
+            'is_active': self.is_active,
+            'last_sent': self.last_sent.isoformat() if self.last_sent else None,
+            'next_fire_at': self.next_fire_at.isoformat() if self.next_fire_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+register_scope(Reminder, 'reminders')
+
+
+def _to_utc(day, time_of_day):
+    local = datetime.combine(day, time_of_day, tzinfo=LOCAL_TIMEZONE)
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _monthly_day(year, month, day_of_month):
+    # The 31st fires on the last day of shorter months
+    return min(day_of_month, calendar.monthrange(year, month)[1])
+
+
+def next_occurrence(frequency, time_of_day, after, days_of_week=None, day_of_month=None):
+    """First occurrence strictly after `after` (naive UTC), as naive UTC"""
+    local_day = after.replace(tzinfo=timezone.utc).astimezone(LOCAL_TIMEZONE).date()
+
+    if frequency == 'daily':
+        for offset in range(3):
+            fire_at = _to_utc(local_day + timedelta(days=offset), time_of_day)
+            if fire_at > after:
+                return fire_at
+
+    elif frequency == 'weekly':
+        weekdays = set(days_of_week or [])
+        if not weekdays:
+            return None
+        for offset in range(9):
+            day = local_day + timedelta(days=offset)
+            if day.weekday() in weekdays:
+                fire_at = _to_utc(day, time_of_day)
+                if fire_at > after:
+                    return fire_at
+
+    elif frequency == 'monthly':
+        year, month = local_day.year, local_day.month
+        for _ in range(3):
+            day = local_day.replace(year=year, month=month, day=_monthly_day(year, month, day_of_month or 1))
+            fire_at = _to_utc(day, time_of_day)
+            if fire_at > after:
+                return fire_at
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    return None
+
+
+def schedule(reminder, after=None):
+    """Set next_fire_at of a reminder from its recurrence"""
+    if not reminder.is_active:
+        reminder.next_fire_at = None
+        return
+    reminder.next_fire_at = next_occurrence(
+        reminder.frequency,
+        reminder.time_of_day,
+        after or datetime.utcnow(),
+        days_of_week=reminder.weekdays(),
+        day_of_month=reminder.day_of_month
+    )
+
+
+class LogDelivery:
+    """Local stub that only prints the notifications"""
+
+    def deliver(self, notifications):
+        for notification in notifications:
+            print(f"Reminder {notification['reminder_id']} for user {notification['user_id']}: "
+                  f"{notification['title']}")
+
+
+def get_delivery_backend(name=None):
+    name = name or DELIVERY_BACKEND
+    if name == 'log':
+        return LogDelivery()
+    module_name, _, factory = name.partition(':')
+    return getattr(importlib.import_module(module_name), factory)()
+
+
+class ReminderScheduler:
+    """Fires due reminders from an in-memory heap fed by index range scans"""
+
+    def __init__(self, app, backend=None, lookahead=LOOKAHEAD, poll_interval=POLL_INTERVAL_SECONDS):
+        self.app = app
+        self.backend = backend or get_delivery_backend()
+        self.lookahead = lookahead
+        self.poll_interval = poll_interval
+        self._heap = []
+        self._scheduled = {}  # reminder id -> fire time in the heap, stale heap items are skipped
+        self._stop = threading.Event()
+        self.stats = {'delivered': 0, 'skipped': 0}
+
+    def load_window(self, now):
+        """Queue every reminder due before now + lookahead"""
+        rows = db.session.query(Reminder.id, Reminder.next_fire_at).filter(
+            Reminder.next_fire_at <= now + self.lookahead
+        ).order_by(Reminder.next_fire_at).all()
+        for reminder_id, fire_at in rows:
+            if self._scheduled.get(reminder_id) != fire_at:
+                self._scheduled[reminder_id] = fire_at
+                heapq.heappush(self._heap, (fire_at, reminder_id))
+        return len(rows)
+
+    def pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < BATCH_SIZE:
+            fire_at, reminder_id = heapq.heappop(self._heap)
+            if self._scheduled.get(reminder_id) == fire_at:
+                del self._scheduled[reminder_id]
+                due.append(reminder_id)
+        return due
+
+    def fire(self, reminder_ids, now):
+        """Claim and deliver one batch of due reminders"""
+        reminders = Reminder.query.filter(
+            Reminder.id.in_(reminder_ids),
+            Reminder.next_fire_at <= now,
+            Reminder.is_active == True
+        ).all()
+
+        notifications = []
+        for reminder in reminders:
+            due_at = reminder.next_fire_at
+            following = next_occurrence(
+                reminder.frequency, reminder.time_of_day, now,
+                days_of_week=reminder.weekdays(), day_of_month=reminder.day_of_month
+            )
+            missed = now - due_at > MISSED_GRACE
+            values = {'next_fire_at': following}
+            if not missed:
+                values['last_sent'] = now
+
+            # Claim: only one scheduler moves this occurrence forward
+            claimed = db.session.execute(
+                update(Reminder)
+                .where(Reminder.id == reminder.id, Reminder.next_fire_at == due_at)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            ).rowcount == 1
+            if not claimed:
+                continue
+            with using_user(reminder.user_id):
+                bump_version(reminder.user_id, 'reminders')
+
+            if missed:
+                self.stats['skipped'] += 1
+                continue
+            notifications.append({
+                'reminder_id': reminder.id,
+                'user_id': reminder.user_id,
+                'title': reminder.title,
+                'message': reminder.message,
+                'due_at': due_at.isoformat()
+            })
+        db.session.commit()
+
+        if notifications:
+            self.backend.deliver(notifications)
+            self.stats['delivered'] += len(notifications)
+        return len(notifications)
+
+    def run_once(self, now=None):
+        """Load the window and fire everything already due"""
+        now = now or datetime.utcnow()
+        self.load_window(now)
+        fired = 0
+        while True:
+            due = self.pop_due(now)
+            if not due:
+                return fired
+            fired += self.fire(due, now)
+
+    def run_forever(self):
+        with self.app.app_context():
+            next_poll = 0.0
+            while not self._stop.is_set():
+                if time.monotonic() >= next_poll:
+                    self.load_window(datetime.utcnow())
+                    db.session.remove()
+                    next_poll = time.monotonic() + self.poll_interval
+
+                now = datetime.utcnow()
+                while True:
+                    due = self.pop_due(now)
+                    if not due:
+                        break
+                    try:
+                        self.fire(due, now)
+                    except Exception as e:
+                        # Unclaimed reminders are found again by the next poll
+                        db.session.rollback()
+                        print(f"Error firing reminders: {e}")
+                db.session.remove()
+
+                wait = next_poll - time.monotonic()
+                if self._heap:
+                    wait = min(wait, (self._heap[0][0] - datetime.utcnow()).total_seconds())
+                self._stop.wait(max(0.05, wait))
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,122 @@
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from src.models.user import db
+from src.data_versions import conditional_on
+from src.reminder_scheduler import Reminder, FREQUENCIES, schedule
+from datetime import datetime, date
+import json
+
+reminders_bp = Blueprint('reminders', __name__)
+
+def apply_reminder_fields(reminder, data):
+    """Validate and copy request fields onto a reminder, returns an error message or None"""
+    if 'title' in data:
+        if not data['title']:
+            return 'Title is required'
+        reminder.title = data['title']
+
+    if 'message' in data:
+        reminder.message = data['message']
+
+    if 'frequency' in data:
+        if data['frequency'] not in FREQUENCIES:
+            return f"Frequency must be one of: {', '.join(FREQUENCIES)}"
+        reminder.frequency = data['frequency']
+
+    if 'time_of_day' in data:
+        try:
+            reminder.time_of_day = datetime.strptime(data['time_of_day'], '%H:%M').time()
+        except (TypeError, ValueError):
+            return 'Invalid time_of_day format. Use HH:MM'
+
+    if 'days_of_week' in data:
+        days = data['days_of_week'] or []
+        if not isinstance(days, list) or any(not isinstance(day, int) or not 0 <= day <= 6 for day in days):
+            return 'days_of_week must be a list of numbers 0 (Monday) to 6 (Sunday)'
+        reminder.days_of_week = json.dumps(sorted(set(days)))
+
+    if 'day_of_month' in data:
+        day = data['day_of_month']
+        if day is not None and (not isinstance(day, int) or not 1 <= day <= 31):
+            return 'day_of_month must be between 1 and 31'
+        reminder.day_of_month = day
+
+    if 'is_active' in data:
+        reminder.is_active = bool(data['is_active'])
+
+    if reminder.frequency == 'weekly' and not reminder.weekdays():
+        return 'Weekly reminders need days_of_week'
+    if reminder.frequency == 'monthly' and not reminder.day_of_month:
+        reminder.day_of_month = date.today().day
+    return None
+
+@reminders_bp.route('/reminders', methods=['GET'])
+@jwt_required()
+@conditional_on('reminders')
+def get_reminders():
+    """Get all reminders of current user"""
+    current_user_id = get_jwt_identity()
+    reminders = Reminder.query.filter_by(user_id=current_user_id).order_by(Reminder.time_of_day).all()
+    return jsonify([reminder.to_dict() for reminder in reminders])
+
+@reminders_bp.route('/reminders', methods=['POST'])
+@jwt_required()
+def create_reminder():
+    """Create new reminder"""
+    current_user_id = get_jwt_identity()
+    data = request.get_json()
+
+    if not data or not data.get('title'):
+        return jsonify({'error': 'Title is required'}), 400
+    if not data.get('frequency') or not data.get('time_of_day'):
+        return jsonify({'error': 'frequency and time_of_day are required'}), 400
+
+    reminder = Reminder(user_id=current_user_id, is_active=True)
+    error = apply_reminder_fields(reminder, data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    schedule(reminder)
+    db.session.add(reminder)
+    db.session.commit()
+
+    return jsonify(reminder.to_dict()), 201
+
+@reminders_bp.route('/reminders/<int:reminder_id>', methods=['PUT'])
+@jwt_required()
+def update_reminder(reminder_id):
+    """Update reminder"""
+    current_user_id = get_jwt_identity()
+    reminder = Reminder.query.filter_by(id=reminder_id, user_id=current_user_id).first()
+
+    if not reminder:
+        return jsonify({'error': 'Reminder not found'}), 404
+
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+
+    error = apply_reminder_fields(reminder, data)
+    if error:
+        db.session.rollback()
+        return jsonify({'error': error}), 400
+
+    schedule(reminder)
+    db.session.commit()
+
+    return jsonify(reminder.to_dict())
+
+@reminders_bp.route('/reminders/<int:reminder_id>', methods=['DELETE'])
+@jwt_required()
+def delete_reminder(reminder_id):
+    """Delete reminder"""
+    current_user_id = get_jwt_identity()
+    reminder = Reminder.query.filter_by(id=reminder_id, user_id=current_user_id).first()
+
+    if not reminder:
+        return jsonify({'error': 'Reminder not found'}), 404
+
+    db.session.delete(reminder)
+    db.session.commit()
+
+    return '', 204
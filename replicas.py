@@ -0,0 +1,230 @@
+"""
+Read replicas of the default database.
+
+Replicas are configured as extra Flask-SQLAlchemy binds:
+
+    KOLO_READ_REPLICAS="r1=postgresql://replica1/kolo,r2=sqlite:///file:/replica/app.db?mode=ro&uri=true"
+
+Inside GET and HEAD requests, SELECTs that would go to the default database
+are sent to a replica instead. Flushes and other writes always use the
+primary, and once a session has written anything, its later reads stay on
+the primary too.
+
+Read-your-writes: every transaction that writes to the primary for a user
+(the JWT identity, the user of using_user(), or one passed to note_write())
+stamps user_last_writes in the same transaction, whatever table it wrote. A
+replica is only used for a request when it has replayed past that marker,
+so the refetch right after creating an entry, a push subscription or an
+import job reads from the primary until the replicas caught up.
+
+Lag is measured with a heartbeat row the primary rewrites every few
+seconds: a replica's lag is how old its copy of the row is. Replicas lagging
+more than KOLO_REPLICA_MAX_LAG seconds are taken out of rotation until they
+recover. Per-user data on extra shards is never read from these replicas,
+and neither are the control tables in PRIMARY_TABLES, where a lagging copy
+would accept revoked tokens or miss claims and shard moves.
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.sql import Select
+from src.models.user import db
+from src import sharding
+
+HEARTBEAT_SECONDS = 2
+MAX_LAG_SECONDS = float(os.getenv('KOLO_REPLICA_MAX_LAG', 10))
+READ_METHODS = ('GET', 'HEAD')
+# The marker is stamped just before commit, which lands a little later
+COMMIT_MARGIN = timedelta(seconds=1)
+PRIMARY_TABLES = {'revoked_tokens', 'flight_claims', 'user_shards', 'replica_heartbeats', 'user_last_writes'}
+
+
+class ReplicaHeartbeat(db.Model):
+    __tablename__ = 'replica_heartbeats'
+
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+
+class UserLastWrite(db.Model):
+    __tablename__ = 'user_last_writes'
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    written_at = db.Column(db.DateTime, nullable=False)
+
+
+def binds_from_env():
+    """SQLALCHEMY_BINDS entries of the read replicas"""
+    binds = {}
+    for item in os.getenv('KOLO_READ_REPLICAS', '').split(','):
+        name, _, url = item.strip().partition('=')
+        if name and url:
+            binds[f'replica-{name.strip()}'] = url.strip()
+    return binds
+
+
+REPLICAS = sorted(binds_from_env())
+
+
+class ReplicaMonitor:
+    """Heartbeat writer and lag probe, one thread per worker"""
+
+    def __init__(self):
+        self.positions = {}  # replica -> newest heartbeat it has replayed
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_running(self, app):
+        # Threads do not survive fork, start one per worker process
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self.positions = {}
+                    threading.Thread(target=self._run, args=(app,), daemon=True).start()
+
+    def _beat(self):
+        table = ReplicaHeartbeat.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            # Any worker may beat, the condition keeps it to about one write per interval
+            result = connection.execute(
+                update(table)
+                .where(table.c.id == 1, table.c.beat_at < now - timedelta(seconds=HEARTBEAT_SECONDS / 2))
+                .values(beat_at=now)
+            )
+            if result.rowcount == 0 and connection.execute(select(table.c.id).where(table.c.id == 1)).first() is None:
+                connection.execute(insert(table).values(id=1, beat_at=now))
+
+    def _probe(self, name):
+        table = ReplicaHeartbeat.__table__
+        try:
+            with db.engines[name].connect() as connection:
+                return connection.execute(select(table.c.beat_at).where(table.c.id == 1)).scalar()
+        except Exception as e:
+            print(f"Error probing replica {name}: {e}")
+            return None
+
+    def _run(self, app):
+        with app.app_context():
+            while True:
+                try:
+                    self._beat()
+                except Exception as e:
+                    print(f"Error writing replica heartbeat: {e}")
+                for name in REPLICAS:
+                    was_healthy = self.healthy(name)
+                    position = self._probe(name)
+                    if position is not None:
+                        self.positions[name] = position
+                    if self.healthy(name) != was_healthy:
+                        print(f"Replica {name} {'back in' if not was_healthy else 'out of'} rotation, "
+                              f"lag {self.lag(name)}")
+                time.sleep(HEARTBEAT_SECONDS)
+
+    def lag(self, name):
+        """Seconds the replica is behind, None before the first successful probe"""
+        position = self.positions.get(name)
+        return (datetime.utcnow() - position).total_seconds() if position else None
+
+    def healthy(self, name):
+        # Measured against the clock, so a replica whose probes fail ages out too
+        lag = self.lag(name)
+        return lag is not None and lag <= MAX_LAG_SECONDS
+
+
+monitor = ReplicaMonitor()
+
+
+def last_write(user_id):
+    """The user's last-write marker, read from the primary"""
+    table = UserLastWrite.__table__
+    with db.engine.connect() as connection:
+        return connection.execute(select(table.c.written_at).where(table.c.user_id == int(user_id))).scalar()
+
+
+def note_write(user_id, session=None):
+    """Stamp the user's last write at commit, for writes made before their identity is known"""
+    (session or db.session).info.setdefault('kolo_written_users', set()).add(int(user_id))
+
+
+@event.listens_for(db.session, 'before_commit')
+def _stamp_last_writes(session):
+    users = session.info.pop('kolo_written_users', None)
+    if not users or not REPLICAS:
+        return
+    table = UserLastWrite.__table__
+    connection = session.connection(bind_arguments={'mapper': UserLastWrite})
+    now = datetime.utcnow()
+    for user_id in users:
+        result = connection.execute(update(table).where(table.c.user_id == user_id).values(written_at=now))
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(user_id=user_id, written_at=now))
+
+
+def replica_for_request():
+    """Replica for this request's reads, or None for the primary
+
+    Chosen once per request after its JWT has been verified. Reads before
+    that, e.g. in the JWT loaders, cannot know the user's last write and use
+    the primary.
+    """
+    if 'kolo_replica' in g:
+        return g.kolo_replica
+    monitor.ensure_running(current_app._get_current_object())
+
+    from flask_jwt_extended import get_jwt_identity
+    try:
+        user_id = get_jwt_identity()
+    except RuntimeError:
+        return None
+
+    candidates = [name for name in REPLICAS if monitor.healthy(name)]
+    if candidates and user_id is not None:
+        marker = last_write(user_id)
+        if marker is not None:
+            # Only replicas that replayed a heartbeat written after the user's last write
+            candidates = [name for name in candidates if monitor.positions[name] > marker + COMMIT_MARGIN]
+
+    g.kolo_replica = random.choice(candidates) if candidates else None
+    return g.kolo_replica
+
+
+def _replica_session_class(base):
+    class ReplicaRoutingSession(base):
+        def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+            engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+            if not REPLICAS or bind is not None:
+                return engine
+            if not isinstance(clause, Select):
+                # Flushes and DML: the rest of this session reads its own writes
+                self.info['kolo_wrote'] = True
+                if engine is db.engine and not sharding.touches(mapper, clause, {UserLastWrite.__tablename__}):
+                    user_id = sharding.current_user_id()
+                    if user_id is not None:
+                        note_write(user_id, self)
+                return engine
+            if (engine is db.engine and not self.info.get('kolo_wrote')
+                    and has_request_context() and request.method in READ_METHODS
+                    and not sharding.touches(mapper, clause, PRIMARY_TABLES)):
+                replica = replica_for_request()
+                if replica is not None:
+                    return db.engines[replica]
+            return engine
+
+    return ReplicaRoutingSession
+
+
+def install():
+    """Route reads of db.session to replicas, on top of the shard routing"""
+    factory = db.session.session_factory
+    if not factory.class_.__name__ == 'ReplicaRoutingSession':
+        factory.class_ = _replica_session_class(factory.class_)
+
+
+install()
@@ -0,0 +1,82 @@
+"""
+Database schema management.
+
+db.create_all() only creates missing tables. Indexes declared later on tables
+that already exist in a deployed database are created here as well.
+
+Unique indexes are part of correctness, not only speed: concurrent first
+logins rely on uq_users_email_provider and the history import upserts on
+uq_wellness_entries_user_category_date. Duplicate wellness scores left by
+older versions are removed before that index is built, keeping the newest
+row of a day. When a unique index still cannot be built, init_db fails with
+the reason instead of running without it.
+"""
+from sqlalchemy import delete, func, inspect, select
+from src.models.user import db, User, WellnessEntry
+from src import journal_store, sharding
+
+db.Index('uq_users_email_provider', User.email, User.provider, unique=True)
+WELLNESS_DAY_INDEX = 'uq_wellness_entries_user_category_date'
+db.Index(
+    WELLNESS_DAY_INDEX,
+    WellnessEntry.user_id, WellnessEntry.category_id, WellnessEntry.entry_date,
+    unique=True
+)
+
+_present = set()
+
+
+def _keep_newest_wellness_entries(connection):
+    table = WellnessEntry.__table__
+    newest = select(func.max(table.c.id)).group_by(table.c.user_id, table.c.category_id, table.c.entry_date)
+    removed = connection.execute(delete(table).where(table.c.id.not_in(newest))).rowcount
+    if removed:
+        print(f'Removed {removed} duplicate wellness entries')
+
+
+# Run before creating a unique index over rows that may contain duplicates
+DEDUPLICATE = {WELLNESS_DAY_INDEX: _keep_newest_wellness_entries}
+
+
+def has_index(connection, table_name, index_name):
+    """Whether an index exists, positive answers are cached per database"""
+    key = (str(connection.engine.url), index_name)
+    if key not in _present:
+        if index_name not in {index['name'] for index in inspect(connection).get_indexes(table_name)}:
+            return False
+        _present.add(key)
+    return True
+
+
+def create_indexes(engine, tables, where='the default database'):
+    """Create the declared indexes missing on existing tables"""
+    for table in tables:
+        for index in table.indexes:
+            try:
+                if index.name in DEDUPLICATE:
+                    with engine.begin() as connection:
+                        if not has_index(connection, table.name, index.name):
+                            DEDUPLICATE[index.name](connection)
+                index.create(engine, checkfirst=True)
+            except Exception as e:
+                if index.unique:
+                    # e.g. rows that already contain duplicates
+                    raise RuntimeError(f'Cannot create unique index {index.name} on {where}, '
+                                       f'fix the conflicting rows and run flask init-db: {e}') from e
+                print(f"Error creating index {index.name} on {where}: {e}")
+
+
+def init_db():
+    """Create missing tables and indexes"""
+    db.create_all()
+    create_indexes(db.engine, db.metadata.sorted_tables)
+
+    # Tables of per-user data also exist on every extra shard
+    sharding.create_shard_tables()
+    for shard in sharding.EXTRA_SHARDS:
+        create_indexes(sharding.shard_engine(shard), sharding.sharded_tables(), f'shard {shard}')
+
+    for shard in sharding.shard_names():
+        indexed = journal_store.create_search_index(sharding.shard_engine(shard))
+        if indexed:
+            print(f'Indexed {indexed} journal bodies for search on {shard}')
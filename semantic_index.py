@@ -0,0 +1,371 @@
+"""
+Local embedding index for semantic journal search.
+
+Every journal entry (title and full body) is embedded on the CPU without any
+network call. Vectors are L2-normalized and stored as one float16 matrix per
+user in a .npy file next to the entry ids; queries memory-map the file and
+score it with a vectorized dot product (cosine similarity), so a search only
+touches the pages of that user's matrix.
+
+Embedding happens in a background thread per worker: the journal routes
+queue the new text after commit and return immediately. Users whose index
+does not exist yet (entries written before this feature, a new embedder) are
+rebuilt from the database on their first search or with `flask index-journal`.
+
+Embedders are pluggable with KOLO_EMBEDDER:
+    hashing                 feature hashing of words, stems and trigrams (default,
+                            lexical but tolerant to Czech inflection and missing diacritics)
+    sentence-transformers   a local sentence-transformers model from KOLO_EMBEDDING_MODEL,
+                            e.g. a downloaded paraphrase-multilingual-MiniLM-L12-v2
+    package.module:factory  any callable returning an object with name, dim and encode(texts)
+Each embedder keeps its own index directory, so switching rebuilds lazily.
+"""
+import fcntl
+import importlib
+import os
+import queue
+import re
+import tempfile
+import threading
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+from src.models.user import JournalEntry
+from src import journal_store
+from src.sharding import using_user
+
+INDEX_DIR = os.getenv(
+    'KOLO_EMBEDDING_DIR',
+    os.path.join(os.path.dirname(__file__), 'database', 'embeddings')
+)
+EMBEDDER = os.getenv('KOLO_EMBEDDER', 'hashing')
+EMBEDDING_MODEL = os.getenv('KOLO_EMBEDDING_MODEL', '')
+HASHING_DIM = 512
+SCORE_CHUNK_ROWS = 8192
+ENCODE_BATCH = 64
+MIN_SCORE = 0.1
+# Mapped user indexes kept open per worker, the least recently searched are unmapped
+CACHED_INDEXES = int(os.getenv('KOLO_EMBEDDING_CACHED_INDEXES', 32))
+
+
+def _numpy():
+    # Imported on first index or search rather than at app start-up
+    import numpy
+    return numpy
+
+
+class HashingEmbedder:
+    """Feature-hashing embedder, needs nothing but numpy"""
+
+    name = 'hashing-v1'
+
+    def __init__(self, dim=HASHING_DIM):
+        self.dim = dim
+
+    def _features(self, text):
+        text = unicodedata.normalize('NFKD', text.casefold())
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+        for word in re.findall(r'\w{3,}', text):
+            yield word, 1.0
+            # Crude stem so 'prochazka', 'prochazku' and 'prochazce' meet
+            if len(word) > 5:
+                yield word[:5], 0.7
+            padded = f'<{word}>'
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.2
+
+    def encode(self, texts):
+        np = _numpy()
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                h = zlib.crc32(feature.encode('utf-8'))
+                matrix[row, h % self.dim] += weight if (h // self.dim) & 1 else -weight
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model on the CPU"""
+
+    def __init__(self, model_path):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_path, device='cpu')
+        self.name = 'st-' + re.sub(r'[^\w.-]', '_', os.path.basename(model_path.rstrip('/')))
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts):
+        np = _numpy()
+        return self.model.encode(
+            list(texts), batch_size=ENCODE_BATCH, normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                if EMBEDDER == 'hashing':
+                    _embedder = HashingEmbedder()
+                elif EMBEDDER == 'sentence-transformers':
+                    if not EMBEDDING_MODEL:
+                        raise RuntimeError('KOLO_EMBEDDING_MODEL must point to a local model')
+                    _embedder = SentenceTransformerEmbedder(EMBEDDING_MODEL)
+                else:
+                    module_name, _, factory = EMBEDDER.partition(':')
+                    _embedder = getattr(importlib.import_module(module_name), factory)()
+    return _embedder
+
+
+def entry_text(title, content):
+    return f'{title}\n{content}' if title else content
+
+
+def _row_dtype(dim):
+    np = _numpy()
+    return np.dtype([('id', '<i8'), ('vec', '<f2', (dim,))])
+
+
+def _index_path(user_id):
+    return os.path.join(INDEX_DIR, get_embedder().name, f'{int(user_id)}.npy')
+
+
+class _UserLock:
+    """Exclusive lock on one user's index across worker processes"""
+
+    def __init__(self, path):
+        self.path = path + '.lock'
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+
+
+_mapped = OrderedDict()
+_mapped_lock = threading.Lock()
+
+
+def load_index(user_id):
+    """Memory-mapped rows of a user's index, or None if it was never built"""
+    np = _numpy()
+    path = _index_path(user_id)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _mapped_lock:
+        cached = _mapped.get(path)
+        if cached is not None and cached[0] == key:
+            _mapped.move_to_end(path)
+            return cached[1]
+
+    try:
+        rows = np.load(path, mmap_mode='r')
+    except ValueError:
+        # Empty index, nothing to map
+        rows = np.load(path)
+    if rows.dtype != _row_dtype(get_embedder().dim):
+        return None
+    with _mapped_lock:
+        _mapped[path] = (key, rows)
+        _mapped.move_to_end(path)
+        while len(_mapped) > CACHED_INDEXES:
+            # Unmapped, and its descriptor closed, once a running search drops the array too;
+            # closing the mmap explicitly would fail while numpy still exports its buffer
+            _mapped.popitem(last=False)
+    return rows
+
+
+def _write_index(path, rows):
+    # Replaced atomically, readers keep their mapping of the previous file
+    np = _numpy()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, rows)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _encode(texts):
+    np = _numpy()
+    embedder = get_embedder()
+    if not texts:
+        return np.zeros((0, embedder.dim), dtype=np.float32)
+    return np.concatenate([
+        embedder.encode(texts[start:start + ENCODE_BATCH])
+        for start in range(0, len(texts), ENCODE_BATCH)
+    ])
+
+
+def apply_changes(user_id, changes):
+    """Apply {entry_id: text or None} to a user's index, None removes the entry"""
+    np = _numpy()
+    dtype = _row_dtype(get_embedder().dim)
+    upserts = {entry_id: text for entry_id, text in changes.items() if text is not None}
+    vectors = _encode(list(upserts.values()))
+
+    path = _index_path(user_id)
+    with _UserLock(path):
+        current = load_index(user_id)
+        if current is None:
+            current = np.zeros(0, dtype=dtype)
+        keep = current[~np.isin(current['id'], list(changes))]
+        added = np.zeros(len(upserts), dtype=dtype)
+        added['id'] = list(upserts)
+        added['vec'] = vectors
+        _write_index(path, np.concatenate([keep, added]))
+
+
+def rebuild_user(user_id):
+    """Re-embed all journal entries of a user, needs an app context"""
+    np = _numpy()
+    entries = JournalEntry.query.filter_by(user_id=user_id).order_by(JournalEntry.id).all()
+    texts = [entry_text(data['title'], data['content']) for data in journal_store.entries_to_dicts(entries)]
+
+    rows = np.zeros(len(entries), dtype=_row_dtype(get_embedder().dim))
+    rows['id'] = [entry.id for entry in entries]
+    rows['vec'] = _encode(texts)
+
+    path = _index_path(user_id)
+    with _UserLock(path):
+        _write_index(path, rows)
+    return len(entries)
+
+
+def drop_user(user_id):
+    """Forget a user's index, the next search rebuilds it"""
+    path = _index_path(user_id)
+    with _UserLock(path):
+        if os.path.exists(path):
+            os.remove(path)
+    with _mapped_lock:
+        _mapped.pop(path, None)
+
+
+def search(user_id, text, limit=10):
+    """[(entry_id, score)] best first, or None if the user has no index yet"""
+    np = _numpy()
+    rows = load_index(user_id)
+    if rows is None:
+        return None
+    if len(rows) == 0:
+        return []
+
+    query = get_embedder().encode([text])[0].astype(np.float32)
+    scores = np.empty(len(rows), dtype=np.float32)
+    # Widen float16 to float32 in chunks so BLAS does the dot product
+    for start in range(0, len(rows), SCORE_CHUNK_ROWS):
+        chunk = rows['vec'][start:start + SCORE_CHUNK_ROWS]
+        scores[start:start + len(chunk)] = chunk.astype(np.float32) @ query
+
+    k = min(limit, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(rows['id'][i]), float(scores[i])) for i in top if scores[i] >= MIN_SCORE]
+
+
+class IndexQueue:
+    """Background embedding of changed journal entries, one thread per worker"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._worker_pid = None
+        self._lock = threading.Lock()
+        self._pending_rebuilds = set()
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, start one per worker process
+        if self._worker_pid != os.getpid():
+            with self._lock:
+                if self._worker_pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._pending_rebuilds = set()
+                    threading.Thread(target=self._run, daemon=True).start()
+                    self._worker_pid = os.getpid()
+
+    def index_entry(self, user_id, entry_id, text):
+        self._ensure_worker()
+        self._queue.put(('change', int(user_id), entry_id, text))
+
+    def remove_entry(self, user_id, entry_id):
+        self._ensure_worker()
+        self._queue.put(('change', int(user_id), entry_id, None))
+
+    def rebuild(self, app, user_id):
+        """Queue a rebuild from the database, once until it finished"""
+        self._ensure_worker()
+        user_id = int(user_id)
+        with self._lock:
+            if user_id in self._pending_rebuilds:
+                return
+            self._pending_rebuilds.add(user_id)
+        self._queue.put(('rebuild', user_id, None, app))
+
+    def _drain(self, first):
+        jobs = [first]
+        while len(jobs) < ENCODE_BATCH:
+            try:
+                jobs.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._drain(self._queue.get())
+            try:
+                self._process(jobs)
+            except Exception as e:
+                # The next rebuild of the user repairs whatever was lost
+                print(f'Error updating journal embeddings: {e}')
+            finally:
+                for _ in jobs:
+                    self._queue.task_done()
+
+    def _process(self, jobs):
+        changes = {}
+        for kind, user_id, entry_id, payload in jobs:
+            if kind == 'rebuild':
+                try:
+                    with payload.app_context(), using_user(user_id):
+                        rebuild_user(user_id)
+                finally:
+                    with self._lock:
+                        self._pending_rebuilds.discard(user_id)
+                # Rebuild already read the latest committed texts
+                changes.pop(user_id, None)
+            else:
+                # Later changes of the same entry win
+                changes.setdefault(user_id, {})[entry_id] = payload
+
+        for user_id, user_changes in changes.items():
+            if load_index(user_id) is None:
+                # Never built, the first search rebuilds from the database
+                continue
+            apply_changes(user_id, user_changes)
+
+    def join(self):
+        self._queue.join()
+
+
+index_queue = IndexQueue()
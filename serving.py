@@ -0,0 +1,81 @@
+"""
+Serving model helpers shared by the gunicorn configuration and the app.
+
+The API spends most of its time waiting on I/O (the LLM, OAuth providers,
+SQLite locks), so workers run either OS threads (gthread, the default) or
+green threads (gevent, when installed). Worker counts are derived from the
+CPU count and the container memory limit instead of being hard-coded.
+"""
+import importlib.util
+import logging
+import multiprocessing
+import os
+
+# Rough resident size of one worker process with all blueprints loaded
+WORKER_MEMORY_MB = int(os.getenv('KOLO_WORKER_MEMORY_MB', 150))
+
+
+def worker_class():
+    """Return the gunicorn worker class requested via KOLO_WORKER_CLASS"""
+    requested = os.getenv('KOLO_WORKER_CLASS', 'gthread')
+    if requested == 'gevent' and importlib.util.find_spec('gevent') is None:
+        # Runs while gunicorn loads its config, log where gunicorn logs its own warnings
+        logging.getLogger('gunicorn.error').warning('gevent is not installed, falling back to gthread workers')
+        return 'gthread'
+    return requested
+
+
+def memory_limit_mb():
+    """Memory available to the container in MB, or None when unlimited"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value) // (1024 * 1024)
+    return None
+
+
+def recommended_workers(klass=None):
+    """Autotune the number of worker processes for the given worker class"""
+    if os.getenv('WEB_CONCURRENCY'):
+        return int(os.getenv('WEB_CONCURRENCY'))
+
+    klass = klass or worker_class()
+    cpus = multiprocessing.cpu_count()
+
+    # Green threads multiplex I/O inside one process, so one per core is enough.
+    # Sync and threaded workers still hold the GIL per process, keep the classic 2n+1.
+    workers = cpus if klass == 'gevent' else cpus * 2 + 1
+
+    limit = memory_limit_mb()
+    if limit:
+        workers = min(workers, max(1, limit // WORKER_MEMORY_MB))
+
+    return max(1, min(workers, int(os.getenv('KOLO_MAX_WORKERS', 8))))
+
+
+def recommended_threads(klass=None):
+    """Threads per worker for gthread workers"""
+    klass = klass or worker_class()
+    if klass != 'gthread':
+        return 1
+    return int(os.getenv('KOLO_THREADS', 16))
+
+
+def configure_sqlite_engine(engine):
+    """Let concurrent readers and writers share a SQLite file without blocking each other"""
+    from sqlalchemy import event
+
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+        cursor.close()
@@ -0,0 +1,375 @@
+"""
+Per-user sharding of user data across several databases.
+
+Tables holding one user's data (SHARDED_TABLES) live on the user's shard:
+the default database (SQLALCHEMY_DATABASE_URI) or one of the extra shards
+configured as Flask-SQLAlchemy binds:
+
+    KOLO_SHARDS="s1=sqlite:////data/shard1.db,s2=postgresql://db2/kolo"
+
+Global tables (users, the shard directory, token revocations, push
+subscriptions, reminders, claims, ...) stay on the default database. Each
+SQLite file has its own write lock, so writes of users on different shards
+no longer serialize on one file.
+
+The directory table user_shards maps user ids to shards. Users without a
+row live on the default database, which is where all data lived before
+sharding, so enabling it needs no migration. New users are spread over all
+shards; `flask move-user` moves existing ones.
+
+The session routes every statement on a sharded table to the shard of the
+current user: the JWT identity inside a request, or the user/shard set with
+using_user()/using_shard() in background jobs and CLI commands. Without any
+extra shards the routing is a no-op.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import has_request_context
+from sqlalchemy import inspect, insert, select, update, delete
+from src.models.user import db
+
+DEFAULT_SHARD = 'default'
+# Directory entries are cached per worker this long; moves wait it out
+DIRECTORY_TTL_SECONDS = 5
+SHARDED_TABLES = {
+    'wellness_categories', 'wellness_entries', 'journal_entries', 'journal_contents',
+    'journal_attachments', 'ai_inspirations', 'data_versions', 'archive_partitions',
+    'activity_calendars',
+}
+# References the move tool must remap that may not be declared as foreign keys
+EXTRA_REFERENCES = {('wellness_entries', 'category_id'): 'wellness_categories'}
+# Called as hook(user_id, id_maps) after a move, for ids kept outside the database
+MOVE_HOOKS = []
+# Called as hook(connection, user_id) before a user's rows are deleted from a shard,
+# for derived data the copy does not carry, such as search indexes
+DELETE_HOOKS = []
+
+
+class ShardMoving(Exception):
+    """The user is being moved between shards, retry in a few seconds"""
+
+
+class UserShard(db.Model):
+    __tablename__ = 'user_shards'
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    shard = db.Column(db.String(50), nullable=False, index=True)
+    moving = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def binds_from_env():
+    """SQLALCHEMY_BINDS entries of the extra shards"""
+    binds = {}
+    for item in os.getenv('KOLO_SHARDS', '').split(','):
+        name, _, url = item.strip().partition('=')
+        if name and url:
+            binds[name.strip()] = url.strip()
+    return binds
+
+
+EXTRA_SHARDS = sorted(binds_from_env())
+
+
+def shard_names():
+    return [DEFAULT_SHARD] + EXTRA_SHARDS
+
+
+def shard_engine(shard):
+    return db.engine if shard == DEFAULT_SHARD else db.engines[shard]
+
+
+def sharded_tables():
+    return [table for table in db.metadata.sorted_tables if table.name in SHARDED_TABLES]
+
+
+class _Directory:
+    """Per-worker cache of user_shards, read outside the ORM session"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(user_id)
+        if cached is not None and now - cached[2] < DIRECTORY_TTL_SECONDS:
+            return cached[0], cached[1]
+
+        # A separate connection: this runs inside Session.get_bind, possibly mid-flush
+        table = UserShard.__table__
+        with db.engine.connect() as connection:
+            row = connection.execute(
+                select(table.c.shard, table.c.moving).where(table.c.user_id == user_id)
+            ).first()
+        shard, moving = (row[0], bool(row[1])) if row else (DEFAULT_SHARD, False)
+        with self._lock:
+            self._entries[user_id] = (shard, moving, now)
+        return shard, moving
+
+    def remember(self, user_id, shard):
+        with self._lock:
+            self._entries[user_id] = (shard, False, time.monotonic())
+
+    def forget(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+directory = _Directory()
+
+_current = contextvars.ContextVar('kolo_shard_target', default=None)
+
+
+@contextmanager
+def using_user(user_id):
+    """Route sharded tables to this user's shard, for work outside a request"""
+    token = _current.set(('user', int(user_id)))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def using_shard(shard):
+    """Route sharded tables to one shard, for maintenance over all users of it"""
+    token = _current.set(('shard', shard))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def _target():
+    target = _current.get()
+    if target is None and has_request_context():
+        from flask_jwt_extended import get_jwt_identity
+        try:
+            identity = get_jwt_identity()
+        except RuntimeError:
+            identity = None
+        if identity is not None:
+            target = ('user', int(identity))
+    return target
+
+
+def current_user_id():
+    """The user selected with using_user() or the request's JWT identity, None otherwise"""
+    target = _target()
+    return target[1] if target is not None and target[0] == 'user' else None
+
+
+def current_shard():
+    target = _target()
+    if target is None:
+        raise RuntimeError('No user or shard selected for a sharded table')
+    kind, value = target
+    if kind == 'shard':
+        return value
+    shard, moving = directory.lookup(value)
+    if moving:
+        raise ShardMoving(value)
+    return shard
+
+
+def touches(mapper, clause, table_names):
+    """Whether a statement routed through Session.get_bind uses one of the tables"""
+    if mapper is not None:
+        return inspect(mapper).local_table.name in table_names
+    if clause is None:
+        return False
+    table = getattr(clause, 'table', None)
+    if table is not None:
+        return table.name in table_names
+    froms = clause.get_final_froms() if hasattr(clause, 'get_final_froms') else getattr(clause, 'froms', [])
+    return any(getattr(item, 'name', None) in table_names for item in froms)
+
+
+def _is_sharded(mapper, clause):
+    return touches(mapper, clause, SHARDED_TABLES)
+
+
+def _routing_session_class(base):
+    class ShardRoutingSession(base):
+        def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+            if bind is None and EXTRA_SHARDS and _is_sharded(mapper, clause):
+                return shard_engine(current_shard())
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    return ShardRoutingSession
+
+
+def install():
+    """Route db.session per user; a subclass keeps the listeners registered on the session class"""
+    factory = db.session.session_factory
+    if not factory.class_.__name__ == 'ShardRoutingSession':
+        factory.class_ = _routing_session_class(factory.class_)
+
+
+install()
+
+
+def assign_shard(user_id):
+    """Place a new user on a shard, spreading users over all shards
+
+    The directory row is written in the session's transaction, together with
+    the user row, and cached right away because the uncommitted row is not
+    visible to directory lookups yet.
+    """
+    shards = shard_names()
+    shard = shards[int(user_id) % len(shards)]
+    if shard != DEFAULT_SHARD:
+        db.session.execute(insert(UserShard).values(
+            user_id=int(user_id), shard=shard, moving=False, updated_at=datetime.utcnow()
+        ))
+    directory.remember(int(user_id), shard)
+    return shard
+
+
+def create_shard_tables():
+    """Create the sharded tables on every extra shard, see src.schema for their indexes"""
+    tables = sharded_tables()
+    for shard in EXTRA_SHARDS:
+        db.metadata.create_all(shard_engine(shard), tables=tables)
+
+
+def user_filter(table, user_id):
+    """Where clause for the rows of a sharded table that belong to a user"""
+    if 'user_id' in table.c:
+        return table.c.user_id == user_id
+    # Child rows without user_id, e.g. journal_contents through journal_entries
+    for fk in table.foreign_keys:
+        parent = fk.column.table
+        if 'user_id' in parent.c:
+            return fk.parent.in_(select(fk.column).where(parent.c.user_id == user_id))
+    raise RuntimeError(f'Cannot tell which rows of {table.name} belong to a user')
+
+
+def _references(table):
+    references = {fk.parent.name: fk.column.table.name for fk in table.foreign_keys}
+    for (table_name, column), target in EXTRA_REFERENCES.items():
+        if table_name == table.name:
+            references.setdefault(column, target)
+    return references
+
+
+def copy_user_rows(source_conn, target_conn, user_id, tables=None, log=print):
+    """Copy a user's rows between databases with fresh ids on the target
+
+    References between the copied tables are remapped. Returns the number of
+    copied rows and {table name: {old id: new id}}.
+    """
+    copied = 0
+    id_maps = {}
+    for table in tables or sharded_tables():
+        rows = source_conn.execute(select(table).where(user_filter(table, user_id))).mappings().all()
+        references = _references(table)
+        primary = list(table.primary_key.columns)
+        remap_primary = (len(primary) == 1 and isinstance(primary[0].type, db.Integer)
+                         and not primary[0].foreign_keys)
+        id_map = id_maps.setdefault(table.name, {})
+
+        for row in rows:
+            values = dict(row)
+            for column, referenced in references.items():
+                if values.get(column) in id_maps.get(referenced, {}):
+                    values[column] = id_maps[referenced][values[column]]
+            if remap_primary:
+                # Ids are per database, the target assigns new ones
+                old_id = values.pop(primary[0].name)
+                id_map[old_id] = target_conn.execute(insert(table).values(**values)).inserted_primary_key[0]
+            else:
+                target_conn.execute(insert(table).values(**values))
+        copied += len(rows)
+        log(f'{table.name}: {len(rows)} rows')
+    return copied, id_maps
+
+
+def delete_user_rows(connection, user_id, tables=None):
+    for hook in DELETE_HOOKS:
+        hook(connection, user_id)
+    # Children first, their filters read the parents
+    for table in reversed(tables or sharded_tables()):
+        connection.execute(delete(table).where(user_filter(table, user_id)))
+
+
+def _set_directory(user_id, **values):
+    table = UserShard.__table__
+    values['updated_at'] = datetime.utcnow()
+    with db.engine.begin() as connection:
+        if connection.execute(update(table).where(table.c.user_id == user_id).values(**values)).rowcount == 0:
+            connection.execute(insert(table).values(
+                user_id=user_id, shard=values.get('shard', DEFAULT_SHARD), moving=values.get('moving', False),
+                updated_at=values['updated_at']
+            ))
+
+
+def _mark_moving(user_id):
+    directory.forget(user_id)
+    shard, moving = directory.lookup(user_id)
+    if moving:
+        raise RuntimeError(f'User {user_id} is already being moved')
+    _set_directory(user_id, shard=shard, moving=True)
+    # Every worker sees the moving flag before rows change
+    time.sleep(DIRECTORY_TTL_SECONDS + 1)
+    return shard
+
+
+@contextmanager
+def paused_user(user_id):
+    """Answer the user's requests with 503 while their rows are rewritten in place
+
+    Yields the user's shard.
+    """
+    user_id = int(user_id)
+    shard = _mark_moving(user_id)
+    try:
+        yield shard
+    finally:
+        _set_directory(user_id, shard=shard, moving=False)
+        directory.forget(user_id)
+
+
+def move_user(user_id, target, log=print):
+    """Move one user's rows to another shard while the app keeps serving others
+
+    The user is marked as moving (their requests get 503 for a few seconds),
+    rows are copied to the target in one transaction with fresh ids on the
+    target shard, the directory is switched and the source rows deleted.
+    Data versions are bumped with the copy, so ETags of lists holding the old
+    ids stop matching. Returns the number of copied rows.
+    """
+    from src.data_versions import bump_all_scopes
+
+    user_id = int(user_id)
+    if target not in shard_names():
+        raise ValueError(f'Unknown shard {target}')
+    directory.forget(user_id)
+    if directory.lookup(user_id)[0] == target:
+        return 0
+
+    source = _mark_moving(user_id)
+    try:
+        with shard_engine(source).connect() as source_conn, shard_engine(target).begin() as target_conn:
+            copied, id_maps = copy_user_rows(source_conn, target_conn, user_id, log=log)
+            bump_all_scopes(target_conn, user_id)
+    except Exception:
+        _set_directory(user_id, shard=source, moving=False)
+        raise
+
+    _set_directory(user_id, shard=target, moving=False)
+    directory.forget(user_id)
+    for hook in MOVE_HOOKS:
+        hook(user_id, id_maps)
+
+    with shard_engine(source).begin() as source_conn:
+        delete_user_rows(source_conn, user_id)
+    directory.forget(user_id)
+    return copied
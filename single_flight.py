@@ -0,0 +1,165 @@
+"""
+Single-flight execution of expensive per-user computations.
+
+Concurrent callers with the same key share one computation instead of each
+running it: within a worker, followers wait for the leader thread's result.
+Across gunicorn workers, callers that can find the result in the database
+afterwards (a `lookup`) coordinate through a claim row in flight_claims: the
+worker that inserts the claim computes, the others poll `lookup` until the
+result appears. Claims expire, so a crashed owner only delays the others.
+
+Results are shared between threads, so they must be plain data (dicts,
+lists), never ORM objects bound to the leader's session.
+
+    data = single_flight(('stats', user_id), compute)                  # in-process only
+    data = single_flight(('daily', user_id, today), compute, lookup)   # also across workers
+"""
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from src.models.user import db
+
+CLAIM_TTL_SECONDS = 60
+WAIT_TIMEOUT_SECONDS = 45
+POLL_SECONDS = 0.2
+
+
+class FlightClaim(db.Model):
+    __tablename__ = 'flight_claims'
+
+    key = db.Column(db.String(255), primary_key=True)
+    owner = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """In-process coalescing of concurrent calls with the same key"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=WAIT_TIMEOUT_SECONDS):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            # The leader is stuck, do not hang the request with it
+            return fn()
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+flights = SingleFlight()
+
+
+def owner():
+    """Claim owner of this process
+
+    Computed per call, not at import: with preload_app the module is imported
+    in the gunicorn master and every forked worker would share its pid.
+    """
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _claim_key(key):
+    return ':'.join(str(part) for part in key) if isinstance(key, tuple) else str(key)
+
+
+def claim(key, ttl=CLAIM_TTL_SECONDS):
+    """Try to become the one worker computing key; commits the claim"""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl)
+    try:
+        db.session.execute(insert(FlightClaim).values(key=key, owner=owner(), expires_at=expires_at))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+
+    # Take over a claim whose owner died
+    taken = db.session.execute(
+        update(FlightClaim)
+        .where(FlightClaim.key == key, FlightClaim.expires_at < now)
+        .values(owner=owner(), expires_at=expires_at)
+    ).rowcount == 1
+    db.session.commit()
+    return taken
+
+
+def release(key):
+    db.session.execute(delete(FlightClaim).where(FlightClaim.key == key, FlightClaim.owner == owner()))
+    db.session.commit()
+
+
+def _across_workers(key, compute, lookup, ttl, wait_timeout):
+    result = lookup()
+    if result is not None:
+        return result
+
+    deadline = time.monotonic() + wait_timeout
+    while True:
+        if claim(key, ttl):
+            try:
+                # Another worker may have finished between our lookup and the claim
+                result = lookup()
+                return result if result is not None else compute()
+            except Exception:
+                # Leave the session usable for releasing the claim
+                db.session.rollback()
+                raise
+            finally:
+                release(key)
+
+        if time.monotonic() > deadline:
+            return compute()
+        time.sleep(POLL_SECONDS)
+        # End the read transaction so the next lookup sees the owner's commit
+        db.session.rollback()
+        result = lookup()
+        if result is not None:
+            return result
+
+
+def single_flight(key, compute, lookup=None, ttl=CLAIM_TTL_SECONDS, wait_timeout=WAIT_TIMEOUT_SECONDS):
+    """Run compute() once for all concurrent callers of key
+
+    lookup() returns the stored result or None; with it the computation is
+    also coalesced across worker processes. Call without pending changes in
+    the session, the claim is committed on its own.
+    """
+    if lookup is None:
+        return flights.do(key, compute, timeout=wait_timeout)
+    return flights.do(
+        key,
+        lambda: _across_workers(_claim_key(key), compute, lookup, ttl, wait_timeout),
+        timeout=wait_timeout + ttl
+    )
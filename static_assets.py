@@ -0,0 +1,140 @@
+"""
+Static asset serving for the React bundle.
+
+The static folder is scanned once into an in-memory manifest, so serving a
+file or the SPA fallback needs no filesystem stat. Precompressed .br/.gz
+siblings (created by `flask precompress-static` at build time) are picked
+per Accept-Encoding, content-hashed build outputs are cached as immutable,
+and range requests are supported for uncompressed files.
+"""
+import gzip
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import current_app, request
+from werkzeug.wsgi import wrap_file
+
+try:
+    import brotli
+except ImportError:  # brotli variants are optional
+    brotli = None
+
+# Content hashes in file names: hex ones like logo.3f2a9c1d.svg anywhere (not
+# all digits, which is more likely a date), and Vite's base64url ones like
+# index-B4x9Qz1a.js only in its assets/ output directory
+HEX_HASHED_NAME = re.compile(r'[.-](?=[0-9]*[a-f])[0-9a-f]{8,}\.[A-Za-z0-9]+$')
+VITE_HASHED_NAME = re.compile(r'^assets/(?:.*/)?[^/]+-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$')
+COMPRESSIBLE_EXTENSIONS = {'.js', '.mjs', '.css', '.html', '.svg', '.json', '.map', '.txt', '.xml', '.ico',
+                           '.webmanifest'}
+MIN_COMPRESS_SIZE = 1024
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'
+
+
+class StaticAsset:
+    def __init__(self, rel_path, abs_path, stat):
+        self.rel_path = rel_path
+        self.abs_path = abs_path
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.etag = f'{self.mtime:x}-{self.size:x}'
+        self.mimetype = mimetypes.guess_type(rel_path)[0] or 'application/octet-stream'
+        self.immutable = bool(HEX_HASHED_NAME.search(rel_path) or VITE_HASHED_NAME.match(rel_path))
+        # encoding -> (path, size) of precompressed variants
+        self.variants = {}
+
+
+class StaticAssetManifest:
+    """In-memory index of the static folder"""
+
+    def __init__(self, root, fallback='index.html'):
+        self.root = root
+        self.fallback = fallback
+        self.assets = {}
+        if root:
+            self.build()
+
+    def build(self):
+        assets = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                abs_path = os.path.join(dirpath, filename)
+                rel_path = os.path.relpath(abs_path, self.root).replace(os.sep, '/')
+                if rel_path.endswith(('.br', '.gz')):
+                    continue
+                assets[rel_path] = StaticAsset(rel_path, abs_path, os.stat(abs_path))
+
+        for asset in assets.values():
+            for encoding, suffix in ENCODINGS:
+                variant_path = asset.abs_path + suffix
+                if os.path.exists(variant_path):
+                    asset.variants[encoding] = (variant_path, os.path.getsize(variant_path))
+
+        self.assets = assets
+
+    def lookup(self, path):
+        """Asset for the request path, or the SPA entry point"""
+        asset = self.assets.get(path)
+        if asset is None and current_app.debug and path:
+            # Pick up files added by the dev server without a restart
+            self.build()
+            asset = self.assets.get(path)
+        return asset or self.assets.get(self.fallback)
+
+    def serve(self, path):
+        if not self.root:
+            return "Static folder not configured", 404
+
+        asset = self.lookup(path)
+        if asset is None:
+            return f"{self.fallback} not found", 404
+
+        file_path, size, encoding = asset.abs_path, asset.size, None
+        if asset.variants and 'Range' not in request.headers:
+            for candidate, _ in ENCODINGS:
+                if candidate in asset.variants and candidate in request.accept_encodings:
+                    file_path, size = asset.variants[candidate]
+                    encoding = candidate
+                    break
+
+        response = current_app.response_class(
+            wrap_file(request.environ, open(file_path, 'rb')),
+            mimetype=asset.mimetype,
+            direct_passthrough=True
+        )
+        response.content_length = size
+        response.last_modified = asset.mtime
+        response.set_etag(f'{asset.etag}-{encoding}' if encoding else asset.etag)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE if asset.immutable else REVALIDATE_CACHE
+        if asset.variants:
+            response.vary.add('Accept-Encoding')
+        if encoding:
+            response.content_encoding = encoding
+
+        return response.make_conditional(request, accept_ranges=encoding is None, complete_length=size)
+
+
+def precompress(root):
+    """Write .gz (and .br when brotli is installed) next to compressible files"""
+    written = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.path.splitext(filename)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            if os.path.getsize(path) < MIN_COMPRESS_SIZE:
+                continue
+
+            with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb', compresslevel=9) as dst:
+                shutil.copyfileobj(src, dst)
+            written += 1
+
+            if brotli is not None:
+                with open(path, 'rb') as src, open(path + '.br', 'wb') as dst:
+                    dst.write(brotli.compress(src.read(), quality=11))
+                written += 1
+    return written
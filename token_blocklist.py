@@ -0,0 +1,256 @@
+"""
+JWT revocation list and verified-token cache.
+
+Revoked token ids (jti) are persisted in the revoked_tokens table, which is
+the source of truth. Every worker answers "is this token revoked?" without
+touching the database:
+
+* a Bloom filter stored in a memory-mapped file shared by all workers on the
+  host answers "definitely not revoked" for almost every request,
+* an in-process exact set confirms the rare positives, and is refreshed from
+  the table incrementally (only rows newer than the last one seen), at most
+  once per sync interval or when the Bloom filter reports an unknown jti.
+  A jti that still is not revoked after that sync is a false positive of the
+  filter. It is remembered until any worker on the host revokes a token (a
+  generation counter in the shared file), at most for one sync interval,
+  which is also how long revocations from other hosts take to arrive.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask_jwt_extended import JWTManager
+from sqlalchemy.exc import IntegrityError
+from src.models.user import db
+
+BLOOM_BITS = 1 << 20  # 128 KiB file, < 1% false positives up to ~100k revoked tokens
+BLOOM_HASHES = 7
+SYNC_INTERVAL_SECONDS = 30
+FALSE_POSITIVES_CACHED = 1024
+
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), unique=True, nullable=False)
+    token_type = db.Column(db.String(10), nullable=False)
+    user_id = db.Column(db.Integer, index=True)
+    expires_at = db.Column(db.DateTime, index=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SharedBloomFilter:
+    """Bloom filter whose bit array lives in a file mapped by every worker
+
+    An 8-byte generation counter after the bit array counts the published
+    additions, i.e. the revocations made on this host.
+    """
+
+    def __init__(self, path, bits=BLOOM_BITS, hashes=BLOOM_HASHES):
+        self.path = path
+        self.bits = bits
+        self.hashes = hashes
+        self._map = None
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _mapping(self):
+        # Map lazily and re-map after fork so each worker owns its descriptor
+        if self._map is None or self._pid != os.getpid():
+            size = self.bits // 8 + 8
+            self._file = open(self.path, 'a+b')
+            if os.fstat(self._file.fileno()).st_size < size:
+                self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+            self._pid = os.getpid()
+        return self._map
+
+    def _positions(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).digest()
+        for i in range(self.hashes):
+            yield int.from_bytes(digest[i * 4:i * 4 + 4], 'little') % self.bits
+
+    def add(self, key, publish=True):
+        mapping = self._mapping()
+        with self._lock:
+            # Bit updates are read-modify-write on a byte, serialize them across workers too
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                for pos in self._positions(key):
+                    mapping[pos >> 3] |= 1 << (pos & 7)
+                if publish:
+                    offset = self.bits // 8
+                    generation = int.from_bytes(mapping[offset:offset + 8], 'little') + 1
+                    mapping[offset:offset + 8] = generation.to_bytes(8, 'little')
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def generation(self):
+        mapping = self._mapping()
+        offset = self.bits // 8
+        return int.from_bytes(mapping[offset:offset + 8], 'little')
+
+    def __contains__(self, key):
+        mapping = self._mapping()
+        return all(mapping[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def clear(self):
+        mapping = self._mapping()
+        with self._lock:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                mapping[:] = bytes(len(mapping))
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+
+class TokenBlocklist:
+    """O(1) revocation checks backed by the revoked_tokens table"""
+
+    def __init__(self, bloom_path=None):
+        self.bloom = SharedBloomFilter(
+            bloom_path or os.getenv(
+                'KOLO_BLOCKLIST_PATH',
+                os.path.join(tempfile.gettempdir(), 'kolo-revoked-tokens.bloom')
+            )
+        )
+        self._revoked = set()
+        self._false_positives = OrderedDict()  # jti -> (time, filter generation) it was found not revoked
+        self._last_id = 0
+        self._last_sync = 0.0
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """Pull revocations written by other workers or hosts since the last sync"""
+        with self._lock:
+            rows = db.session.query(RevokedToken.id, RevokedToken.jti).filter(
+                RevokedToken.id > self._last_id
+            ).order_by(RevokedToken.id).all()
+            for row_id, jti in rows:
+                self._revoked.add(jti)
+                # Published by the worker that revoked it
+                self.bloom.add(jti, publish=False)
+                self._last_id = row_id
+            self._last_sync = time.monotonic()
+
+    def is_revoked(self, jti):
+        if time.monotonic() - self._last_sync > SYNC_INTERVAL_SECONDS:
+            self.sync()
+
+        if jti not in self.bloom:
+            return False
+        if jti in self._revoked:
+            return True
+        with self._lock:
+            checked = self._false_positives.get(jti)
+        if (checked is not None and time.monotonic() - checked[0] < SYNC_INTERVAL_SECONDS
+                and checked[1] == self.bloom.generation()):
+            return False
+
+        # Revoked by another worker since our last sync, or a false positive
+        generation = self.bloom.generation()
+        self.sync()
+        if jti in self._revoked:
+            return True
+        with self._lock:
+            self._false_positives[jti] = (time.monotonic(), generation)
+            self._false_positives.move_to_end(jti)
+            if len(self._false_positives) > FALSE_POSITIVES_CACHED:
+                self._false_positives.popitem(last=False)
+        return False
+
+    def revoke(self, jwt_payload):
+        """Persist the revocation of a decoded token and publish it to all workers
+
+        Returns False when the token was already revoked, e.g. by a concurrent
+        refresh with the same single-use token.
+        """
+        jti = jwt_payload['jti']
+        if jti in self._revoked:
+            return False
+
+        expires_at = None
+        if jwt_payload.get('exp'):
+            expires_at = datetime.utcfromtimestamp(jwt_payload['exp'])
+
+        db.session.add(RevokedToken(
+            jti=jti,
+            token_type=jwt_payload.get('type', 'access'),
+            user_id=jwt_payload.get('sub'),
+            expires_at=expires_at
+        ))
+        try:
+            db.session.commit()
+            revoked = True
+        except IntegrityError:
+            # Another request revoked it between our check and the insert
+            db.session.rollback()
+            revoked = False
+
+        self.bloom.add(jti)
+        self._revoked.add(jti)
+        return revoked
+
+    def prune_expired(self):
+        """Forget revocations of tokens that have expired anyway and rebuild the filter"""
+        deleted = RevokedToken.query.filter(RevokedToken.expires_at < datetime.utcnow()).delete()
+        db.session.commit()
+
+        with self._lock:
+            self._revoked.clear()
+            self._last_id = 0
+            self.bloom.clear()
+        self.sync()
+        return deleted
+
+
+class CachingJWTManager(JWTManager):
+    """JWTManager that skips signature verification for recently verified tokens
+
+    Only the decode step is cached; blocklist and identity checks still run
+    for every request, so a revoked token is rejected even when cached.
+    The overridden decode method is private to flask-jwt-extended, which is
+    pinned in requirements.txt; start-up fails if an upgrade removes it.
+    """
+
+    def __init__(self, app=None, cache_size=1024, **kwargs):
+        if not callable(getattr(JWTManager, '_decode_jwt_from_config', None)):
+            raise RuntimeError('flask-jwt-extended no longer has JWTManager._decode_jwt_from_config, '
+                               'update CachingJWTManager for this version')
+        self._verified = OrderedDict()
+        self._verified_lock = threading.Lock()
+        self._cache_size = cache_size
+        super().__init__(app, **kwargs)
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        if allow_expired:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+
+        key = (encoded_token, csrf_value)
+        with self._verified_lock:
+            claims = self._verified.get(key)
+            if claims is not None:
+                if claims.get('exp') is None or claims['exp'] > time.time():
+                    self._verified.move_to_end(key)
+                    return claims
+                del self._verified[key]
+
+        # Raises for expired or tampered tokens, which are never cached
+        claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+
+        with self._verified_lock:
+            self._verified[key] = claims
+            if len(self._verified) > self._cache_size:
+                self._verified.popitem(last=False)
+        return claims
+
+
+blocklist = TokenBlocklist()
@@ -1,12 +1,146 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.models.user import User, db
+from sqlalchemy import and_, func, or_
+from datetime import datetime, timedelta
+from functools import wraps
+import base64
+import json
+import os
 
 user_bp = Blueprint('user', __name__)
 
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv('KOLO_ADMIN_EMAILS', '').split(',') if email.strip()}
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH = 1000
+# Upper bound of a prefix range, sorts after every character
+PREFIX_END = '\U0010ffff'
+
+# Prefix searches are range scans over these, ties broken by id for keyset pages
+db.Index('ix_users_email_lower', func.lower(User.email), User.id)
+db.Index('ix_users_name_lower', func.lower(User.name), User.id)
+db.Index('ix_users_provider_id', User.provider, User.id)
+db.Index('ix_users_created_at', User.created_at)
+
+def admin_required(view):
+    """Only users whose email is listed in KOLO_ADMIN_EMAILS"""
+    @wraps(view)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        user = db.session.get(User, int(get_jwt_identity()))
+        if user is None or (user.email or '').lower() not in ADMIN_EMAILS:
+            return jsonify({'error': 'Admin access required'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def _parse_day(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'Invalid {name} format. Use YYYY-MM-DD')
+
+def directory_query(args):
+    """Filtered user query and its sort expression (None for newest first by id)
+
+    Raises ValueError for invalid filters.
+    """
+    query = User.query
+    if args.get('provider'):
+        query = query.filter(User.provider == args['provider'])
+    if args.get('created_from'):
+        query = query.filter(User.created_at >= _parse_day(args['created_from'], 'created_from'))
+    if args.get('created_to'):
+        # Inclusive day, compared as the start of the next one
+        end = _parse_day(args['created_to'], 'created_to') + timedelta(days=1)
+        query = query.filter(User.created_at < end)
+
+    email = args.get('email', '').strip().lower()
+    name = args.get('name', '').strip().lower()
+    if email and name:
+        raise ValueError('Search by email or by name, not both')
+    if not email and not name:
+        return query, None
+
+    sort = func.lower(User.email) if email else func.lower(User.name)
+    prefix = email or name
+    return query.filter(sort >= prefix, sort < prefix + PREFIX_END), sort
+
+def _encode_cursor(key, user_id):
+    return base64.urlsafe_b64encode(json.dumps([key, user_id]).encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor):
+    try:
+        key, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return key, int(user_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def directory_page(query, sort, cursor=None, limit=PAGE_SIZE):
+    """One keyset page: (users, cursor of the next page or None)"""
+    if sort is None:
+        if cursor:
+            _, last_id = _decode_cursor(cursor)
+            query = query.filter(User.id < last_id)
+        rows = query.add_columns(User.id.label('sort_key')).order_by(User.id.desc()).limit(limit + 1).all()
+    else:
+        if cursor:
+            key, last_id = _decode_cursor(cursor)
+            query = query.filter(or_(sort > key, and_(sort == key, User.id > last_id)))
+        rows = query.add_columns(sort.label('sort_key')).order_by(sort, User.id).limit(limit + 1).all()
+
+    users = [user for user, _ in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        _, key = rows[limit - 1]
+        next_cursor = _encode_cursor(key, users[-1].id)
+    return users, next_cursor
+
 @user_bp.route('/users', methods=['GET'])
+@admin_required
 def get_users():
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    """Admin user directory, keyset paginated
+
+    ?email= or ?name= search by prefix, ?provider=, ?created_from= and
+    ?created_to= filter, ?cursor= continues from the previous page.
+    """
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    try:
+        query, sort = directory_query(request.args)
+        users, next_cursor = directory_page(query, sort, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'users': [user.to_dict() for user in users],
+        'next_cursor': next_cursor
+    })
+
+@user_bp.route('/users/export', methods=['GET'])
+@admin_required
+def export_users():
+    """Stream the filtered user directory as NDJSON, one page in memory at a time"""
+    try:
+        query, sort = directory_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        cursor = None
+        while True:
+            users, cursor = directory_page(query, sort, cursor, EXPORT_BATCH)
+            for user in users:
+                yield json.dumps(user.to_dict(), ensure_ascii=False, default=str) + '\n'
+            # Rows of sent pages are not kept in the session
+            db.session.expunge_all()
+            if cursor is None:
+                return
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': 'attachment; filename=users.ndjson'}
+    )
 
 @user_bp.route('/users', methods=['POST'])
 def create_user():
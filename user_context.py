@@ -0,0 +1,193 @@
+"""
+User context summaries for personalized inspirations.
+
+A summary captures what matters for the prompt: which wellness categories
+are declining or improving and which tags the user wrote about recently. It
+is deliberately coarse (category names and a few tags, no scores or text),
+so many users share the same summary and therefore the same cached
+generations.
+
+Summaries are cached per worker keyed by the user's data versions, so they
+are only recomputed after the user saved something; an unchanged user costs
+one primary-key lookup. Generated texts are cached in the database by
+(context hash, type, day), shared by all users and workers.
+"""
+import hashlib
+import json
+import random
+import threading
+from collections import Counter, OrderedDict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import case, func
+from src.models.user import db, WellnessCategory, WellnessEntry, JournalEntry
+from src.data_versions import current_versions
+
+RECENT_DAYS = 7
+BASELINE_DAYS = 21
+TREND_THRESHOLD = 1.0
+LOW_SCORE = 4
+TOP_TAGS = 3
+# Distinct texts kept per context and type and day before cached ones are reused
+VARIANTS_PER_CONTEXT = 5
+SUMMARY_CACHE_SIZE = 4096
+
+
+class InspirationCache(db.Model):
+    __tablename__ = 'inspiration_cache'
+
+    id = db.Column(db.Integer, primary_key=True)
+    context_hash = db.Column(db.String(40), nullable=False)
+    inspiration_type = db.Column(db.String(50), nullable=False)
+    created_date = db.Column(db.Date, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_inspiration_cache_lookup', 'context_hash', 'inspiration_type', 'created_date'),
+    )
+
+
+_summaries = OrderedDict()
+_summaries_lock = threading.Lock()
+
+
+def _category_trends(user_id, today):
+    recent_start = today - timedelta(days=RECENT_DAYS)
+    baseline_start = today - timedelta(days=BASELINE_DAYS)
+    is_recent = WellnessEntry.entry_date > recent_start
+
+    # One aggregate over the last three weeks instead of loading the entries
+    rows = db.session.query(
+        WellnessCategory.name,
+        func.avg(case((is_recent, WellnessEntry.score))),
+        func.avg(case((~is_recent, WellnessEntry.score))),
+    ).join(
+        WellnessCategory, WellnessCategory.id == WellnessEntry.category_id
+    ).filter(
+        WellnessEntry.user_id == user_id,
+        WellnessEntry.entry_date > baseline_start,
+        WellnessEntry.entry_date <= today,
+        WellnessCategory.is_active == True
+    ).group_by(WellnessCategory.name).all()
+
+    declining, improving, low = [], [], []
+    for name, recent_avg, baseline_avg in rows:
+        if recent_avg is None:
+            continue
+        if recent_avg <= LOW_SCORE:
+            low.append(name)
+        if baseline_avg is None:
+            continue
+        if recent_avg < baseline_avg - TREND_THRESHOLD:
+            declining.append(name)
+        elif recent_avg > baseline_avg + TREND_THRESHOLD:
+            improving.append(name)
+    return sorted(declining), sorted(improving), sorted(low)
+
+
+def _recent_tags(user_id, today):
+    # Private entries never reach the prompt or the shared cache
+    rows = db.session.query(JournalEntry.tags).filter(
+        JournalEntry.user_id == user_id,
+        JournalEntry.is_private == False,
+        JournalEntry.entry_date > today - timedelta(days=RECENT_DAYS * 2)
+    ).all()
+
+    counts = Counter()
+    for (tags,) in rows:
+        try:
+            counts.update(json.loads(tags) if tags else [])
+        except json.JSONDecodeError:
+            continue
+    return sorted(tag for tag, _ in counts.most_common(TOP_TAGS))
+
+
+def build_summary(user_id, today=None):
+    today = today or date.today()
+    declining, improving, low = _category_trends(user_id, today)
+    return {
+        'declining': declining,
+        'improving': improving,
+        'low': low,
+        'tags': _recent_tags(user_id, today),
+    }
+
+
+def get_summary(user_id):
+    """Cached context summary, recomputed only after the user's data changed"""
+    key = (int(user_id), date.today(), *current_versions(user_id, ['wellness', 'journal']))
+    with _summaries_lock:
+        summary = _summaries.get(key)
+        if summary is not None:
+            _summaries.move_to_end(key)
+            return summary
+
+    summary = build_summary(user_id)
+    with _summaries_lock:
+        _summaries[key] = summary
+        if len(_summaries) > SUMMARY_CACHE_SIZE:
+            _summaries.popitem(last=False)
+    return summary
+
+
+def is_empty(summary):
+    return not any(summary.values())
+
+
+def context_hash(summary):
+    return hashlib.sha1(json.dumps(summary, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def describe(summary):
+    """Czech description of the summary appended to the prompt"""
+    parts = []
+    if summary['declining']:
+        parts.append(f"V poslední době se uživateli zhoršuje oblast: {', '.join(summary['declining'])}.")
+    if summary['low']:
+        parts.append(f"Nízké hodnocení má v oblasti: {', '.join(summary['low'])}.")
+    if summary['improving']:
+        parts.append(f"Zlepšuje se v oblasti: {', '.join(summary['improving'])}.")
+    if summary['tags']:
+        parts.append(f"V deníku se nedávno věnuje tématům: {', '.join(summary['tags'])}.")
+    return ' '.join(parts)
+
+
+def cached_variants(summary_hash, inspiration_type, today=None):
+    return [row.content for row in InspirationCache.query.filter_by(
+        context_hash=summary_hash,
+        inspiration_type=inspiration_type,
+        created_date=today or date.today()
+    ).order_by(InspirationCache.id).all()]
+
+
+def personalized_content(user_id, inspiration_type, generate, first=False):
+    """Return personalized text, generating only when the shared cache is short of variants
+
+    generate(inspiration_type, context) is called at most once. With first=True
+    the first cached variant is returned (stable daily inspiration), otherwise
+    a random one once VARIANTS_PER_CONTEXT texts exist for today.
+    Returns None when there is no data to personalize on or generation failed,
+    so failures are never cached for other users.
+    """
+    summary = get_summary(user_id)
+    if is_empty(summary):
+        return None
+
+    summary_hash = context_hash(summary)
+    variants = cached_variants(summary_hash, inspiration_type)
+    if variants and (first or len(variants) >= VARIANTS_PER_CONTEXT):
+        return variants[0] if first else random.choice(variants)
+
+    try:
+        content = generate(inspiration_type, describe(summary))
+    except Exception as e:
+        print(f"Error generating personalized inspiration: {e}")
+        return None
+    db.session.add(InspirationCache(
+        context_hash=summary_hash,
+        inspiration_type=inspiration_type,
+        created_date=date.today(),
+        content=content
+    ))
+    return content
@@ -1,14 +1,33 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.models.user import db, WellnessCategory, WellnessEntry
+from src.data_versions import conditional_on, current_versions
+from src.single_flight import single_flight
+from src.projection import Projection, ProjectionError
+from src import archive
 from datetime import datetime, date
 import json
 
 wellness_bp = Blueprint('wellness', __name__)
 
+ENTRY_PROJECTION = Projection(
+    columns={
+        'id': WellnessEntry.id,
+        'category_id': WellnessEntry.category_id,
+        'score': WellnessEntry.score,
+        'note': WellnessEntry.note,
+        'entry_date': WellnessEntry.entry_date,
+        'created_at': WellnessEntry.created_at,
+        'updated_at': WellnessEntry.updated_at,
+    },
+    summary=['id', 'category_id', 'score', 'entry_date'],
+    text_fields=['note']
+)
+
 # Wellness Categories Routes
 @wellness_bp.route('/categories', methods=['GET'])
 @jwt_required()
+@conditional_on('wellness')
 def get_categories():
     """Get all wellness categories for current user"""
     current_user_id = get_jwt_identity()
@@ -99,6 +118,7 @@ def delete_category(category_id):
 # Wellness Entries Routes
 @wellness_bp.route('/entries', methods=['GET'])
 @jwt_required()
+@conditional_on('wellness')
 def get_entries():
     """Get wellness entries with optional filtering"""
     current_user_id = get_jwt_identity()
@@ -108,9 +128,15 @@ def get_entries():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     limit = request.args.get('limit', type=int, default=100)
+
+    try:
+        fields = ENTRY_PROJECTION.requested()
+    except ProjectionError as e:
+        return jsonify({'error': str(e)}), 400
     
     # Build query
     query = WellnessEntry.query.filter_by(user_id=current_user_id)
+    start_date_obj = end_date_obj = None
     
     if category_id:
         query = query.filter_by(category_id=category_id)
@@ -129,7 +155,23 @@ def get_entries():
         except ValueError:
             return jsonify({'error': 'Invalid end_date format. Use YYYY-MM-DD'}), 400
     
-    entries = query.order_by(WellnessEntry.entry_date.desc()).limit(limit).all()
+    query = query.order_by(WellnessEntry.entry_date.desc()).limit(limit)
+
+    # Entries older than the archive horizon live in the cold tier
+    archived = archive.read(
+        current_user_id, 'wellness', start_date_obj, end_date_obj,
+        match={'category_id': category_id} if category_id else None, limit=limit
+    )
+    if archived:
+        return jsonify(archive.with_archive(
+            ENTRY_PROJECTION, query, fields, archived, 'entry_date', limit,
+            lambda entries: [entry.to_dict() for entry in entries]
+        ))
+
+    if fields:
+        return jsonify(ENTRY_PROJECTION.fetch(query, fields))
+
+    entries = query.all()
     
     return jsonify([entry.to_dict() for entry in entries])
 
@@ -182,6 +224,10 @@ def create_entry():
         existing_entry.updated_at = datetime.utcnow()
         db.session.commit()
         return jsonify(existing_entry.to_dict())
+    elif archive.read(current_user_id, 'wellness', entry_date, entry_date,
+                      match={'category_id': data['category_id']}, limit=1):
+        # The unique index only covers the hot table, a second row would show up twice
+        return jsonify({'error': 'The entry for this date is archived and can no longer be changed'}), 409
     else:
         # Create new entry
         entry = WellnessEntry(
@@ -247,6 +293,7 @@ def delete_entry(entry_id):
 
 @wellness_bp.route('/entries/today', methods=['GET'])
 @jwt_required()
+@conditional_on('wellness')
 def get_today_entries():
     """Get today's wellness entries for all categories"""
     current_user_id = get_jwt_identity()
@@ -278,52 +325,68 @@ def get_today_entries():
     
     return jsonify(result)
 
-@wellness_bp.route('/stats', methods=['GET'])
-@jwt_required()
-def get_wellness_stats():
-    """Get wellness statistics for charts and progress tracking"""
-    current_user_id = get_jwt_identity()
-    
-    # Get query parameters
-    days = request.args.get('days', type=int, default=30)
-    category_id = request.args.get('category_id', type=int)
-    
+def compute_wellness_stats(user_id, days, category_id=None, include_notes=True):
+    """Per-category entries, averages and trends of the last days"""
     # Calculate date range
     end_date = date.today()
     start_date = date.fromordinal(end_date.toordinal() - days)
     
-    # Build query
-    query = WellnessEntry.query.filter(
-        WellnessEntry.user_id == current_user_id,
+    # Build query, selecting only the columns the response needs
+    columns = [
+        WellnessEntry.category_id,
+        WellnessCategory.name,
+        WellnessEntry.entry_date,
+        WellnessEntry.score,
+    ]
+    if include_notes:
+        columns.append(WellnessEntry.note)
+
+    query = db.session.query(*columns).join(
+        WellnessCategory, WellnessCategory.id == WellnessEntry.category_id
+    ).filter(
+        WellnessEntry.user_id == user_id,
         WellnessEntry.entry_date >= start_date,
         WellnessEntry.entry_date <= end_date
     )
     
     if category_id:
-        query = query.filter_by(category_id=category_id)
+        query = query.filter(WellnessEntry.category_id == category_id)
     
-    entries = query.order_by(WellnessEntry.entry_date).all()
+    rows = [dict(row._mapping) for row in query.all()]
+
+    # Ranges reaching past the archive horizon include the cold tier
+    archived = archive.read(
+        user_id, 'wellness', start_date, end_date,
+        match={'category_id': category_id} if category_id else None
+    )
+    if archived:
+        names = dict(db.session.query(WellnessCategory.id, WellnessCategory.name).filter_by(user_id=user_id))
+        rows.extend(
+            dict(row, name=names[row['category_id']]) for row in archived if row['category_id'] in names
+        )
+    rows.sort(key=lambda row: row['entry_date'])
     
     # Group entries by category and date
     stats = {}
-    for entry in entries:
-        cat_id = entry.category_id
-        entry_date = entry.entry_date.isoformat()
+    for row in rows:
+        cat_id = row['category_id']
         
         if cat_id not in stats:
             stats[cat_id] = {
                 'category_id': cat_id,
-                'category_name': entry.category.name,
+                'category_name': row['name'],
                 'entries': [],
                 'average_score': 0,
                 'trend': 'stable'
             }
         
-        stats[cat_id]['entries'].append({
-            'date': entry_date,
-            'score': entry.score,
-            'note': entry.note
-        })
+        point = {
+            'date': row['entry_date'].isoformat(),
+            'score': row['score']
+        }
+        if include_notes:
+            point['note'] = row['note']
+        stats[cat_id]['entries'].append(point)
     
     # Calculate averages and trends
     for cat_id, cat_stats in stats.items():
@@ -344,5 +407,25 @@ def get_wellness_stats():
                 else:
                     cat_stats['trend'] = 'stable'
     
-    return jsonify(list(stats.values()))
+    return list(stats.values())
+
+@wellness_bp.route('/stats', methods=['GET'])
+@jwt_required()
+@conditional_on('wellness')
+def get_wellness_stats():
+    """Get wellness statistics for charts and progress tracking"""
+    current_user_id = get_jwt_identity()
+    
+    # Get query parameters
+    days = request.args.get('days', type=int, default=30)
+    category_id = request.args.get('category_id', type=int)
+    # Charts only need scores, view=summary leaves the notes in the database
+    include_notes = request.args.get('view') != 'summary'
+    
+    # Concurrent identical requests (double-mounted charts, several tabs) share one computation
+    version, = current_versions(current_user_id, ['wellness'])
+    key = ('wellness-stats', int(current_user_id), version, request.full_path)
+    return jsonify(single_flight(
+        key, lambda: compute_wellness_stats(current_user_id, days, category_id, include_notes)
+    ))
 